@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
 
 
 class AnalysisConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'analysis'
+
+    def ready(self):
+        from . import instrumentation, jobs, retention, signals  # noqa: F401
+        connection_created.connect(instrumentation.install, dispatch_uid='analysis-track-sql')
+        request_started.connect(jobs.resume_on_first_request, dispatch_uid='analysis-resume-jobs')
+        request_started.connect(retention.start_on_first_request, dispatch_uid='analysis-start-pruner')
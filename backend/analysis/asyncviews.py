@@ -0,0 +1,168 @@
+"""Async twins of the upload, history and download views, served under /async/.
+
+Under an ASGI server (``uvicorn api.asgi:application``) these run on the
+event loop: authentication, version checks and cache hits use the async
+cache and ORM, and the blocking work is handed off. Parsing, saving and
+building history pages run on the bounded thread pool of
+``workers.offload`` (ANALYSIS_ASYNC_WORKERS threads), and missing PDF
+reports are built on the export process pool. A slow upload therefore
+holds no thread while its body arrives, only while it is analysed, and
+uploads beyond the pool size wait in its queue instead of taking threads.
+
+Responses match the sync views, which keep working under WSGI and ASGI.
+The progress streams (``jobs/<id>/events/``, ``download/<id>/events/``) have
+no sync twin; under WSGI their events arrive all at once at the end.
+"""
+import asyncio
+import os
+from functools import wraps
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import JSONRenderer
+
+from authentication.backends import CachedTokenAuthentication
+
+from . import events, historycache, reports, versions
+from .instrumentation import span
+from .models import Record, UploadJob
+from .views import handle_upload, history_content, history_params, history_validators
+from .workers import get_executor, offload
+
+
+def _json(data, status_code=status.HTTP_200_OK, headers=None):
+    return HttpResponse(JSONRenderer().render(data), status=status_code,
+                        content_type='application/json', headers=headers)
+
+
+def _event_stream(stream):
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Don't let nginx hold the events back
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _token_required(view):
+    # IsAuthenticated + token authentication, answered like DRF does
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        authenticator = CachedTokenAuthentication()
+        try:
+            result = await authenticator.aauthenticate(request)
+        except AuthenticationFailed as e:
+            result, detail = None, e.detail
+        else:
+            detail = "Authentication credentials were not provided."
+        if result is None:
+            return _json({"detail": detail}, status.HTTP_401_UNAUTHORIZED,
+                         {'WWW-Authenticate': authenticator.authenticate_header(request)})
+        request.user, request.auth = result
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+@csrf_exempt
+@require_POST
+@_token_required
+async def upload(request):
+    # Same as POST /upload/; the body is already spooled, the analysis runs in the pool
+    data, status_code, headers = await offload(handle_upload, request, request.user)
+    return _json(data, status_code, headers)
+
+
+@require_GET
+@_token_required
+async def record(request):
+    with historycache.latency.time(outcome='error') as timing:
+        return await _history_response(request, timing)
+
+
+async def _history_response(request, timing):
+    user = request.user
+
+    # 1. Page size, position and projection from the query string
+    try:
+        params = history_params(request.GET)
+    except ValueError as e:
+        return _json({"error": str(e)}, status.HTTP_400_BAD_REQUEST)
+
+    # 2. Unchanged since the client's copy? One async query for the version row
+    with span('version'):
+        version, updated_at, horizon = await versions.acurrent(user)
+    page_key, headers, not_modified = history_validators(request, user, version, updated_at, params)
+    if not_modified:
+        timing['outcome'] = 'not_modified'
+        return HttpResponseNotModified(headers=headers)
+
+    # 3. Rendered before for this version? Serve the bytes as they are
+    with span('cache_lookup'):
+        content = await historycache.aget(user.id, version, page_key)
+    if content is not None:
+        timing['outcome'] = 'hit'
+        return HttpResponse(content, content_type='application/json', headers=headers)
+
+    # 4-5. Query, render and cache off the event loop
+    try:
+        content = await offload(history_content, user, version, horizon, page_key, params)
+    except ValueError as e:
+        return _json({"error": str(e)}, status.HTTP_400_BAD_REQUEST)
+    timing['outcome'] = 'miss'
+    return HttpResponse(content, content_type='application/json', headers=headers)
+
+
+@require_GET
+@_token_required
+async def download_record(request, record_id):
+    # Same as GET /download/<id>/; a report that was not prebuilt is built on the export pool
+    theme = request.GET.get('theme', reports.DEFAULT_THEME)
+    record = await (Record.objects.only('id', 'version', 'created_at')
+                    .filter(pk=record_id, user=request.user).afirst())
+    if record is None:
+        return _json({"detail": "No Record matches the given query."}, status.HTTP_404_NOT_FOUND)
+    if theme not in reports.THEMES:
+        return _json({"error": f"theme must be one of: {', '.join(reports.THEMES)}"},
+                     status.HTTP_400_BAD_REQUEST)
+
+    path = reports.report_path(record, request.user.email, theme)
+    if not os.path.exists(path):
+        with span('report'):
+            executor = get_executor('export', settings.ANALYSIS_EXPORT_WORKERS)
+            path = await asyncio.wrap_future(
+                executor.submit(reports.build_report, record.id, request.user.email, theme),
+            )
+        if path is None:
+            return _json({"detail": "No Record matches the given query."}, status.HTTP_404_NOT_FOUND)
+    return FileResponse(open(path, 'rb'), as_attachment=True, content_type='application/pdf',
+                        filename=reports.report_filename(record.created_at.isoformat()))
+
+
+@require_GET
+@_token_required
+async def job_events(request, job_id):
+    # Progress of POST /upload/?async=1 until the result, instead of polling /jobs/<id>/
+    if not await UploadJob.objects.filter(pk=job_id, user=request.user).aexists():
+        return _json({"detail": "No UploadJob matches the given query."}, status.HTTP_404_NOT_FOUND)
+    return _event_stream(events.job_stream(job_id, request.user))
+
+
+@require_GET
+@_token_required
+async def report_events(request, record_id):
+    # Builds the report if needed while reporting progress; ``done`` has the download URL
+    theme = request.GET.get('theme', reports.DEFAULT_THEME)
+    record = await (Record.objects.only('id', 'version', 'created_at')
+                    .filter(pk=record_id, user=request.user).afirst())
+    if record is None:
+        return _json({"detail": "No Record matches the given query."}, status.HTTP_404_NOT_FOUND)
+    if theme not in reports.THEMES:
+        return _json({"error": f"theme must be one of: {', '.join(reports.THEMES)}"},
+                     status.HTTP_400_BAD_REQUEST)
+
+    url = f"{reverse('download-record', args=[record.id])}?theme={theme}"
+    return _event_stream(events.report_stream(record, request.user.email, theme, url))
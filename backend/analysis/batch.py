@@ -0,0 +1,113 @@
+"""Analysis of ZIP/tar archives holding many equipment CSVs.
+
+Members are read straight out of the archive, never extracted to disk: each
+pool worker reopens the archive and streams its member through the chunked
+parser. ZIP and plain tar members are random access; in a compressed tar a
+worker has to decompress up to its member's offset.
+"""
+import os
+import tarfile
+import tempfile
+import zipfile
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from . import datasets
+from .ingest import EquipmentStats, analyse_csv
+from .workers import get_executor
+
+
+class ArchiveError(ValueError):
+    pass
+
+
+def _is_csv(name):
+    base = os.path.basename(name)
+    return name.lower().endswith('.csv') and not base.startswith('.') and '__MACOSX/' not in name
+
+
+def list_members(path):
+    """Return ``(kind, members)`` for the CSV members of an archive, in archive order."""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            members = [info.filename for info in archive.infolist()
+                       if not info.is_dir() and _is_csv(info.filename)]
+        return 'zip', members
+
+    if tarfile.is_tarfile(path):
+        with tarfile.open(path) as archive:
+            members = [info for info in archive.getmembers() if info.isfile() and _is_csv(info.name)]
+        return 'tar', members
+
+    raise ArchiveError("Upload a .zip or .tar archive of CSV files")
+
+
+def member_name(member):
+    return member.name if isinstance(member, tarfile.TarInfo) else member
+
+
+@contextmanager
+def open_member(path, kind, member):
+    if kind == 'zip':
+        with zipfile.ZipFile(path) as archive, archive.open(member) as f:
+            yield f
+    else:
+        with tarfile.open(path) as archive, archive.extractfile(member) as f:
+            yield f
+
+
+def analyse_member(path, kind, member, dataset=None):
+    """Process-pool task: returns ``(stats, error)`` for one archive member."""
+    try:
+        with open_member(path, kind, member) as f:
+            return analyse_csv(f, dataset=dataset), None
+    except Exception as e:
+        return None, str(e)
+
+
+@contextmanager
+def archive_path(file_obj):
+    """Yield a filesystem path for the uploaded archive so workers can reopen it."""
+    if hasattr(file_obj, 'temporary_file_path'):
+        yield file_obj.temporary_file_path()
+        return
+
+    fd, path = tempfile.mkstemp(suffix='.archive', dir=settings.FILE_UPLOAD_TEMP_DIR)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in file_obj.chunks():
+                f.write(chunk)
+        yield path
+    finally:
+        os.remove(path)
+
+
+def analyse_archive(file_obj, staging):
+    """Analyse every CSV in an uploaded archive across the process pool.
+
+    Returns ``(files, combined)``: one ``(name, stats, error, dataset)`` per
+    member in archive order, and the merged statistics of every member that
+    parsed. Each member's columns go to its own staged dataset, entered on the
+    ``staging`` ExitStack so they live until the caller has attached them.
+    """
+    with archive_path(file_obj) as path:
+        kind, members = list_members(path)
+        if not members:
+            raise ArchiveError("The archive contains no CSV files")
+        if len(members) > settings.ANALYSIS_BATCH_MAX_FILES:
+            raise ArchiveError(f"At most {settings.ANALYSIS_BATCH_MAX_FILES} CSV files per archive")
+
+        staged = [staging.enter_context(datasets.stage()) for _ in members]
+        executor = get_executor('parse', settings.ANALYSIS_PARSE_WORKERS)
+        outcomes = list(executor.map(
+            analyse_member, [path] * len(members), [kind] * len(members), members, staged,
+        ))
+
+    files = []
+    combined = EquipmentStats()
+    for member, dataset, (stats, error) in zip(members, staged, outcomes):
+        files.append((member_name(member), stats, error, dataset))
+        if stats is not None:
+            combined.merge(stats)
+    return files, combined
@@ -0,0 +1,293 @@
+"""Columnar copies of parsed uploads, memory-mapped for re-analysis.
+
+Layout under ANALYSIS_DATASET_DIR::
+
+    <record_id>/meta.json           {"rows": n, "parts": [{"name", "rows", "labels"}, ...]}
+    <record_id>/<part>.<column>.f8  little-endian float64, one file per numeric column
+    <record_id>/<part>.type.i4      int32 codes into the part's "labels" (-1 = missing)
+    cache/<digest>/                 hard links to a dataset, for result-cache hits
+    staging/<uuid>/                 datasets still being written
+
+A dataset is a list of immutable parts: the chunked parser writes one part,
+each parallel byte range or archive member writes its own, and appends add
+new parts. Part files are never modified once written, so datasets can
+share them through hard links.
+"""
+import json
+import logging
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from .ingest import STAT_COLUMNS, TYPE_COLUMN, EquipmentStats, _native
+from .models import Record, ResultCache
+
+logger = logging.getLogger(__name__)
+
+META_FILE = 'meta.json'
+
+
+def enabled():
+    return settings.ANALYSIS_PERSIST_DATASETS
+
+
+def _root(*parts):
+    return os.path.join(settings.ANALYSIS_DATASET_DIR, *parts)
+
+
+def record_dir(record_id):
+    return _root(str(record_id))
+
+
+def cache_dir(digest):
+    return _root('cache', digest)
+
+
+class PartWriter:
+    """Appends parsed chunks to the column files of one part."""
+
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        self.rows = 0
+        # label -> code; insertion order is code order
+        self.labels = {}
+        self._files = {column: open(self._path(f'{column}.f8'), 'wb') for column in STAT_COLUMNS}
+        self._files[TYPE_COLUMN] = open(self._path('type.i4'), 'wb')
+
+    def _path(self, suffix):
+        return os.path.join(self.directory, f'{self.name}.{suffix}')
+
+    def write(self, chunk):
+        for column in STAT_COLUMNS:
+            chunk[column].to_numpy(dtype='<f8', na_value=np.nan).tofile(self._files[column])
+        self._codes(chunk[TYPE_COLUMN]).tofile(self._files[TYPE_COLUMN])
+        self.rows += len(chunk)
+
+    def _codes(self, types):
+        if not isinstance(types.dtype, pd.CategoricalDtype):
+            types = types.astype('category')
+        # Chunk category codes -> part codes; the trailing -1 maps missing values
+        lookup = [self.labels.setdefault(_native(label), len(self.labels)) for label in types.cat.categories]
+        lookup = np.array(lookup + [-1], dtype='<i4')
+        return lookup[types.cat.codes.to_numpy()]
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        with open(self._path('part.json'), 'w') as f:
+            json.dump({"name": self.name, "rows": self.rows, "labels": list(self.labels)}, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class StagedDataset:
+    """A dataset being written; picklable so pool workers can add parts to it."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def part(self, index):
+        return PartWriter(self.path, f'p{index:05d}')
+
+    def part_meta(self):
+        names = sorted(name for name in os.listdir(self.path) if name.endswith('.part.json'))
+        metas = []
+        for name in names:
+            with open(os.path.join(self.path, name)) as f:
+                metas.append(json.load(f))
+        return metas
+
+
+@contextmanager
+def stage():
+    """Yield a StagedDataset (None when persistence is off); removed unless committed."""
+    if not enabled():
+        yield None
+        return
+
+    path = _root('staging', uuid.uuid4().hex)
+    os.makedirs(path)
+    try:
+        yield StagedDataset(path)
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _write_meta(directory, parts):
+    meta = {"rows": sum(part['rows'] for part in parts), "parts": parts}
+    tmp = os.path.join(directory, META_FILE + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(directory, META_FILE))
+
+
+def commit(staged, record_id):
+    """Move a finished staged dataset into place for ``record_id``."""
+    parts = staged.part_meta()
+    for part in parts:
+        os.remove(os.path.join(staged.path, f"{part['name']}.part.json"))
+    _write_meta(staged.path, parts)
+    discard(record_id)  # leftovers of a record id from a reset database
+    os.replace(staged.path, record_dir(record_id))
+
+
+def _link_tree(source, target):
+    # Hard-link every file (copy where links are unsupported), then publish atomically
+    tmp = f'{target}.{uuid.uuid4().hex}.tmp'
+    os.makedirs(tmp)
+    try:
+        for name in os.listdir(source):
+            try:
+                os.link(os.path.join(source, name), os.path.join(tmp, name))
+            except OSError:
+                shutil.copy2(os.path.join(source, name), os.path.join(tmp, name))
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(tmp, target)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+def attach(staged, record_id, digest=None):
+    """Tie a dataset to a freshly created Record.
+
+    If the upload was parsed, ``staged`` holds its columns and a copy is shared
+    with the result cache under ``digest``, if the cache kept an entry for it. On a cache hit nothing was parsed
+    and the cached dataset is linked in instead. Failures are logged, not
+    raised: the Record itself is already saved.
+    """
+    if staged is None:
+        return
+    try:
+        if staged.part_meta():
+            commit(staged, record_id)
+            if digest and not os.path.exists(cache_dir(digest)) and _cached(digest):
+                os.makedirs(_root('cache'), exist_ok=True)
+                _link_tree(record_dir(record_id), cache_dir(digest))
+                # Evicted meanwhile? Only the entry's post_delete removes the copy
+                if not _cached(digest):
+                    discard_cached(digest)
+        elif digest:
+            link_cached(digest, record_id)
+        # Pruned meanwhile? Its post_delete clean-up may have run before the
+        # files were in place, so they would never be removed
+        if not Record.objects.filter(pk=record_id).exists():
+            discard(record_id)
+    except OSError as e:
+        logger.warning("Could not persist dataset for record %s: %s", record_id, e)
+
+
+def extend(staged, record_id):
+    """Add the parts of a staged delta to the dataset of ``record_id``.
+
+    Parts move in under fresh names and only meta.json is rewritten, so files
+    shared with the cache or other records are untouched. If the delta was not
+    staged, the record's dataset no longer matches its Record and is dropped.
+    """
+    dataset = load(record_id)
+    if dataset is None:
+        return
+    if staged is None:
+        discard(record_id)
+        return
+    try:
+        parts = list(dataset.meta['parts'])
+        index = max((int(part['name'][1:]) for part in parts), default=-1) + 1
+        for part in staged.part_meta():
+            name = f'p{index:05d}'
+            for suffix in [f'{column}.f8' for column in STAT_COLUMNS] + ['type.i4']:
+                os.replace(os.path.join(staged.path, f"{part['name']}.{suffix}"),
+                           os.path.join(dataset.directory, f'{name}.{suffix}'))
+            parts.append(dict(part, name=name))
+            index += 1
+        _write_meta(dataset.directory, parts)
+    except OSError as e:
+        logger.warning("Could not extend dataset for record %s: %s", record_id, e)
+        discard(record_id)
+
+
+def link_cached(digest, record_id):
+    """Give ``record_id`` the dataset cached under ``digest``, if there is one."""
+    if os.path.exists(cache_dir(digest)):
+        _link_tree(cache_dir(digest), record_dir(record_id))
+
+
+def discard(record_id):
+    shutil.rmtree(record_dir(record_id), ignore_errors=True)
+
+
+def discard_cached(digest):
+    shutil.rmtree(cache_dir(digest), ignore_errors=True)
+
+
+def _cached(digest):
+    return ResultCache.objects.filter(digest=digest).exists()
+
+
+def purge_cache():
+    """Remove cached datasets whose result cache entry is gone; returns how many."""
+    try:
+        names = os.listdir(_root('cache'))
+    except FileNotFoundError:
+        return 0
+    # Half-linked trees (*.tmp) belong to attach calls still running
+    digests = {name for name in names if not name.endswith('.tmp')}
+    orphans = digests - set(ResultCache.objects.filter(digest__in=digests).values_list('digest', flat=True))
+    for digest in orphans:
+        discard_cached(digest)
+    return len(orphans)
+
+
+class Dataset:
+    """Read-only view of a persisted dataset; columns are memory-mapped, not read."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, META_FILE)) as f:
+            self.meta = json.load(f)
+
+    @property
+    def rows(self):
+        return self.meta['rows']
+
+    def _column(self, part, suffix, dtype):
+        if not part['rows']:
+            return np.empty(0, dtype=dtype)
+        path = os.path.join(self.directory, f"{part['name']}.{suffix}")
+        return np.memmap(path, dtype=dtype, mode='r', shape=(part['rows'],))
+
+    def frames(self):
+        """Yield one DataFrame per part, backed by the memory maps (no copies)."""
+        for part in self.meta['parts']:
+            columns = {column: self._column(part, f'{column}.f8', '<f8') for column in STAT_COLUMNS}
+            codes = self._column(part, 'type.i4', '<i4')
+            columns[TYPE_COLUMN] = pd.Categorical.from_codes(codes, categories=part['labels'])
+            yield pd.DataFrame(columns, copy=False)
+
+
+def load(record_id):
+    """Return the Dataset for ``record_id``, or None if none was persisted."""
+    directory = record_dir(record_id)
+    if not os.path.exists(os.path.join(directory, META_FILE)):
+        return None
+    return Dataset(directory)
+
+
+def analyse(dataset, types=None):
+    """Aggregate the stored rows again; with ``types``, only rows of those equipment types."""
+    stats = EquipmentStats()
+    for frame in dataset.frames():
+        if types is not None:
+            frame = frame[frame[TYPE_COLUMN].isin(types)]
+        stats.update(frame)
+    return stats
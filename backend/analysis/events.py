@@ -0,0 +1,161 @@
+"""Server-sent event streams of upload job and report build progress.
+
+Each stream is an async generator for a StreamingHttpResponse with
+``text/event-stream``; under an ASGI server it holds no thread while it
+waits. Messages are ``event: <name>`` with a JSON ``data:`` line:
+
+- ``progress``: the state changed (sent once right away, then on change)
+- ``done``:     the final result; the stream ends
+- ``failed``:   ``{"error": ...}``; the stream ends
+
+A stream reads the UploadJob row once, then waits for the changes the
+worker pushes through ``notify`` (at most every ANALYSIS_JOB_PROGRESS_INTERVAL
+seconds). It reads the row again only for the final result, or when nothing
+came for ANALYSIS_EVENTS_KEEPALIVE seconds; then a comment line is sent so
+proxies keep the connection open. Every ``progress`` is a full snapshot: a
+client that reconnects just starts over.
+"""
+import os
+import time
+import uuid
+
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+
+from . import notify, reports
+from .jobs import topic
+from .models import UploadJob
+from .workers import get_executor
+
+KEEPALIVE = b': keepalive\n\n'
+
+JOB_FIELDS = ('status', 'stage', 'bytes_done', 'bytes_total', 'rows_processed', 'error', 'result',
+              'record', 'record__created_at')
+
+
+def encode(event, data):
+    """One SSE message; ``data`` is rendered like the JSON responses."""
+    return b'event: ' + event.encode() + b'\ndata: ' + JSONRenderer().render(data) + b'\n\n'
+
+
+class _Pacer:
+    """Sends a keepalive when nothing else was sent for a while."""
+
+    def __init__(self):
+        self.sent = time.monotonic()
+
+    def message(self, data):
+        self.sent = time.monotonic()
+        return data
+
+    def keepalive(self):
+        if time.monotonic() - self.sent < settings.ANALYSIS_EVENTS_KEEPALIVE:
+            return None
+        return self.message(KEEPALIVE)
+
+
+def _job_progress(job):
+    return {
+        'status': job.status,
+        'stage': job.stage,
+        'progress': job.progress,
+        'bytes_done': job.bytes_done,
+        'bytes_total': job.bytes_total,
+        'rows_processed': job.rows_processed,
+    }
+
+
+def _upload_result(job):
+    # The body POST /upload/ answers with
+    data = dict(job.result)
+    data['id'] = job.record_id
+    data['created_at'] = job.record.created_at if job.record is not None else None
+    return data
+
+
+def _read_job(job_id, user):
+    return (UploadJob.objects.select_related('record').only(*JOB_FIELDS)
+            .filter(pk=job_id, user=user).afirst())
+
+
+async def job_stream(job_id, user):
+    """Events of one upload job until it is done or failed."""
+    pacer = _Pacer()
+    last = None
+    # Subscribed before the first read, so no change falls in between
+    with notify.subscribe(topic(job_id)) as updates:
+        job = await _read_job(job_id, user)
+        while True:
+            if job is None:
+                yield encode('failed', {'error': 'The job no longer exists'})
+                return
+            if job.status == UploadJob.DONE:
+                yield encode('done', _upload_result(job))
+                return
+            if job.status == UploadJob.FAILED:
+                yield encode('failed', {'error': job.error})
+                return
+
+            snapshot = _job_progress(job)
+            if snapshot != last:
+                last = snapshot
+                yield pacer.message(encode('progress', snapshot))
+            else:
+                keepalive = pacer.keepalive()
+                if keepalive:
+                    yield keepalive
+
+            changes = await updates.wait(settings.ANALYSIS_EVENTS_KEEPALIVE)
+            if changes is None or changes.get('status') in (UploadJob.DONE, UploadJob.FAILED):
+                # Quiet for long (maybe run by another process) or finished: the row has it
+                job = await _read_job(job_id, user)
+            else:
+                for name, value in changes.items():
+                    setattr(job, name, value)
+
+
+def _build_report(key, record_id, email, theme):
+    # On the export pool: tell the stream the build has started
+    notify.publish(key, {'status': UploadJob.RUNNING})
+    return reports.build_report(record_id, email, theme)
+
+
+async def report_stream(record, email, theme, url):
+    """Events of building one report on the export pool; ``done`` carries its ``url``."""
+    if os.path.exists(reports.report_path(record, email, theme)):
+        yield encode('done', {'url': url})
+        return
+
+    key = ('report', uuid.uuid4().hex)
+    with notify.subscribe(key) as updates:
+        future = get_executor('export', settings.ANALYSIS_EXPORT_WORKERS).submit(
+            _build_report, key, record.id, email, theme,
+        )
+        future.add_done_callback(lambda f: updates.push({}))
+        pacer = _Pacer()
+        status = UploadJob.QUEUED
+        last = None
+        try:
+            while not future.done():
+                if status != last:
+                    last = status
+                    yield pacer.message(encode('progress', {'status': status}))
+                else:
+                    keepalive = pacer.keepalive()
+                    if keepalive:
+                        yield keepalive
+                changes = await updates.wait(settings.ANALYSIS_EVENTS_KEEPALIVE)
+                status = (changes or {}).get('status', status)
+
+            try:
+                path = future.result()
+            except Exception as e:
+                yield encode('failed', {'error': str(e)})
+                return
+            if path is None:
+                yield encode('failed', {'error': 'The record no longer exists'})
+                return
+            yield encode('done', {'url': url})
+        finally:
+            # The client went away before the build started
+            future.cancel()
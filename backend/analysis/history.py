@@ -0,0 +1,140 @@
+import base64
+from datetime import datetime
+
+from django.db import transaction
+
+from . import datasets, historycache, reports, versions, writer
+from .ingest import EquipmentStats
+from .models import Record, RecordTombstone
+
+# Top-level keys of Record.data that ?fields= can select
+RECORD_FIELDS = ('total_count', 'averages', 'distribution', 'statistics')
+
+
+def create_record(user, data, state=None):
+    """Save a new analysis for ``user``; its report is built in the background.
+
+    Schedule ``retention.schedule`` once the record's dataset is attached, so the
+    pruner never removes a record whose files are still being put in place.
+    """
+    # Committed by the writer together with whatever else is queued, in one
+    # transaction with the version bump, so versions commit in order
+    return writer.execute(_create_record, user, data, state)
+
+
+def _create_record(user, data, state):
+    # We assign it to 'new_record' so we can access its properties
+    new_record = Record.objects.create(user=user, data=data, state=state)
+    transaction.on_commit(lambda: reports.schedule([new_record.id]))
+    return new_record
+
+
+def create_records(user, results):
+    """Save several ``(data, state)`` analyses with a single INSERT (schedule retention after)."""
+    return writer.execute(_create_records, user, results)
+
+
+def _create_records(user, results):
+    # bulk_create sends no save signals, so the version and cache are handled here
+    version = versions.next_version(user.id)
+    new_records = Record.objects.bulk_create(
+        [Record(user=user, data=data, state=state, version=version) for data, state in results]
+    )
+    transaction.on_commit(lambda: historycache.invalidate(user.id))
+    transaction.on_commit(lambda: reports.schedule([record.id for record in new_records]))
+    return new_records
+
+
+def append_to_record(record_id, delta):
+    """Merge the EquipmentStats of newly arrived rows into a saved analysis.
+
+    Only the stored accumulator state is read, so the cost depends on the
+    delta, not on the history. Records saved before states were kept are
+    rebuilt once from their dataset. Returns the updated Record, or None when
+    there is nothing to merge into.
+    """
+    with transaction.atomic():
+        # Lock the row so concurrent appends to one record don't lose rows
+        record = Record.objects.select_for_update().get(pk=record_id)
+        if record.state is not None:
+            stats = EquipmentStats.from_state(record.state)
+        else:
+            dataset = datasets.load(record.id)
+            if dataset is None:
+                return None
+            stats = datasets.analyse(dataset)
+
+        stats.merge(delta)
+        record.data, record.state = stats.result(), stats.state()
+        record.save(update_fields=['data', 'state', 'version'])
+    return record
+
+
+def encode_cursor(created_at, record_id):
+    value = f'{created_at.isoformat()}|{record_id}'
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for anything it did not produce."""
+    try:
+        created_at, record_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(record_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def history_page(user, limit, cursor=None, fields=RECORD_FIELDS):
+    """One page of ``user``'s analyses, newest first, and the cursor of the next.
+
+    Keyset pagination over the (user, created_at, id) index: every page is an
+    index range scan, however long the history. Only the requested keys of
+    ``data`` are read from the database.
+    """
+    records = Record.objects.filter(user=user).order_by('-created_at', '-id')
+    if cursor is not None:
+        created_at, record_id = decode_cursor(cursor)
+        records = records.filter(created_at__lte=created_at).exclude(created_at=created_at, id__gte=record_id)
+
+    rows = list(_values(records, fields)[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+    return _entries(rows, fields), next_cursor
+
+
+def history_changes(user, since, until, limit, fields=RECORD_FIELDS):
+    """Changes to ``user``'s history between two versions, oldest first.
+
+    Returns ``(entries, deleted, next_since, has_more)``: the records written
+    after version ``since`` up to ``until`` (at most about ``limit`` of them),
+    the ids of records deleted in that span, and the version to pass as
+    ``since`` next time.
+    """
+    records = Record.objects.filter(user=user, version__gt=since, version__lte=until).order_by('version', 'id')
+    rows = list(_values(records, fields)[:limit + 1])
+    has_more = False
+    if len(rows) > limit:
+        rows = rows[:limit]
+        # Records written together share a version; never split one across pages
+        rows += _values(records.filter(version=rows[-1]['version'], id__gt=rows[-1]['id']), fields)
+        has_more = rows[-1]['version'] < until
+        until = rows[-1]['version']
+
+    deleted = RecordTombstone.objects.filter(user=user, version__gt=since, version__lte=until)
+    return _entries(rows, fields), list(deleted.values_list('record_id', flat=True)), until, has_more
+
+
+def _values(records, fields):
+    return records.values('id', 'created_at', 'version', *[f'data__{field}' for field in fields])
+
+
+def _entries(rows, fields):
+    entries = []
+    for row in rows:
+        entry = {'id': row['id']}
+        entry.update((field, row[f'data__{field}']) for field in fields)
+        entry['created_at'] = row['created_at']
+        entries.append(entry)
+    return entries
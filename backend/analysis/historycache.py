@@ -0,0 +1,56 @@
+"""Rendered GET /record/ responses, cached per user in Django's cache framework.
+
+Each user has one cache entry holding the rendered pages of their current
+history version. Record signals drop the entry once a change commits, and
+every read also checks the version from the database, so an entry that
+outlived its invalidation (another process's cache, a racing write) is
+never served.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+hits = metrics.counter('analysis_history_cache_hits_total', 'History responses served from the cache.')
+misses = metrics.counter('analysis_history_cache_misses_total', 'History responses that had to be built.')
+latency = metrics.histogram(
+    'analysis_history_request_seconds', 'GET /record/ latency by how it was answered.', ['outcome'],
+)
+
+
+def _cache():
+    return caches[settings.ANALYSIS_HISTORY_CACHE]
+
+
+def _key(user_id):
+    return f'analysis:history:{user_id}'
+
+
+def get(user_id, version, page_key):
+    """The cached response body for this page of ``version``, or None."""
+    return _lookup(_cache().get(_key(user_id)), version, page_key)
+
+
+async def aget(user_id, version, page_key):
+    return _lookup(await _cache().aget(_key(user_id)), version, page_key)
+
+
+def _lookup(entry, version, page_key):
+    content = entry['pages'].get(page_key) if entry and entry['version'] == version else None
+    (misses if content is None else hits).inc()
+    return content
+
+
+def put(user_id, version, page_key, content):
+    key = _key(user_id)
+    entry = _cache().get(key)
+    if not entry or entry['version'] != version:
+        entry = {'version': version, 'pages': {}}
+    if len(entry['pages']) >= settings.ANALYSIS_HISTORY_CACHE_MAX_PAGES:
+        entry['pages'].pop(next(iter(entry['pages'])))
+    entry['pages'][page_key] = content
+    _cache().set(key, entry, settings.ANALYSIS_HISTORY_CACHE_TIMEOUT)
+
+
+def invalidate(user_id):
+    _cache().delete(_key(user_id))
@@ -0,0 +1,347 @@
+import csv
+import io
+import os
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+from pandas._libs.parsers import STR_NA_VALUES
+from django.conf import settings
+
+from .instrumentation import span
+from .statistics import STAT_COLUMNS, TYPE_COLUMN, StatisticsEngine
+from .workers import get_executor
+
+try:
+    import pyarrow
+    from pyarrow import csv as pyarrow_csv
+    FAST_ENGINE = 'pyarrow'
+except ImportError:
+    FAST_ENGINE = 'c'
+
+REQUIRED_COLUMNS = (TYPE_COLUMN,) + STAT_COLUMNS
+
+COLUMN_DTYPES = {
+    TYPE_COLUMN: 'category',
+    'flowrate': 'float64',
+    'pressure': 'float64',
+    'temperature': 'float64',
+}
+
+
+def _native(value):
+    # numpy scalars -> plain python so the result stays JSON serialisable
+    return value.item() if hasattr(value, 'item') else value
+
+
+def _type_counts(types):
+    """(label, count) pairs for one chunk, in order of first appearance."""
+    if not isinstance(types.dtype, pd.CategoricalDtype):
+        for label, count in types.value_counts(sort=False).items():
+            yield _native(label), int(count)
+        return
+
+    # Categories come back sorted; pd.unique gives the codes in appearance order
+    codes = types.cat.codes.to_numpy()
+    counts = np.bincount(codes[codes >= 0], minlength=len(types.cat.categories))
+    labels = types.cat.categories
+    for code in pd.unique(codes).tolist():
+        if code >= 0:
+            yield _native(labels[code]), int(counts[code])
+
+
+class EquipmentStats:
+    """Running accumulators for an equipment CSV, fed one chunk at a time."""
+
+    def __init__(self):
+        self.total_count = 0
+        self.sums = {column: 0.0 for column in STAT_COLUMNS}
+        self.counts = {column: 0 for column in STAT_COLUMNS}
+        # Insertion order = first appearance, which is how value_counts breaks ties
+        self.type_counts = {}
+        self.statistics = StatisticsEngine()
+
+    def update(self, chunk):
+        self.total_count += len(chunk)
+
+        for column in STAT_COLUMNS:
+            values = chunk[column].to_numpy(dtype=np.float64, na_value=np.nan)
+            finite = np.isfinite(values)
+            if not finite.all():
+                # Missing like a blank cell, as in the statistics
+                values = values[finite]
+            self.sums[column] += float(values.sum())
+            self.counts[column] += len(values)
+
+        for label, count in _type_counts(chunk[TYPE_COLUMN]):
+            self.type_counts[label] = self.type_counts.get(label, 0) + count
+
+        self.statistics.update(chunk)
+
+    def merge(self, other):
+        """Fold another partial result into this one (order matters only for ties)."""
+        self.total_count += other.total_count
+        for column in STAT_COLUMNS:
+            self.sums[column] += other.sums[column]
+            self.counts[column] += other.counts[column]
+        for label, count in other.type_counts.items():
+            self.type_counts[label] = self.type_counts.get(label, 0) + count
+        self.statistics.merge(other.statistics)
+        return self
+
+    def state(self):
+        """Everything ``merge`` needs, as JSON; stored with the Record so appends can resume."""
+        return {
+            "total_count": self.total_count,
+            "sums": self.sums,
+            "counts": self.counts,
+            "type_counts": list(self.type_counts.items()),
+            "statistics": self.statistics.state(),
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        stats = cls()
+        stats.total_count = state['total_count']
+        stats.sums = dict(state['sums'])
+        stats.counts = dict(state['counts'])
+        stats.type_counts = {label: count for label, count in state['type_counts']}
+        stats.statistics = StatisticsEngine.from_state(state['statistics'])
+        return stats
+
+    def result(self):
+        averages = {}
+        for column in STAT_COLUMNS:
+            count = self.counts[column]
+            averages[column] = round(self.sums[column] / count, 2) if count else 0
+
+        # Stable sort keeps first-appearance order for equal counts
+        type_counts = sorted(self.type_counts.items(), key=lambda item: -item[1])
+        labels = [label for label, _ in type_counts]
+        return {
+            "total_count": self.total_count,
+            "averages": averages,
+            "distribution": {
+                "labels": labels,
+                "values": [count for _, count in type_counts],
+            },
+            "statistics": self.statistics.result(labels),
+        }
+
+
+def read_header(source):
+    """Return the header row of a seekable CSV source without consuming it."""
+    position = source.tell()
+    line = source.readline()
+    source.seek(position)
+    if isinstance(line, bytes):
+        line = line.decode('utf-8-sig')
+    return next(csv.reader([line]), [])
+
+
+def resolve_columns(header):
+    """Map each required column to its name in ``header``, ignoring case and padding."""
+    found = {}
+    for name in header:
+        key = name.strip().lower()
+        if key in REQUIRED_COLUMNS and key not in found:
+            found[key] = name
+
+    missing = [column for column in REQUIRED_COLUMNS if column not in found]
+    if missing:
+        raise ValueError(f"Missing required column(s): {', '.join(missing)}")
+    return found
+
+
+def _read_options(source):
+    # Only the four columns we use are parsed, straight into their final dtypes
+    columns = resolve_columns(read_header(source))
+    return {
+        'usecols': list(columns.values()),
+        'dtype': {name: COLUMN_DTYPES[column] for column, name in columns.items()},
+    }
+
+
+def _read_arrow(source, options):
+    # pandas' pyarrow engine lets pyarrow infer every column and converts after,
+    # so numeric equipment types came back as numbers ("01" -> 1). Typed up
+    # front, they stay the text the C engine reads.
+    column_types = {
+        name: pyarrow.string() if dtype == 'category' else pyarrow.from_numpy_dtype(dtype)
+        for name, dtype in options['dtype'].items()
+    }
+    table = pyarrow_csv.read_csv(source, convert_options=pyarrow_csv.ConvertOptions(
+        include_columns=options['usecols'], column_types=column_types,
+        null_values=sorted(STR_NA_VALUES), strings_can_be_null=True,
+    ))
+    frame = table.to_pandas()
+    for name, dtype in options['dtype'].items():
+        if dtype == 'category':
+            frame[name] = frame[name].astype('category')
+    return frame
+
+
+def _normalise(frame):
+    frame.columns = frame.columns.str.strip().str.lower()
+    return frame
+
+
+def read_chunks(source, chunk_rows=None):
+    """Yield the CSV as typed DataFrames of at most ``chunk_rows`` rows."""
+    chunk_rows = chunk_rows or settings.ANALYSIS_CSV_CHUNK_ROWS
+    options = _read_options(source)
+    for chunk in pd.read_csv(source, chunksize=chunk_rows, **options):
+        yield _normalise(chunk)
+
+
+def read_frame(source, engine=FAST_ENGINE):
+    """Parse a bounded CSV block in one go, with pyarrow when it is installed."""
+    options = _read_options(source)
+    if engine == 'pyarrow':
+        return _normalise(_read_arrow(source, options))
+    return _normalise(pd.read_csv(source, engine=engine, **options))
+
+
+def _part_writer(dataset, part):
+    # The parsed columns go to part `part` of a staged dataset, if one is given
+    return dataset.part(part) if dataset is not None else nullcontext()
+
+
+def analyse_csv(source, chunk_rows=None, progress=None, dataset=None, part=0):
+    """Stream ``source`` through the accumulators; memory is bounded by the chunk size.
+
+    ``progress(rows, bytes_read)`` is called after every chunk if given.
+    """
+    stats = EquipmentStats()
+    with _part_writer(dataset, part) as writer:
+        for chunk in read_chunks(source, chunk_rows):
+            stats.update(chunk)
+            if writer is not None:
+                writer.write(chunk)
+            if progress is not None:
+                progress(stats.total_count, source.tell())
+    return stats
+
+
+def analyse_block(source, dataset=None, part=0):
+    """Aggregate a CSV that is already bounded in size with a single fast parse."""
+    stats = EquipmentStats()
+    with span('parse'):
+        frame = read_frame(source)
+    with span('compute'):
+        stats.update(frame)
+    with span('dataset'), _part_writer(dataset, part) as writer:
+        if writer is not None:
+            writer.write(frame)
+    return stats
+
+
+def split_ranges(path, parts, max_range_bytes):
+    """Split the data section of a CSV file into newline-aligned byte ranges.
+
+    Returns ``(header_end, ranges)``. Rows must not contain quoted newlines,
+    which holds for the flat equipment exports this app ingests.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.readline()
+        header_end = f.tell()
+
+        data_size = size - header_end
+        if data_size <= 0:
+            return header_end, []
+
+        count = max(parts, -(-data_size // max_range_bytes))
+        boundaries = [header_end]
+        for i in range(1, count):
+            target = header_end + data_size * i // count
+            if target <= boundaries[-1]:
+                continue
+            f.seek(target - 1)
+            f.readline()  # runs to the end of the row containing `target`
+            if boundaries[-1] < f.tell() < size:
+                boundaries.append(f.tell())
+        boundaries.append(size)
+
+    return header_end, list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def analyse_range(path, header, start, end, dataset=None, part=0):
+    """Process-pool task: aggregate the rows between two byte offsets.
+
+    The header row is copied in front of the slice so the block parses like a
+    standalone CSV.
+    """
+    buffer = bytearray(len(header) + end - start)
+    buffer[:len(header)] = header
+    with open(path, 'rb') as f:
+        f.seek(start)
+        f.readinto(memoryview(buffer)[len(header):])
+    return analyse_block(io.BytesIO(buffer), dataset, part)
+
+
+def analyse_csv_parallel(path, workers=None, dataset=None, progress=None):
+    """Parse one CSV file across a process pool and merge the partial results.
+
+    ``progress(rows, bytes_read)`` is called as each byte range is merged.
+    """
+    workers = workers or settings.ANALYSIS_PARSE_WORKERS
+    header_end, ranges = split_ranges(path, workers, settings.ANALYSIS_PARALLEL_RANGE_BYTES)
+    with open(path, 'rb') as f:
+        header = f.read(header_end)
+    resolve_columns(read_header(io.BytesIO(header)))  # fail fast, before fanning out
+
+    stats = EquipmentStats()
+    if not ranges:
+        return stats
+
+    executor = get_executor('parse', workers)
+    # map() yields in submission order, so type first-appearance order is kept
+    partials = executor.map(
+        analyse_range,
+        [path] * len(ranges),
+        [header] * len(ranges),
+        [start for start, _ in ranges],
+        [end for _, end in ranges],
+        [dataset] * len(ranges),
+        range(len(ranges)),
+    )
+    for partial, (_, end) in zip(partials, ranges):
+        stats.merge(partial)
+        if progress is not None:
+            progress(stats.total_count, end)
+    return stats
+
+
+def analyse_upload(file_obj, dataset=None):
+    """Pick the ingestion mode for an uploaded file.
+
+    Uploads Django kept in memory are already bounded by
+    FILE_UPLOAD_MAX_MEMORY_SIZE and get one fast parse. Large uploads spooled
+    to disk are parsed in parallel byte ranges, and the rest are streamed in
+    chunks in this process. Parsed columns are written to ``dataset`` if given.
+    """
+    if not hasattr(file_obj, 'temporary_file_path'):
+        return analyse_block(file_obj, dataset)
+    return analyse_file(file_obj.temporary_file_path(), dataset)
+
+
+def analyse_file(path, dataset=None, progress=None):
+    """``analyse_upload`` for a CSV already on disk, e.g. a queued upload job.
+
+    Files small enough to have been uploaded in memory get the one fast parse,
+    and the rest are parsed like spooled uploads. ``progress(rows, bytes_read)``
+    is called as the parse advances.
+    """
+    size = os.path.getsize(path)
+    workers = settings.ANALYSIS_PARSE_WORKERS
+    if workers > 1 and size >= settings.ANALYSIS_PARALLEL_MIN_BYTES:
+        return analyse_csv_parallel(path, workers, dataset, progress)
+
+    with open(path, 'rb') as f:
+        if size > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            return analyse_csv(f, progress=progress, dataset=dataset)
+        stats = analyse_block(f, dataset)
+    if progress is not None:
+        progress(stats.total_count, size)
+    return stats
@@ -0,0 +1,130 @@
+"""Per-request timing, SQL accounting and phase spans, exported through metrics.
+
+RequestMetricsMiddleware times every request, under WSGI or ASGI, labelled
+by the resolved URL name. Every database connection carries an
+execute_wrapper (installed when the connection is created) that counts the
+SQL of the request in the current context, so queries run by async ORM
+calls and by work offloaded with ``offload`` are counted too.
+
+Inside a request, ``span(phase)`` times one phase of the view; outside one
+(the pruner thread) the view label is 'background'. Spans timed in pool
+worker processes stay in those processes and are not exported (see
+metrics_view). For streaming responses only the time until the response is
+returned is counted.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from . import metrics
+
+_current = contextvars.ContextVar('analysis_request_stats', default=None)
+
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250, 1000)
+
+request_seconds = metrics.histogram(
+    'analysis_request_seconds', 'Time to produce a response, by view.', ('view', 'method', 'status'),
+)
+request_queries = metrics.histogram(
+    'analysis_request_queries', 'SQL queries per request, by view.', ('view',), buckets=QUERY_BUCKETS,
+)
+request_sql_seconds = metrics.histogram(
+    'analysis_request_sql_seconds', 'Time spent in SQL per request, by view.', ('view',),
+)
+phase_seconds = metrics.histogram(
+    'analysis_phase_seconds', 'Time spent in one phase of a view.', ('view', 'phase'),
+)
+phase_queries = metrics.histogram(
+    'analysis_phase_queries', 'SQL queries run in one phase of a view.', ('view', 'phase'), buckets=QUERY_BUCKETS,
+)
+
+
+class _RequestStats:
+    def __init__(self, request):
+        self.request = request
+        self.queries = 0
+        self.sql_seconds = 0.0
+
+    @property
+    def view(self):
+        match = getattr(self.request, 'resolver_match', None)
+        return (match.url_name or match.view_name) if match is not None else None
+
+
+def track_sql(execute, sql, params, many, context):
+    """execute_wrapper present on every connection; counts for the current request."""
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.sql_seconds += time.perf_counter() - start
+        stats.queries += 1
+
+
+def install(sender, connection, **kwargs):
+    # Connected to connection_created
+    if track_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(track_sql)
+
+
+@contextmanager
+def span(phase):
+    """Time the ``with`` block as ``phase`` of the current view."""
+    stats = _current.get()
+    queries = stats.queries if stats is not None else 0
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        view = (stats.view or 'unknown') if stats is not None else 'background'
+        phase_seconds.observe(time.perf_counter() - start, view=view, phase=phase)
+        if stats is not None:
+            phase_queries.observe(stats.queries - queries, view=view, phase=phase)
+
+
+class RequestMetricsMiddleware:
+    """Outermost middleware: total time, SQL count and SQL time per request."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = _RequestStats(request)
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._observe(stats, request, response, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        stats = _RequestStats(request)
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._observe(stats, request, response, time.perf_counter() - start)
+        return response
+
+    @staticmethod
+    def _observe(stats, request, response, seconds):
+        view = stats.view or 'unmatched'
+        request_seconds.observe(seconds, view=view, method=request.method, status=response.status_code)
+        request_queries.observe(stats.queries, view=view)
+        request_sql_seconds.observe(stats.sql_seconds, view=view)
@@ -0,0 +1,170 @@
+"""Asynchronous upload analysis on a local process pool.
+
+Job state lives in the UploadJob table and the upload itself is kept in
+ANALYSIS_JOB_DIR until a worker has processed it, so queued and interrupted
+jobs are picked up again after a restart.
+
+Workers only analyse and save. Retention is scheduled from the web process
+once a job's future completes, so the pruner thread never starts in a
+worker.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.db import transaction
+from django.utils import timezone
+
+from . import datasets, notify, resultcache, retention
+from .history import create_record
+from .ingest import analyse_file
+from .models import UploadJob
+from .workers import get_executor
+
+logger = logging.getLogger(__name__)
+
+
+def _job_path(job_id):
+    return os.path.join(settings.ANALYSIS_JOB_DIR, f'{job_id}.csv')
+
+
+def enqueue(user, file_obj, digest='', cached=None):
+    """Create a job for an uploaded file and hand it to the worker pool.
+
+    With a ``cached`` ``(result, state)`` there is nothing to analyse: the
+    Record is written straight away and the job is returned already done.
+    """
+    if cached is not None:
+        cached_result, cached_state = cached
+        record = create_record(user, cached_result, cached_state)
+        with datasets.stage() as dataset:
+            datasets.attach(dataset, record.id, digest)
+        job = UploadJob.objects.create(
+            user=user, status=UploadJob.DONE, digest=digest, bytes_total=file_obj.size,
+            bytes_done=file_obj.size, rows_processed=cached_result['total_count'],
+            result=cached_result, record=record,
+        )
+        transaction.on_commit(retention.schedule)
+        return job
+
+    job = UploadJob(user=user, digest=digest, bytes_total=file_obj.size)
+    job.path = _job_path(job.id)
+    os.makedirs(settings.ANALYSIS_JOB_DIR, exist_ok=True)
+    if hasattr(file_obj, 'temporary_file_path'):
+        file_move_safe(file_obj.temporary_file_path(), job.path)
+    else:
+        with open(job.path, 'wb') as f:
+            for chunk in file_obj.chunks():
+                f.write(chunk)
+    job.save()
+
+    submit(job.id)
+    return job
+
+
+def topic(job_id):
+    """The ``notify`` key a job's progress is published under."""
+    return ('job', str(job_id))
+
+
+def submit(job_id):
+    future = get_executor('jobs', settings.ANALYSIS_JOB_WORKERS).submit(run_job, str(job_id))
+    future.add_done_callback(_job_finished)
+
+
+def _job_finished(future):
+    # In the web process: trim the history once a job has saved its record
+    if not future.cancelled() and future.exception() is None and future.result():
+        retention.schedule()
+
+
+class _ProgressReporter:
+    """Writes progress to the job row and its streams, at most once per interval.
+
+    The row update doubles as the job's heartbeat.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.interval = settings.ANALYSIS_JOB_PROGRESS_INTERVAL
+        self._last = 0.0
+
+    def __call__(self, rows, bytes_read):
+        now = time.monotonic()
+        if now - self._last < self.interval:
+            return
+        self._last = now
+        UploadJob.objects.filter(pk=self.job_id).update(
+            rows_processed=rows, bytes_done=bytes_read, updated_at=timezone.now(),
+        )
+        notify.publish(topic(self.job_id), {'rows_processed': rows, 'bytes_done': bytes_read})
+
+
+def run_job(job_id):
+    """Worker entry point. Claims the job so it runs once even if submitted twice.
+
+    Returns True if a record was saved.
+    """
+    claimed = UploadJob.objects.filter(pk=job_id, status=UploadJob.QUEUED).update(
+        status=UploadJob.RUNNING, stage=UploadJob.PARSE, updated_at=timezone.now(),
+    )
+    if not claimed:
+        return False
+    notify.publish(topic(job_id), {'status': UploadJob.RUNNING, 'stage': UploadJob.PARSE})
+
+    job = UploadJob.objects.select_related('user').get(pk=job_id)
+    try:
+        with datasets.stage() as dataset:
+            # The same parse the upload view would have chosen for this file
+            stats = analyse_file(job.path, dataset, progress=_ProgressReporter(job_id))
+            result, state = stats.result(), stats.state()
+            if job.digest and resultcache.enabled():
+                resultcache.store(job.digest, result, state)
+            UploadJob.objects.filter(pk=job_id).update(stage=UploadJob.SAVE, updated_at=timezone.now())
+            notify.publish(topic(job_id), {'stage': UploadJob.SAVE})
+            record = create_record(job.user, result, state)
+            datasets.attach(dataset, record.id, job.digest)
+    except Exception as e:
+        logger.exception("Upload job %s failed", job_id)
+        UploadJob.objects.filter(pk=job_id).update(
+            status=UploadJob.FAILED, error=str(e), updated_at=timezone.now(),
+        )
+        notify.publish(topic(job_id), {'status': UploadJob.FAILED})
+        return False
+    else:
+        UploadJob.objects.filter(pk=job_id).update(
+            status=UploadJob.DONE, result=result, record=record, bytes_done=job.bytes_total,
+            rows_processed=result['total_count'], updated_at=timezone.now(),
+        )
+        notify.publish(topic(job_id), {'status': UploadJob.DONE})
+        return True
+    finally:
+        try:
+            os.remove(job.path)
+        except FileNotFoundError:
+            pass
+
+
+def resume_pending():
+    """Re-submit queued jobs and jobs whose worker stopped sending heartbeats."""
+    stale = timezone.now() - timedelta(seconds=settings.ANALYSIS_JOB_STALE_AFTER)
+    UploadJob.objects.filter(status=UploadJob.RUNNING, updated_at__lt=stale).update(
+        status=UploadJob.QUEUED,
+    )
+    for job_id in UploadJob.objects.filter(status=UploadJob.QUEUED).values_list('id', flat=True):
+        submit(job_id)
+
+
+_resumed = threading.Event()
+
+
+def resume_on_first_request(sender, **kwargs):
+    # Connected to request_started: runs once per web process, after startup
+    if _resumed.is_set():
+        return
+    _resumed.set()
+    resume_pending()
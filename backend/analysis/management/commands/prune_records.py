@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from analysis import retention
+
+
+class Command(BaseCommand):
+    help = "Delete the records the retention policy no longer keeps (for cron, or after changing the policy)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        removed = retention.prune(options['batch_size'])
+        self.stdout.write(f"Pruned {removed} record(s)")
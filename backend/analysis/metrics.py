@@ -0,0 +1,128 @@
+"""Process-local metrics, exported in the Prometheus text format."""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+_registry = {}
+_lock = threading.Lock()
+
+
+# Seconds; suits request and query latencies
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(labelnames, values))
+    return '{' + pairs + '}'
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # An unlabelled counter is exported as 0 before its first increment
+        self._values = {} if self.labelnames else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels[name]) for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield self.name + _format_labels(self.labelnames, key), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # label values -> [per-bucket counts (not cumulative), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the ``with`` block; labels may be set on the yielded dict."""
+        labels = dict(labels)
+        start = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        entry = self._values.get(tuple(str(labels[name]) for name in self.labelnames))
+        return entry[2] if entry else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        labelnames = self.labelnames + ('le',)
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield self.name + '_bucket' + _format_labels(labelnames, key + (_format_bound(bound),)), cumulative
+            yield self.name + '_sum' + _format_labels(self.labelnames, key), total
+            yield self.name + '_count' + _format_labels(self.labelnames, key), count
+
+
+def _register(metric_class, name, documentation, labelnames=(), **kwargs):
+    with _lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = metric_class(name, documentation, labelnames, **kwargs)
+            _registry[name] = metric
+        return metric
+
+
+def counter(name, documentation, labelnames=()):
+    return _register(Counter, name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+def render():
+    lines = []
+    with _lock:
+        metrics = sorted(_registry.values(), key=lambda metric: metric.name)
+    for metric in metrics:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for sample, value in metric.samples():
+            lines.append(f'{sample} {value}')
+    return '\n'.join(lines) + '\n'
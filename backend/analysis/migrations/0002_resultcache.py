@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultCache',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('data', models.JSONField()),
+                ('created_at', models.DateTimeField()),
+                ('last_used_at', models.DateTimeField(db_index=True)),
+                ('hits', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0003_uploadjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='record',
+            name='state',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='resultcache',
+            name='state',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
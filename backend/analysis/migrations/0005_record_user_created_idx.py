@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0004_record_state'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='record',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='record_user_created_idx'),
+        ),
+    ]
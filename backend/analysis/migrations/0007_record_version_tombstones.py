@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0006_historyversion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecordTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('record_id', models.BigIntegerField()),
+                ('version', models.PositiveBigIntegerField()),
+                ('deleted_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='historyversion',
+            name='horizon',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='record',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='record',
+            index=models.Index(fields=['user', 'version'], name='record_user_version_idx'),
+        ),
+        migrations.AddField(
+            model_name='recordtombstone',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='recordtombstone',
+            index=models.Index(fields=['user', 'version'], name='tombstone_user_version_idx'),
+        ),
+    ]
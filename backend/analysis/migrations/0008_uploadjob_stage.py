@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0007_record_version_tombstones'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadjob',
+            name='stage',
+            field=models.CharField(blank=True, choices=[('parse', 'Parsing'), ('save', 'Saving')], max_length=10),
+        ),
+    ]
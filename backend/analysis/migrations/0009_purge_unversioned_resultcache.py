@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+def purge(apps, schema_editor):
+    # Stored before result digests covered resultcache.FORMAT: unreachable
+    # now, and some predate statistics/state. The pruner drops their datasets.
+    apps.get_model('analysis', 'ResultCache').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0008_uploadjob_stage'),
+    ]
+
+    operations = [
+        migrations.RunPython(purge, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
 
@@ -5,3 +7,79 @@ class Record(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='analyses')
     created_at = models.DateTimeField(auto_now_add=True)
     data = models.JSONField()
+    # Mergeable accumulator state behind `data` (EquipmentStats.state()), for appends
+    state = models.JSONField(null=True, blank=True)
+    # The user's HistoryVersion.version when this record was last written
+    version = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # History listing: one user's records newest first, id breaking ties
+            models.Index(fields=['user', '-created_at', '-id'], name='record_user_created_idx'),
+            # Delta sync: records changed after a given version
+            models.Index(fields=['user', 'version'], name='record_user_version_idx'),
+        ]
+
+
+class RecordTombstone(models.Model):
+    # A deleted record, kept for ANALYSIS_TOMBSTONE_TTL so delta sync can report it
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    record_id = models.BigIntegerField()
+    version = models.PositiveBigIntegerField()
+    deleted_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'version'], name='tombstone_user_version_idx')]
+
+
+class HistoryVersion(models.Model):
+    # Bumped whenever one of the user's records changes; backs the ETag of GET /record/
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='history_version')
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField()
+    # Tombstones up to this version have expired; older sync cursors must reset
+    horizon = models.PositiveBigIntegerField(default=0)
+
+
+class ResultCache(models.Model):
+    # sha256 of the result format and uploaded bytes -> the result computed from them
+    digest = models.CharField(max_length=64, primary_key=True)
+    data = models.JSONField()
+    state = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField()
+    last_used_at = models.DateTimeField(db_index=True)
+    hits = models.PositiveIntegerField(default=0)
+
+
+class UploadJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+    # What a running job is doing, for progress displays
+    PARSE = 'parse'
+    SAVE = 'save'
+    STAGE_CHOICES = [(PARSE, 'Parsing'), (SAVE, 'Saving')]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    stage = models.CharField(max_length=10, choices=STAGE_CHOICES, blank=True)
+    # Where the upload is kept until a worker has analysed it
+    path = models.CharField(max_length=255, blank=True)
+    digest = models.CharField(max_length=64, blank=True)
+    bytes_total = models.BigIntegerField(default=0)
+    bytes_done = models.BigIntegerField(default=0)
+    rows_processed = models.BigIntegerField(default=0)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    record = models.ForeignKey(Record, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def progress(self):
+        if self.status == self.DONE:
+            return 1.0
+        return round(self.bytes_done / self.bytes_total, 4) if self.bytes_total else 0.0
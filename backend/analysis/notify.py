@@ -0,0 +1,120 @@
+"""Progress pushed from the worker pools to the event streams of the web process.
+
+Each web process owns one multiprocessing queue, handed to every worker of
+its pools when they start. ``publish(key, fields)`` in a worker puts the
+changed fields on that queue; a listener thread of the web process passes
+them on to the streams subscribed to ``key``, which wait for them instead
+of re-reading the database. Called in the web process, ``publish`` delivers
+directly.
+
+Delivery is best effort: nothing is kept for keys nobody subscribed to, and
+a job run by another web process (e.g. one resumed after a restart) is not
+heard of here, so streams still re-read their row when nothing arrived for
+ANALYSIS_EVENTS_KEEPALIVE seconds.
+"""
+import asyncio
+import logging
+import threading
+from multiprocessing import get_context
+
+logger = logging.getLogger(__name__)
+
+_channel = None
+_worker_channel = None
+_subscriptions = {}
+_lock = threading.Lock()
+
+
+class Subscription:
+    """Fields published for one key since the last ``wait``, for one stream."""
+
+    def __init__(self, key):
+        self.key = key
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+        self.pending = {}
+
+    def push(self, fields):
+        # From any thread
+        with _lock:
+            self.pending.update(fields)
+        try:
+            self.loop.call_soon_threadsafe(self.event.set)
+        except RuntimeError:
+            # The stream's loop is gone
+            pass
+
+    async def wait(self, timeout):
+        """The fields published meanwhile, or None if nothing came within ``timeout``."""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self.event.clear()
+        with _lock:
+            fields, self.pending = self.pending, {}
+        return fields
+
+    def __enter__(self):
+        with _lock:
+            _subscriptions.setdefault(self.key, set()).add(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        with _lock:
+            subscribers = _subscriptions.get(self.key)
+            subscribers.discard(self)
+            if not subscribers:
+                del _subscriptions[self.key]
+
+
+def subscribe(key):
+    """Use as ``with subscribe(key) as updates:`` from a coroutine, before reading the state."""
+    return Subscription(key)
+
+
+def _deliver(key, fields):
+    with _lock:
+        subscribers = list(_subscriptions.get(key, ()))
+    for subscription in subscribers:
+        subscription.push(fields)
+
+
+def _listen(channel):
+    while True:
+        try:
+            key, fields = channel.get()
+        except (EOFError, OSError):
+            # The queue was closed: the process is exiting
+            return
+        try:
+            _deliver(key, fields)
+        except Exception:
+            logger.exception("Dropped a progress notification")
+
+
+def channel():
+    """The web process's queue for pool workers, listened to from first use."""
+    global _channel
+    with _lock:
+        if _channel is None:
+            _channel = get_context('spawn').Queue()
+            threading.Thread(target=_listen, args=(_channel,), name='analysis-notify', daemon=True).start()
+        return _channel
+
+
+def connect(channel):
+    # In a pool worker: publish to the web process that started it
+    global _worker_channel
+    _worker_channel = channel
+
+
+def publish(key, fields):
+    """Tell the streams subscribed to ``key`` that ``fields`` changed (picklable values)."""
+    if _worker_channel is None:
+        _deliver(key, fields)
+        return
+    try:
+        _worker_channel.put((key, fields))
+    except Exception:
+        logger.exception("Could not publish a progress notification")
@@ -0,0 +1,269 @@
+"""Report assets rendered on the server from a saved Record.
+
+Files live under ANALYSIS_REPORT_DIR/<record_id>/ and carry the record's
+version in their name, so an append never serves a stale asset; the whole
+directory is dropped when the record changes or is deleted (which includes
+records removed by retention).
+
+New records get their chart and report built ahead of time on a process pool
+(``schedule``), so a download is normally just a file read. ``stream_archive``
+zips every report of a user while the missing ones are still being built.
+"""
+import hashlib
+import hmac
+import io
+import logging
+import os
+import shutil
+import uuid
+import zipfile
+from concurrent.futures import as_completed
+from multiprocessing import parent_process
+
+from django.conf import settings
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.pdfencrypt import StandardEncryption
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+from .models import Record
+from .workers import get_executor
+
+logger = logging.getLogger(__name__)
+
+# Same palette and theme text colours as the desktop client's MplBarChart
+BAR_COLORS = ['#38bdf8', '#818cf8', '#f472b6']
+THEMES = {
+    'dark': {'text_primary': "#f1f5f9", 'text_secondary': "#94a3b8"},
+    'light': {'text_primary': "#0f172a", 'text_secondary': "#64748b"},
+}
+DEFAULT_THEME = 'dark'
+
+
+def report_dir(record_id):
+    return os.path.join(settings.ANALYSIS_REPORT_DIR, str(record_id))
+
+
+def discard(record_id):
+    shutil.rmtree(report_dir(record_id), ignore_errors=True)
+
+
+def _write_atomic(path, write):
+    # `write(f)` fills a temporary file that then replaces `path` in one step
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def render_chart(labels, values, theme=DEFAULT_THEME, width=5, height=4, dpi=100):
+    """PNG bytes of the equipment distribution bar chart (headless Agg canvas)."""
+    theme_colors = THEMES[theme]
+    fig = Figure(figsize=(width, height), dpi=dpi)
+    FigureCanvasAgg(fig)
+    fig.patch.set_facecolor('none')
+
+    axes = fig.add_subplot(111)
+    axes.set_facecolor('none')
+    bars = axes.bar(labels, values, color=BAR_COLORS, alpha=0.7, width=0.5)
+
+    axes.spines['top'].set_visible(False)
+    axes.spines['right'].set_visible(False)
+    axes.spines['left'].set_visible(False)
+    axes.spines['bottom'].set_color(theme_colors['text_secondary'])
+    axes.tick_params(axis='x', colors=theme_colors['text_secondary'])
+    axes.tick_params(axis='y', colors=theme_colors['text_secondary'])
+
+    for bar in bars:
+        bar_height = bar.get_height()
+        axes.text(bar.get_x() + bar.get_width() / 2., bar_height, f'{int(bar_height)}',
+                  ha='center', va='bottom', color=theme_colors['text_primary'], fontsize=9)
+
+    fig.tight_layout()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', transparent=True)
+    return buffer.getvalue()
+
+
+def chart_path(record, theme=DEFAULT_THEME):
+    return os.path.join(report_dir(record.id), f'chart-{theme}-v{record.version}.png')
+
+
+def chart_file(record, theme=DEFAULT_THEME):
+    """Path of the record's chart PNG, rendered on first use and reused after."""
+    path = chart_path(record, theme)
+    if not os.path.exists(path):
+        distribution = record.data['distribution']
+        png = render_chart(distribution['labels'], distribution['values'], theme)
+        _write_atomic(path, lambda f: f.write(png))
+    return path
+
+
+def draw_report(output, created_at, email, stats, chart=None, password=None):
+    """Write the PDF report to ``output`` (a path or binary file) in a single pass.
+
+    With a ``password`` the document is encrypted (RC4 128) as it is written,
+    instead of being re-read and re-encrypted afterwards. ``chart`` is anything
+    reportlab's ImageReader takes.
+    """
+    encrypt = StandardEncryption(password, strength=128) if password else None
+    p = canvas.Canvas(output, pagesize=letter, encrypt=encrypt)
+    width, height = letter
+
+    # --- PDF CONTENT DESIGN ---
+    p.setFont("Helvetica-Bold", 18)
+    p.drawString(50, height - 50, "Equipment Analysis Report")
+
+    p.setFont("Helvetica", 12)
+    p.drawString(50, height - 80, f"Date: {created_at}")
+    p.drawString(50, height - 100, f"Generated for: {email}")
+
+    # Draw Stats Text
+    y_position = height - 150
+    p.drawString(50, y_position, "Summary Statistics:")
+    y_position -= 20
+    p.setFont("Courier", 12)
+
+    if stats:
+        for key, value in stats.items():
+            p.drawString(70, y_position, f"{key.capitalize()}: {value}")
+            y_position -= 20
+
+    # Draw Chart Image (x, y, width, height)
+    if chart is not None:
+        p.drawImage(chart, 50, y_position - 300, width=400, height=250, mask='auto')
+
+    p.showPage()
+    p.save()
+
+
+def report_filename(created_at):
+    return f"{created_at.replace(':', '-').replace(' ', '_')}.pdf"
+
+
+def _password_key(password):
+    # Names the cached file after the password without revealing it
+    return hmac.new(settings.SECRET_KEY.encode(), password.encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def report_path(record, password, theme=DEFAULT_THEME):
+    return os.path.join(report_dir(record.id), f'report-{theme}-v{record.version}-{_password_key(password)}.pdf')
+
+
+def report_file(record, email, theme=DEFAULT_THEME):
+    """Path of the record's PDF report for ``email`` (also its password), built on first use."""
+    path = report_path(record, email, theme)
+    if not os.path.exists(path):
+        chart = ImageReader(chart_file(record, theme))
+        _write_atomic(path, lambda f: draw_report(
+            f, record.created_at.isoformat(), email, record.data['averages'], chart, password=email,
+        ))
+    return path
+
+
+def prebuild(record_id):
+    """Pool task: build the chart and report of a new record for each prebuilt theme."""
+    record = (Record.objects.select_related('user').only('id', 'version', 'data', 'created_at', 'user__email')
+              .filter(pk=record_id).first())
+    if record is None:
+        return
+    for theme in settings.ANALYSIS_REPORT_PREBUILD_THEMES:
+        report_file(record, record.user.email, theme)
+
+    # A delete or append that committed meanwhile has already cleared the
+    # directory; don't leave files behind that nothing will remove
+    if not Record.objects.filter(pk=record_id, version=record.version).exists():
+        discard(record_id)
+
+
+def schedule(record_ids):
+    """Queue ``prebuild`` for committed records; call it from ``transaction.on_commit``."""
+    if not settings.ANALYSIS_REPORT_PREBUILD:
+        return
+    if parent_process() is not None:
+        # Already in a pool worker (an async upload job), off the request path
+        for record_id in record_ids:
+            prebuild(record_id)
+        return
+    executor = get_executor('reports', settings.ANALYSIS_REPORT_WORKERS)
+    for record_id in record_ids:
+        executor.submit(prebuild, record_id)
+
+
+def build_report(record_id, email, theme=DEFAULT_THEME):
+    """Pool task: path of a record's report, or None if the record is gone."""
+    record = Record.objects.only('id', 'version', 'data', 'created_at').filter(pk=record_id).first()
+    return report_file(record, email, theme) if record is not None else None
+
+
+class _ZipSink(io.RawIOBase):
+    """Unseekable file that collects what zipfile writes until it is drained."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+def stream_archive(records, email, theme=DEFAULT_THEME, chunk_size=64 * 1024):
+    """Yield a ZIP of the reports of ``records`` (loaded with id, version, created_at).
+
+    Reports already on disk go first; the rest are built on the export pool
+    and added as they finish. Only about one chunk is held in memory at a time.
+    """
+    ready, missing = [], []
+    for record in records:
+        (ready if os.path.exists(report_path(record, email, theme)) else missing).append(record)
+
+    executor = get_executor('export', settings.ANALYSIS_EXPORT_WORKERS)
+    futures = {executor.submit(build_report, record.id, email, theme): record for record in missing}
+    sink = _ZipSink()
+    try:
+        # PDFs are compressed already; storing them keeps this I/O bound
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as archive:
+            def add(record, path):
+                name = f'{record.id}_{report_filename(record.created_at.isoformat())}'
+                with open(path, 'rb') as source, archive.open(name, 'w') as target:
+                    while chunk := source.read(chunk_size):
+                        target.write(chunk)
+                        yield from sink.drain()
+                yield from sink.drain()
+
+            for record in ready:
+                try:
+                    yield from add(record, report_path(record, email, theme))
+                except FileNotFoundError:
+                    # Discarded by an append since we looked; build it again
+                    futures[executor.submit(build_report, record.id, email, theme)] = record
+            for future in as_completed(futures):
+                record = futures[future]
+                try:
+                    path = future.result()
+                except Exception:
+                    # Headers are already sent; leave the report out rather than the archive
+                    logger.exception("Report for record %s could not be built", record.id)
+                    continue
+                if path is not None:
+                    yield from add(record, path)
+        yield from sink.drain()
+    finally:
+        # The client may have gone away; don't build what nobody will read
+        for future in futures:
+            future.cancel()
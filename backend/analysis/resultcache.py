@@ -0,0 +1,77 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics, writer
+from .models import ResultCache
+
+# Mixed into every upload digest (see uploadhandlers). Bump it when the
+# result or state layout, or how a result is computed, changes: entries from
+# before are then never looked up again and age out.
+FORMAT = 3
+
+hits = metrics.counter('analysis_result_cache_hits_total', 'Uploads answered from the result cache.')
+misses = metrics.counter('analysis_result_cache_misses_total', 'Uploads that had to be parsed.')
+evictions = metrics.counter('analysis_result_cache_evictions_total', 'Cache entries evicted by LRU or TTL.')
+
+
+def enabled():
+    return settings.ANALYSIS_RESULT_CACHE_MAX_ENTRIES > 0
+
+
+def _expiry_cutoff():
+    ttl = settings.ANALYSIS_RESULT_CACHE_TTL
+    return timezone.now() - timedelta(seconds=ttl) if ttl else None
+
+
+def lookup(digest):
+    """Return ``(data, state)`` cached for ``digest`` or None, counting the hit or miss."""
+    entries = ResultCache.objects.filter(digest=digest)
+    cutoff = _expiry_cutoff()
+    if cutoff is not None:
+        entries = entries.filter(created_at__gte=cutoff)
+
+    entry = entries.values_list('data', 'state').first()
+    if entry is None:
+        misses.inc()
+        return None
+
+    writer.execute(_touch, digest)
+    hits.inc()
+    return entry
+
+
+def _touch(digest):
+    ResultCache.objects.filter(digest=digest).update(last_used_at=timezone.now(), hits=F('hits') + 1)
+
+
+def store(digest, data, state=None):
+    writer.execute(_store, digest, data, state)
+
+
+def _store(digest, data, state):
+    ResultCache.objects.update_or_create(
+        digest=digest,
+        defaults={'data': data, 'state': state, 'created_at': timezone.now(), 'last_used_at': timezone.now()},
+    )
+    evict()
+
+
+def evict():
+    """Drop expired entries, then the least recently used beyond the size limit."""
+    removed = 0
+    cutoff = _expiry_cutoff()
+    if cutoff is not None:
+        removed += ResultCache.objects.filter(created_at__lt=cutoff).delete()[0]
+
+    limit = settings.ANALYSIS_RESULT_CACHE_MAX_ENTRIES
+    stale = ResultCache.objects.order_by('-last_used_at').values_list('digest', flat=True)[limit:]
+    stale = list(stale)
+    if stale:
+        removed += ResultCache.objects.filter(digest__in=stale).delete()[0]
+
+    if removed:
+        evictions.inc(removed)
+    return removed
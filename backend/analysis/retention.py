@@ -0,0 +1,151 @@
+"""Record retention, enforced outside the upload request.
+
+The policy comes from settings: keep at most ANALYSIS_RETENTION_MAX_RECORDS
+records and none older than ANALYSIS_RETENTION_MAX_AGE seconds, counted per
+user or per company (ANALYSIS_RETENTION_SCOPE). Users without a company are
+counted on their own.
+
+Uploads only call ``schedule()``, which wakes a background pruner thread.
+The pruner ranks records with a window function and deletes everything
+beyond the policy in batches, each batch one write committed by the writer
+thread along with the uploads queued at the time. The ranking is a pure
+function of the table, so concurrent uploads and several pruners running at
+once can never delete more than the policy allows.
+"""
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import CharField, F, Q, Value, Window
+from django.db.models.functions import Cast, Concat, RowNumber
+from django.db.models.expressions import Case, When
+from django.utils import timezone
+
+from . import datasets, metrics, versions, writer
+from .instrumentation import span
+from .models import Record
+
+logger = logging.getLogger(__name__)
+
+pruned = metrics.counter('analysis_records_pruned_total', 'Records deleted by the retention policy.')
+
+USER = 'user'
+COMPANY = 'company'
+
+
+def _partition():
+    if settings.ANALYSIS_RETENTION_SCOPE == USER:
+        return F('user_id')
+    if settings.ANALYSIS_RETENTION_SCOPE != COMPANY:
+        raise ValueError(f"Unknown ANALYSIS_RETENTION_SCOPE {settings.ANALYSIS_RETENTION_SCOPE!r}")
+
+    has_company = Q(user__profile__company__isnull=False) & ~Q(user__profile__company='')
+    return Case(
+        When(has_company, then=Concat(Value('company:'), F('user__profile__company'))),
+        default=Concat(Value('user:'), Cast('user_id', CharField())),
+        output_field=CharField(),
+    )
+
+
+def expired():
+    """Queryset of the ids of every record the policy no longer keeps."""
+    condition = Q()
+    max_age = settings.ANALYSIS_RETENTION_MAX_AGE
+    if max_age:
+        condition |= Q(created_at__lt=timezone.now() - timedelta(seconds=max_age))
+
+    records = Record.objects.all()
+    max_records = settings.ANALYSIS_RETENTION_MAX_RECORDS
+    if max_records:
+        records = records.annotate(rank=Window(
+            RowNumber(), partition_by=[_partition()], order_by=[F('created_at').desc(), F('id').desc()],
+        ))
+        condition |= Q(rank__gt=max_records)
+
+    if not condition:
+        return Record.objects.none().values_list('id', flat=True)
+    return records.filter(condition).values_list('id', flat=True)
+
+
+def prune(batch_size=None):
+    """Delete records beyond the policy, a batch per write. Returns the count."""
+    with span('prune'):
+        return _prune(batch_size or settings.ANALYSIS_RETENTION_BATCH_SIZE)
+
+
+def _prune(batch_size):
+    removed = 0
+    while True:
+        deleted = writer.execute(_delete_batch, batch_size)
+        removed += deleted
+        if deleted < batch_size:
+            break
+
+    if removed:
+        pruned.inc(removed)
+    writer.execute(versions.purge_tombstones)
+    return removed
+
+
+def _delete_batch(batch_size):
+    with versions.deferred():
+        ids = list(expired()[:batch_size])
+        if ids:
+            # Record deletes also fire the dataset clean-up signals; each
+            # affected user's history version is bumped once per batch and
+            # tombstones are left for delta sync
+            Record.objects.filter(id__in=ids).delete()
+    return len(ids)
+
+
+class Pruner(threading.Thread):
+    """Daemon thread that prunes when woken by an upload, and at least every interval.
+
+    Each run also drops cached datasets left without a result cache entry.
+    """
+
+    def __init__(self):
+        super().__init__(name='record-pruner', daemon=True)
+        self.wake = threading.Event()
+
+    def run(self):
+        while True:
+            self.wake.wait(settings.ANALYSIS_RETENTION_INTERVAL)
+            self.wake.clear()
+            close_old_connections()
+            try:
+                prune()
+                datasets.purge_cache()
+            except Exception:
+                logger.exception("Record pruning failed")
+            finally:
+                close_old_connections()
+
+
+_pruner = None
+_pruner_lock = threading.Lock()
+
+
+def _ensure_pruner():
+    global _pruner
+    with _pruner_lock:
+        if _pruner is None:
+            _pruner = Pruner()
+            _pruner.start()
+    return _pruner
+
+
+def schedule():
+    """Ask for a prune soon; called after records are created. No queries run here."""
+    if not settings.ANALYSIS_RETENTION_BACKGROUND:
+        prune()
+        return
+    _ensure_pruner().wake.set()
+
+
+def start_on_first_request(sender, **kwargs):
+    # Connected to request_started, so age-based expiry runs even without uploads
+    if settings.ANALYSIS_RETENTION_BACKGROUND and _pruner is None:
+        _ensure_pruner()
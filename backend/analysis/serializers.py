@@ -0,0 +1,12 @@
+from rest_framework import serializers
+from .models import UploadJob
+
+
+class UploadJobSerializer(serializers.ModelSerializer):
+    progress = serializers.FloatField(read_only=True)
+    record_id = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = UploadJob
+        fields = ['id', 'status', 'stage', 'progress', 'bytes_done', 'bytes_total', 'rows_processed',
+                  'result', 'error', 'record_id', 'created_at', 'updated_at']
@@ -0,0 +1,56 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import datasets, historycache, reports, versions
+from .models import Record, ResultCache
+
+
+@receiver(pre_save, sender=Record)
+def bump_history_on_save(sender, instance, **kwargs):
+    # The record is written with the version it creates (saves with
+    # update_fields must include 'version')
+    instance.version = versions.next_version(instance.user_id)
+
+
+@receiver(post_delete, sender=Record)
+def bump_history_on_delete(sender, instance, origin=None, **kwargs):
+    # Deleting the user removes their version row and tombstones with the records
+    if getattr(origin, 'model', type(origin)) is User:
+        return
+    versions.record_deleted(instance.user_id, instance.pk)
+
+
+@receiver(post_save, sender=Record)
+@receiver(post_delete, sender=Record)
+def invalidate_history_cache(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: historycache.invalidate(user_id))
+
+
+@receiver(post_delete, sender=Record)
+def discard_record_dataset(sender, instance, **kwargs):
+    # Files go only once the delete is committed
+    record_id = instance.pk
+    transaction.on_commit(lambda: datasets.discard(record_id))
+
+
+@receiver(post_save, sender=Record)
+def discard_stale_reports(sender, instance, created, **kwargs):
+    # An append changed the analysis; its charts and reports are out of date
+    if not created:
+        record_id = instance.pk
+        transaction.on_commit(lambda: reports.discard(record_id))
+
+
+@receiver(post_delete, sender=Record)
+def discard_record_reports(sender, instance, **kwargs):
+    record_id = instance.pk
+    transaction.on_commit(lambda: reports.discard(record_id))
+
+
+@receiver(post_delete, sender=ResultCache)
+def discard_cached_dataset(sender, instance, **kwargs):
+    digest = instance.digest
+    transaction.on_commit(lambda: datasets.discard_cached(digest))
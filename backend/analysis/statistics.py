@@ -0,0 +1,336 @@
+"""Extended, mergeable statistics for the equipment parameter columns.
+
+For flowrate, pressure and temperature, overall and per equipment type, the
+engine keeps count, mean and M2 (Welford/Chan), min, max and a quantile
+sketch. Every chunk is folded in with a handful of vectorised numpy passes,
+and the state of two engines merges exactly (the sketch merges bucket-wise),
+so chunked, parallel and re-analysis paths all agree.
+
+Percentiles come from a DDSketch-style log-bucket sketch, in bounded memory
+and without keeping the rows: like pandas' default (linear) method they are
+interpolated between the two order statistics around the rank, each of
+which the sketch knows to within RELATIVE_ACCURACY.
+"""
+import math
+from bisect import bisect_right
+
+import numpy as np
+import pandas as pd
+
+STAT_COLUMNS = ('flowrate', 'pressure', 'temperature')
+TYPE_COLUMN = 'type'
+PERCENTILES = (5, 25, 50, 75, 95, 99)
+RELATIVE_ACCURACY = 0.01
+
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+# Above this many (group, bucket) cells, count with np.unique instead of bincount
+_MAX_DENSE_CELLS = 1 << 22
+
+
+def _round(value):
+    return round(float(value), 2)
+
+
+def _bucket_keys(magnitudes):
+    # Bucket k holds magnitudes in (gamma**(k-1), gamma**k]; works in place,
+    # overwriting `magnitudes`
+    np.log(magnitudes, out=magnitudes)
+    np.divide(magnitudes, _LOG_GAMMA, out=magnitudes)
+    return np.ceil(magnitudes, out=magnitudes).astype(np.int64)
+
+
+def _bucket_counts(groups, keys, n_groups):
+    """Count (group, key) pairs. Returns parallel arrays for the non-empty cells.
+
+    ``groups`` (int64) and ``keys`` are overwritten.
+    """
+    if not len(keys):
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+
+    low = int(keys.min())
+    span = int(keys.max()) - low + 1
+    keys -= low
+    groups *= span
+    cells = np.add(groups, keys, out=groups)
+    if span * n_groups <= _MAX_DENSE_CELLS:
+        counts = np.bincount(cells, minlength=span * n_groups)
+        cells = np.flatnonzero(counts)
+        counts = counts[cells]
+    else:
+        cells, counts = np.unique(cells, return_counts=True)
+    return cells // span, cells % span + low, counts
+
+
+class QuantileSketch:
+    """Mergeable relative-error quantile sketch over log-spaced buckets."""
+
+    def __init__(self):
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+
+    @staticmethod
+    def _add(store, keys, counts):
+        for key, count in zip(keys, counts):
+            store[key] = store.get(key, 0) + count
+
+    def merge(self, other):
+        self._add(self.positive, other.positive.keys(), other.positive.values())
+        self._add(self.negative, other.negative.keys(), other.negative.values())
+        self.zeros += other.zeros
+
+    def state(self):
+        return {
+            "positive": list(self.positive.items()),
+            "negative": list(self.negative.items()),
+            "zeros": self.zeros,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        sketch = cls()
+        sketch.positive = {int(key): count for key, count in state['positive']}
+        sketch.negative = {int(key): count for key, count in state['negative']}
+        sketch.zeros = state['zeros']
+        return sketch
+
+    def _buckets(self):
+        # (value, count) in ascending value order: large negative magnitudes
+        # first, then zeros, then positives
+        for key in sorted(self.negative, reverse=True):
+            yield -2 * _GAMMA ** key / (_GAMMA + 1), self.negative[key]
+        if self.zeros:
+            yield 0.0, self.zeros
+        for key in sorted(self.positive):
+            yield 2 * _GAMMA ** key / (_GAMMA + 1), self.positive[key]
+
+    def quantiles(self, qs, count, low=None, high=None):
+        """Linearly interpolated like ``pandas.Series.quantile``; ``low``/``high`` are the exact extremes.
+
+        The buckets are sorted once for all of ``qs``.
+        """
+        if not count:
+            return [None] * len(qs)
+        values, ends = [], []
+        seen = 0
+        for value, bucket_count in self._buckets():
+            seen += bucket_count
+            values.append(value)
+            ends.append(seen)
+
+        def order_statistic(index):
+            # Estimate of the index-th smallest value (0-based)
+            position = bisect_right(ends, index)
+            if position == len(values):
+                return None
+            if low is not None and index == 0:
+                return low
+            if high is not None and index == count - 1:
+                return high
+            return values[position]
+
+        results = []
+        for q in qs:
+            rank = q * (count - 1)
+            index = math.floor(rank)
+            value = order_statistic(index)
+            following = order_statistic(index + 1) if index + 1 < count else None
+            if value is not None and following is not None:
+                value += (rank - index) * (following - value)
+            results.append(value)
+        return results
+
+class ColumnSummary:
+    """Moments, extremes and quantile sketch of one column within one group."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sketch = QuantileSketch()
+
+    def add_moments(self, count, mean, m2, low, high):
+        # Chan et al. parallel combination of (count, mean, M2)
+        if not count:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min = min(self.min, low)
+        self.max = max(self.max, high)
+
+    def merge(self, other):
+        self.add_moments(other.count, other.mean, other.m2, other.min, other.max)
+        self.sketch.merge(other.sketch)
+
+    def state(self):
+        # JSON has no infinities; an empty summary stores None extremes
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "m2": self.m2,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "sketch": self.sketch.state(),
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        summary = cls()
+        if state['count']:
+            summary.add_moments(state['count'], state['mean'], state['m2'], state['min'], state['max'])
+        summary.sketch = QuantileSketch.from_state(state['sketch'])
+        return summary
+
+    def result(self):
+        if not self.count:
+            summary = {"count": 0, "mean": None, "std": None, "min": None, "max": None}
+            summary.update({f"p{p}": None for p in PERCENTILES})
+            return summary
+
+        summary = {
+            "count": self.count,
+            "mean": _round(self.mean),
+            "std": _round(math.sqrt(self.m2 / (self.count - 1))) if self.count > 1 else None,
+            "min": _round(self.min),
+            "max": _round(self.max),
+        }
+        # The sketch answers to within RELATIVE_ACCURACY; the extremes are exact
+        values = self.sketch.quantiles([p / 100 for p in PERCENTILES], self.count, self.min, self.max)
+        for p, value in zip(PERCENTILES, values):
+            summary[f"p{p}"] = _round(min(max(value, self.min), self.max))
+        return summary
+
+
+def _codes(types):
+    if not isinstance(types.dtype, pd.CategoricalDtype):
+        types = types.astype('category')
+    return types.cat.codes.to_numpy().astype(np.int64), list(types.cat.categories)
+
+
+class StatisticsEngine:
+    """Per-column summaries overall and grouped by equipment type, fed chunk by chunk."""
+
+    def __init__(self):
+        self.overall = {column: ColumnSummary() for column in STAT_COLUMNS}
+        self.by_type = {}
+
+    def _group(self, label):
+        group = self.by_type.get(label)
+        if group is None:
+            group = self.by_type[label] = {column: ColumnSummary() for column in STAT_COLUMNS}
+        return group
+
+    def update(self, chunk):
+        codes, labels = _codes(chunk[TYPE_COLUMN])
+        groups = [self._group(label.item() if hasattr(label, 'item') else label) for label in labels]
+        # Rows without a type get their own group slot; it only feeds the overall summary
+        n_groups = len(labels) + 1
+        codes = np.where(codes < 0, n_groups - 1, codes)
+
+        for column in STAT_COLUMNS:
+            values = chunk[column].to_numpy(dtype=np.float64, na_value=np.nan)
+            column_codes = codes
+            # Blank cells and infinities (an "inf" cell parses as a float) are left out
+            valid = np.isfinite(values)
+            if not valid.all():
+                values, column_codes = values[valid], codes[valid]
+            if not len(values):
+                continue
+
+            # Moments per group in three bincount passes; extremes via ufunc.at
+            counts = np.bincount(column_codes, minlength=n_groups)
+            sums = np.bincount(column_codes, weights=values, minlength=n_groups)
+            means = sums / np.maximum(counts, 1)
+            deviations = values - means[column_codes]
+            m2s = np.bincount(column_codes, weights=np.square(deviations, out=deviations), minlength=n_groups)
+            lows = np.full(n_groups, np.inf)
+            highs = np.full(n_groups, -np.inf)
+            np.minimum.at(lows, column_codes, values)
+            np.maximum.at(highs, column_codes, values)
+
+            # The overall summary is combined from the groups rather than recomputed
+            total = int(counts.sum())
+            mean = float(sums.sum()) / total
+            spread = means - mean
+            self.overall[column].add_moments(
+                total, mean, float(m2s.sum() + np.dot(counts, spread * spread)),
+                float(lows.min()), float(highs.max()),
+            )
+            for code in np.flatnonzero(counts[:-1]).tolist():
+                groups[code][column].add_moments(
+                    int(counts[code]), float(means[code]), float(m2s[code]),
+                    float(lows[code]), float(highs[code]),
+                )
+
+            self._add_buckets(self.overall[column].sketch, [group[column].sketch for group in groups],
+                              values, column_codes, n_groups)
+
+    @staticmethod
+    def _add_buckets(overall, sketches, values, codes, n_groups):
+        # One counting pass over (sign class, group, bucket) cells: class 0 holds
+        # positive values, 1 negative values and 2 zeros (whose bucket is unused)
+        magnitudes = np.abs(values)
+        zero = magnitudes == 0
+        magnitudes[zero] = 1
+        keys = _bucket_keys(magnitudes)
+        groups = codes + n_groups * (values < 0)
+        groups[zero] = codes[zero] + 2 * n_groups
+        cell_groups, cell_keys, cell_counts = _bucket_counts(groups, keys, 3 * n_groups)
+
+        stores = ('positive', 'negative')
+        for cell, key, count in zip(cell_groups.tolist(), cell_keys.tolist(), cell_counts.tolist()):
+            sign_class, code = divmod(cell, n_groups)
+            targets = (overall,) if code == n_groups - 1 else (overall, sketches[code])
+            for sketch in targets:
+                if sign_class == 2:
+                    sketch.zeros += count
+                else:
+                    store = getattr(sketch, stores[sign_class])
+                    store[key] = store.get(key, 0) + count
+
+    def merge(self, other):
+        for column in STAT_COLUMNS:
+            self.overall[column].merge(other.overall[column])
+        for label, group in other.by_type.items():
+            mine = self._group(label)
+            for column in STAT_COLUMNS:
+                mine[column].merge(group[column])
+
+    def state(self):
+        """JSON-serialisable snapshot; ``from_state`` restores an engine that merges the same."""
+        def columns(summaries):
+            return {column: summaries[column].state() for column in STAT_COLUMNS}
+
+        return {
+            "overall": columns(self.overall),
+            # Pairs rather than an object so non-string labels survive the round trip
+            "by_type": [[label, columns(group)] for label, group in self.by_type.items()],
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        def columns(summaries):
+            return {column: ColumnSummary.from_state(summaries[column]) for column in STAT_COLUMNS}
+
+        engine = cls()
+        engine.overall = columns(state['overall'])
+        engine.by_type = {label: columns(group) for label, group in state['by_type']}
+        return engine
+
+    def result(self, type_order=None):
+        """Rounded summaries; ``type_order`` sets the order of the per-type entries."""
+        labels = type_order if type_order is not None else list(self.by_type)
+        return {
+            "overall": {column: self.overall[column].result() for column in STAT_COLUMNS},
+            "by_type": {
+                label: {column: self.by_type[label][column].result() for column in STAT_COLUMNS}
+                for label in labels if label in self.by_type
+            },
+        }
@@ -1,3 +1,1270 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import io
+import json
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import pandas as pd
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from pypdf import PdfReader
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from authentication.models import Profile
+
+from . import (
+    asyncviews, datasets, events, historycache, instrumentation, jobs, notify, reports, resultcache, retention, writer,
+)
+from .ingest import (
+    FAST_ENGINE, EquipmentStats, analyse_block, analyse_csv, analyse_csv_parallel, read_frame, split_ranges,
+)
+from .models import Record, ResultCache, UploadJob
+from .statistics import PERCENTILES, RELATIVE_ACCURACY
+
+HEADER = b"Equipment Name,Type,Flowrate,Pressure,Temperature\n"
+CSV = HEADER + b"P1,Pump,10,2,100\nV1,Valve,20,3,50\nP2,Pump,30,4,70\n"
+MORE = HEADER + b"V2,Valve,5,1,20\nH1,HX,7,9,300\n"
+
+
+def _without_ids(result):
+    return {key: value for key, value in result.items() if key not in ('id', 'created_at')}
+
+
+class InlineExecutor:
+    """Runs pool tasks in the test's own thread, where the test transaction is visible."""
+
+    def submit(self, func, *args):
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class AnalysisTestMixin:
+    """A user with a token-less API client, and datasets/reports in a temporary directory."""
+
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.dataset_dir = os.path.join(directory, 'datasets')
+        self.enterContext(override_settings(
+            ANALYSIS_DATASET_DIR=self.dataset_dir,
+            ANALYSIS_REPORT_DIR=os.path.join(directory, 'reports'),
+            ANALYSIS_REPORT_PREBUILD=False,
+        ))
+
+        self.user = User.objects.create_user('a@b.c', 'a@b.c', 'pw')
+        Profile.objects.create(user=self.user, role='Engineer', company='Acme')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, content=CSV, name='equipment.csv', url='/upload/'):
+        response = self.client.post(url, {'file': SimpleUploadedFile(name, content)}, format='multipart')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def latest_id(self):
+        return Record.objects.filter(user=self.user).latest('id').id
+
+    def history(self, **query):
+        response = self.client.get('/record/', query)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+
+class ChunkedIngestTests(AnalysisTestMixin, TestCase):
+
+    content = HEADER + b"P1,Pump,10,2,100\nV1,Valve,,3,50\nH1,HX,7.5,9,\nP2,Pump,30,4,70\nV2,Valve,5,1,20\n"
+
+    def test_chunks_add_up_to_the_whole_file(self):
+        frame = pd.read_csv(io.BytesIO(self.content))
+        frame.columns = frame.columns.str.strip().str.lower()
+        counts = frame['type'].value_counts()
+
+        for chunk_rows in (1, 2, 4, 100):
+            result = analyse_csv(io.BytesIO(self.content), chunk_rows=chunk_rows).result()
+            self.assertEqual(result['total_count'], 5)
+            self.assertEqual(result['averages'], {
+                column: round(frame[column].mean(), 2) for column in ('flowrate', 'pressure', 'temperature')
+            })
+            self.assertEqual(result['distribution'], {'labels': list(counts.index), 'values': list(counts)})
+
+    def test_upload_saves_the_result(self):
+        result = self.upload(self.content)
+        self.assertEqual(result['total_count'], 5)
+        self.assertEqual(Record.objects.get(user=self.user).data['averages'], result['averages'])
+
+    def test_infinite_cells_are_missing_values(self):
+        infinite = HEADER + b"P1,Pump,inf,2,100\nV1,Valve,20,-inf,50\nP2,Pump,30,Infinity,70\n"
+        blank = HEADER + b"P1,Pump,,2,100\nV1,Valve,20,,50\nP2,Pump,30,,70\n"
+        expected = _without_ids(self.upload(blank))
+
+        self.assertEqual(_without_ids(self.upload(infinite)), expected)
+        self.assertEqual(analyse_csv(io.BytesIO(infinite), chunk_rows=2).result(), expected)
+        self.assertEqual(self.history()['resultData'][0]['statistics']['overall']['pressure']['count'], 1)
+
+
+class HistoryPaginationTests(AnalysisTestMixin, TestCase):
+
+    def create(self, count):
+        created = []
+        for _ in range(count):
+            self.upload()
+            created.append(self.latest_id())
+        return created
+
+    def walk(self, limit):
+        ids, cursor = [], None
+        while True:
+            query = {'limit': limit}
+            if cursor:
+                query['cursor'] = cursor
+            page = self.history(**query)
+            self.assertLessEqual(len(page['resultData']), limit)
+            ids += [entry['id'] for entry in page['resultData']]
+            cursor = page['next_cursor']
+            if not cursor:
+                return ids
+
+    def test_cursor_walks_every_record_once_newest_first(self):
+        created = self.create(5)
+        self.assertEqual(self.walk(limit=2), created[::-1])
+
+    def test_records_with_the_same_timestamp_are_split_by_id(self):
+        created = self.create(5)
+        Record.objects.filter(id__in=created).update(created_at=Record.objects.get(pk=created[0]).created_at)
+        self.assertEqual(self.walk(limit=2), sorted(created, reverse=True))
+
+    def test_fields_selects_the_keys_of_each_entry(self):
+        self.assertIsNone(self.history()['resultData'])
+        self.upload()
+        entry = self.history(fields='averages')['resultData'][0]
+        self.assertEqual(set(entry), {'id', 'averages', 'created_at'})
+
+    def test_bad_parameters_are_rejected(self):
+        for query in ({'limit': 0}, {'limit': 'x'}, {'cursor': 'zz'}, {'fields': 'bogus'},
+                      {'since': 'x'}, {'since': -1}, {'since': 1, 'cursor': 'zz'}):
+            self.assertEqual(self.client.get('/record/', query).status_code, 400, query)
+
+
+@override_settings(ANALYSIS_RETENTION_BACKGROUND=False, ANALYSIS_RETENTION_MAX_RECORDS=2,
+                   ANALYSIS_RETENTION_MAX_AGE=None, ANALYSIS_RETENTION_SCOPE='user')
+class RetentionPolicyTests(AnalysisTestMixin, TestCase):
+
+    def create(self, user, count):
+        return [Record.objects.create(user=user, data={}).id for _ in range(count)]
+
+    def remaining(self):
+        return set(Record.objects.values_list('id', flat=True))
+
+    def test_uploads_prune_synchronously_without_the_background_thread(self):
+        for _ in range(3):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.upload()
+        self.assertEqual(Record.objects.filter(user=self.user).count(), 2)
+
+    def test_each_user_keeps_their_newest_records(self):
+        other = User.objects.create_user('o@b.c', 'o@b.c', 'pw')
+        mine, theirs = self.create(self.user, 4), self.create(other, 2)
+        self.assertEqual(retention.prune(batch_size=1), 2)
+        self.assertEqual(self.remaining(), set(mine[2:] + theirs))
+        self.assertEqual(retention.prune(), 0)
+
+    @override_settings(ANALYSIS_RETENTION_SCOPE='company', ANALYSIS_RETENTION_MAX_RECORDS=3)
+    def test_colleagues_share_the_company_limit(self):
+        colleague = User.objects.create_user('c@b.c', 'c@b.c', 'pw')
+        Profile.objects.create(user=colleague, role='Engineer', company='Acme')
+        loner = User.objects.create_user('l@b.c', 'l@b.c', 'pw')
+        Profile.objects.create(user=loner, role='Engineer', company='')
+
+        mine, theirs, own = self.create(self.user, 2), self.create(colleague, 2), self.create(loner, 3)
+        retention.prune()
+        self.assertEqual(self.remaining(), set(mine[1:] + theirs + own))
+
+    @override_settings(ANALYSIS_RETENTION_MAX_RECORDS=None, ANALYSIS_RETENTION_MAX_AGE=60)
+    def test_old_records_expire(self):
+        old, new = self.create(self.user, 2)
+        Record.objects.filter(pk=old).update(created_at=timezone.now() - timedelta(seconds=61))
+        out = io.StringIO()
+        call_command('prune_records', stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Pruned 1 record(s)")
+        self.assertEqual(self.remaining(), {new})
+
+
+@override_settings(ANALYSIS_RETENTION_BACKGROUND=False, ANALYSIS_RETENTION_MAX_RECORDS=5)
+class DeltaSyncTests(AnalysisTestMixin, TestCase):
+
+    def create(self, prefix, count):
+        created = []
+        for i in range(count):
+            self.upload(CSV + b"%s%d,Pump,1,1,1\n" % (prefix, i))
+            created.append(self.latest_id())
+        return created
+
+    def test_changes_since_a_version_oldest_first(self):
+        since = self.history()['next_since']
+        created = self.create(b'Q', 3)
+
+        changes = self.history(since=since)
+        self.assertEqual([entry['id'] for entry in changes['resultData']], created)
+        self.assertEqual(changes['deleted'], [])
+        self.assertFalse(changes['reset'])
+        self.assertGreater(changes['next_since'], since)
+
+        unchanged = self.history(since=changes['next_since'])
+        self.assertEqual(unchanged['resultData'], [])
+        self.assertEqual(unchanged['next_since'], changes['next_since'])
+
+    def test_pruned_records_come_back_as_tombstones(self):
+        first = self.create(b'Q', 3)
+        since = self.history()['next_since']
+        later = self.create(b'R', 4)
+        retention.prune()
+
+        changes = self.history(since=since)
+        self.assertEqual([entry['id'] for entry in changes['resultData']], later)
+        self.assertEqual(sorted(changes['deleted']), first[:2])
+
+    def test_paged_changes_never_split_a_batch(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as z:
+            for name in 'abc':
+                z.writestr(f'{name}.csv', CSV)
+        since = self.history()['next_since']
+        self.upload(CSV)
+        self.upload(archive.getvalue(), 'batch.zip', '/upload/batch/')
+
+        first = self.history(since=since, limit=1)
+        self.assertEqual(len(first['resultData']), 1)
+        self.assertTrue(first['has_more'])
+        second = self.history(since=first['next_since'], limit=1)
+        self.assertEqual(len(second['resultData']), 3)
+        self.assertFalse(second['has_more'])
+
+    def test_expired_tombstones_reset_the_client(self):
+        since = self.history()['next_since']
+        self.create(b'Q', 6)
+        with override_settings(ANALYSIS_TOMBSTONE_TTL=-1):
+            retention.prune()
+
+        changes = self.history(since=since)
+        self.assertTrue(changes['reset'])
+        self.assertEqual(len(changes['resultData']), 5)
+        self.assertTrue(self.history(since=999)['reset'])
+
+
+@override_settings(ANALYSIS_RETENTION_BACKGROUND=False, ANALYSIS_RETENTION_MAX_RECORDS=5)
+class ConditionalHistoryTests(AnalysisTestMixin, TestCase):
+
+    def test_unchanged_history_is_not_modified(self):
+        self.upload()
+        response = self.client.get('/record/')
+        etag = response['ETag']
+
+        with self.assertNumQueries(1):
+            not_modified = self.client.get('/record/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, 304)
+        modified_since = self.client.get('/record/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(modified_since.status_code, 304)
+        # Another page of the same history has another tag
+        self.assertEqual(self.client.get('/record/', {'limit': 3}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_uploads_prunes_and_appends_change_the_tag(self):
+        etags = [self.client.get('/record/')['ETag']]
+        for i in range(6):
+            self.upload(CSV + b"Q%d,Pump,1,1,1\n" % i)
+        etags.append(self.client.get('/record/')['ETag'])
+        retention.prune()
+        etags.append(self.client.get('/record/')['ETag'])
+        self.client.post(f'/record/{self.latest_id()}/append/', {'file': SimpleUploadedFile('more.csv', MORE)},
+                         format='multipart')
+        etags.append(self.client.get('/record/')['ETag'])
+        self.assertEqual(len(set(etags)), len(etags))
+
+
+@override_settings(ANALYSIS_RETENTION_BACKGROUND=False)
+class HistoryCacheTests(AnalysisTestMixin, TestCase):
+
+    def get(self, **query):
+        hits = historycache.hits.value()
+        response = self.client.get('/record/', query)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.content, historycache.hits.value() - hits
+
+    def test_repeat_reads_are_served_from_the_cache(self):
+        self.upload()
+        content, hit = self.get()
+        self.assertEqual(hit, 0)
+        with self.assertNumQueries(1):
+            # Only the history version is read
+            self.assertEqual(self.get(), (content, 1))
+        # Each page has its own entry
+        self.assertEqual(self.get(limit=1)[1], 0)
+        self.assertEqual(self.get(limit=1)[1], 1)
+
+    def test_changes_are_never_served_stale(self):
+        self.upload()
+        before, _ = self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.upload(MORE)
+        after, hit = self.get()
+        self.assertEqual(hit, 0)
+        self.assertEqual(len(json.loads(after)['resultData']), 2)
+
+        # Even when the invalidation was missed, a newer version is not served from the old entry
+        content, _ = self.get()
+        Record.objects.filter(user=self.user).latest('id').delete()
+        self.assertNotEqual(self.get(), (content, 1))
+
+    def test_users_do_not_share_entries(self):
+        self.upload()
+        self.get()
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user('o@b.c', 'o@b.c', 'pw'))
+        self.assertIsNone(other.get('/record/').json()['resultData'])
+
+
+class AppendTests(AnalysisTestMixin, TestCase):
+
+    def append(self, record_id, content=MORE):
+        return self.client.post(f'/record/{record_id}/append/', {'file': SimpleUploadedFile('more.csv', content)},
+                                format='multipart')
+
+    def test_append_matches_analysing_the_combined_file(self):
+        self.upload()
+        record_id = self.latest_id()
+        response = self.append(record_id)
+        self.assertEqual(response.status_code, 200, response.content)
+
+        combined = self.upload(CSV + MORE.split(b'\n', 1)[1], 'combined.csv')
+        self.assertEqual(_without_ids(response.json()), _without_ids(combined))
+        stored = self.client.get(f'/record/{record_id}/analysis/').json()['resultData']
+        self.assertEqual(_without_ids(stored), _without_ids(combined))
+
+    def test_append_to_a_record_from_the_result_cache(self):
+        self.upload()
+        first = self.latest_id()
+        self.upload()
+        cached = self.latest_id()
+        self.append(cached)
+        # The record that shared its dataset is left alone
+        self.assertEqual(self.client.get(f'/record/{first}/analysis/').json()['resultData']['total_count'], 3)
+        self.assertEqual(Record.objects.get(pk=cached).data['total_count'], 5)
+
+    def test_append_without_saved_state_reparses_the_dataset(self):
+        self.upload()
+        record_id = self.latest_id()
+        Record.objects.filter(pk=record_id).update(state=None)
+        self.assertEqual(self.append(record_id).json()['total_count'], 5)
+
+    def test_append_without_state_or_dataset_conflicts(self):
+        record_id = Record.objects.create(user=self.user, data={}).id
+        self.assertEqual(self.append(record_id).status_code, 409)
+        self.assertEqual(self.append(999).status_code, 404)
+
+
+@override_settings(ANALYSIS_RETENTION_BACKGROUND=False)
+class ChartTests(AnalysisTestMixin, TestCase):
+
+    def chart(self, record_id, **query):
+        response = self.client.get(f'/record/{record_id}/chart.png', query)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        return b''.join(response.streaming_content)
+
+    def test_the_chart_is_rendered_once_and_reused(self):
+        record_id = self.upload()['id']
+        with mock.patch('analysis.reports.render_chart', wraps=reports.render_chart) as render:
+            first = self.chart(record_id)
+            self.assertTrue(first.startswith(b'\x89PNG'))
+            self.assertEqual(self.chart(record_id), first)
+            self.assertEqual(render.call_count, 1)
+
+            self.chart(record_id, theme='light')
+            self.assertEqual(render.call_count, 2)
+        self.assertEqual(len(os.listdir(reports.report_dir(record_id))), 2)
+
+    def test_appends_and_deletes_discard_the_chart(self):
+        record_id = self.upload()['id']
+        self.chart(record_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/record/{record_id}/append/', {'file': SimpleUploadedFile('more.csv', MORE)},
+                             format='multipart')
+        self.assertFalse(os.path.exists(reports.report_dir(record_id)))
+
+        self.chart(record_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            Record.objects.get(pk=record_id).delete()
+        self.assertFalse(os.path.exists(reports.report_dir(record_id)))
+
+    def test_bad_themes_and_other_users_records(self):
+        record_id = self.upload()['id']
+        self.assertEqual(self.client.get(f'/record/{record_id}/chart.png', {'theme': 'neon'}).status_code, 400)
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user('o@b.c', 'o@b.c', 'pw'))
+        self.assertEqual(other.get(f'/record/{record_id}/chart.png').status_code, 404)
+
+
+@override_settings(ANALYSIS_RETENTION_BACKGROUND=False)
+class LegacyDownloadTests(AnalysisTestMixin, TestCase):
+
+    def test_record_ids_must_be_integers(self):
+        for record_id in ('abc', 1.5, True, [1], '', '-1'):
+            response = self.client.post('/download/', {'record_id': record_id}, format='json')
+            self.assertEqual(response.status_code, 400, record_id)
+        self.assertEqual(self.client.post('/download/', {'record_id': '999'}, format='json').status_code, 404)
+
+    def test_a_record_id_gets_a_report_of_the_saved_record(self):
+        record_id = self.upload()['id']
+        for posted in (record_id, str(record_id)):
+            response = self.client.post('/download/', {'record_id': posted}, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+
+@override_settings(ANALYSIS_RETENTION_BACKGROUND=False)
+class ReportTests(AnalysisTestMixin, TestCase):
+
+    def report_bytes(self, record_id):
+        response = self.client.get(f'/download/{record_id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        return b''.join(response.streaming_content)
+
+    def test_reports_are_encrypted_with_the_users_email(self):
+        content = self.report_bytes(self.upload()['id'])
+        self.assertTrue(PdfReader(io.BytesIO(content)).is_encrypted)
+        self.assertFalse(PdfReader(io.BytesIO(content)).decrypt('wrong'))
+        pdf = PdfReader(io.BytesIO(content))
+        self.assertTrue(pdf.decrypt('a@b.c'))
+        self.assertIn("Generated for: a@b.c", pdf.pages[0].extract_text())
+
+    def test_cached_reports_are_keyed_by_the_password(self):
+        record_id = self.upload()['id']
+        record = Record.objects.get(pk=record_id)
+        with mock.patch('analysis.reports.draw_report', wraps=reports.draw_report) as draw:
+            first = self.report_bytes(record_id)
+            self.assertEqual(self.report_bytes(record_id), first)
+            self.assertEqual(draw.call_count, 1)
+
+            # A new email is a new password, so another file
+            self.user.email = 'n@b.c'
+            self.user.save()
+            self.assertTrue(PdfReader(io.BytesIO(self.report_bytes(record_id))).decrypt('n@b.c'))
+            self.assertEqual(draw.call_count, 2)
+
+        for email in ('a@b.c', 'n@b.c'):
+            path = reports.report_path(record, email)
+            self.assertTrue(os.path.exists(path))
+            # Named after an HMAC of the password under SECRET_KEY, never the password itself
+            key = hmac.new(settings.SECRET_KEY.encode(), email.encode(), hashlib.sha256).hexdigest()[:16]
+            self.assertEqual(os.path.basename(path), f'report-{reports.DEFAULT_THEME}-v{record.version}-{key}.pdf')
+
+    def test_posted_stats_still_make_an_encrypted_report(self):
+        response = self.client.post('/download/', {'stats': {'flowrate': 20}, 'created_at': '2026-01-02 03:04'},
+                                    format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="2026-01-02_03-04.pdf"')
+        pdf = PdfReader(io.BytesIO(response.content))
+        self.assertTrue(pdf.is_encrypted)
+        self.assertTrue(pdf.decrypt('a@b.c'))
+        self.assertIn("Flowrate: 20", pdf.pages[0].extract_text())
+
+
+@override_settings(ANALYSIS_RETENTION_BACKGROUND=False, ANALYSIS_RETENTION_MAX_RECORDS=2,
+                   ANALYSIS_REPORT_PREBUILD_THEMES=('dark', 'light'))
+class PrebuildTests(AnalysisTestMixin, TestCase):
+
+    def prebuilt(self, record_id):
+        directory = reports.report_dir(record_id)
+        return sorted(name.split('-')[0] for name in os.listdir(directory)) if os.path.exists(directory) else []
+
+    def test_new_records_are_queued_once_committed(self):
+        with override_settings(ANALYSIS_REPORT_PREBUILD=True), \
+                mock.patch('analysis.reports.get_executor') as get_executor:
+            with self.captureOnCommitCallbacks(execute=True):
+                record_id = self.upload()['id']
+        get_executor.return_value.submit.assert_called_once_with(reports.prebuild, record_id)
+
+    def test_downloads_use_the_prebuilt_report(self):
+        record_id = self.upload()['id']
+        reports.prebuild(record_id)
+        self.assertEqual(self.prebuilt(record_id), ['chart', 'chart', 'report', 'report'])
+        with mock.patch('analysis.reports.draw_report') as draw:
+            response = self.client.get(f'/download/{record_id}/', {'theme': 'light'})
+            self.assertEqual(response.status_code, 200)
+            draw.assert_not_called()
+
+    def test_pruned_and_deleted_records_lose_their_reports(self):
+        created = [self.upload(CSV + b"Q%d,Pump,1,1,1\n" % i)['id'] for i in range(3)]
+        for record_id in created:
+            reports.prebuild(record_id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            retention.prune()
+        self.assertEqual([self.prebuilt(record_id) != [] for record_id in created], [False, True, True])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Record.objects.get(pk=created[1]).delete()
+        self.assertEqual(self.prebuilt(created[1]), [])
+        self.assertNotEqual(self.prebuilt(created[2]), [])
+
+    def test_a_record_deleted_during_the_build_leaves_no_files(self):
+        record_id = self.upload()['id']
+        build = reports.report_file
+
+        def build_then_delete(record, email, theme):
+            path = build(record, email, theme)
+            # Deleted in another process: its on_commit clean-up has already run
+            Record.objects.filter(pk=record_id).delete()
+            return path
+
+        with mock.patch('analysis.reports.report_file', side_effect=build_then_delete):
+            reports.prebuild(record_id)
+        self.assertEqual(self.prebuilt(record_id), [])
+        reports.prebuild(record_id)
+        self.assertEqual(self.prebuilt(record_id), [])
+
+
+@override_settings(ANALYSIS_RETENTION_BACKGROUND=False)
+class DownloadAllTests(AnalysisTestMixin, TestCase):
+
+    def member(self, record_id):
+        created_at = Record.objects.get(pk=record_id).created_at
+        return f'{record_id}_{reports.report_filename(created_at.isoformat())}'
+
+    def test_the_archive_holds_every_report_of_the_user(self):
+        prebuilt, missing = self.upload()['id'], self.upload(MORE)['id']
+        reports.prebuild(prebuilt)
+        other = User.objects.create_user('o@b.c', 'o@b.c', 'pw')
+        foreign = Record.objects.create(user=other, data=Record.objects.get(pk=prebuilt).data).id
+        reports.prebuild(foreign)
+
+        with mock.patch('analysis.reports.get_executor', return_value=InlineExecutor()):
+            response = self.client.get('/download/all/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Disposition'], 'attachment; filename="reports.zip"')
+            content = b''.join(response.streaming_content)
+
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            self.assertIsNone(archive.testzip())
+            names = archive.namelist()
+            # Reports already on disk come first, then the ones built while streaming
+            self.assertEqual(names, [self.member(prebuilt), self.member(missing)])
+            for name in names:
+                pdf = PdfReader(io.BytesIO(archive.read(name)))
+                self.assertTrue(pdf.decrypt('a@b.c'))
+        self.assertFalse(any(name.startswith(f'{foreign}_') for name in names))
+
+    def test_users_without_records_get_an_empty_archive(self):
+        content = b''.join(self.client.get('/download/all/').streaming_content)
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            self.assertEqual(archive.namelist(), [])
+        self.assertEqual(self.client.get('/download/all/', {'theme': 'neon'}).status_code, 400)
+
+
+@override_settings(ANALYSIS_RETENTION_BACKGROUND=False)
+class MetricsTests(AnalysisTestMixin, TestCase):
+
+    sample = re.compile(r'^[a-z_]+(\{[a-z_]+="[^"]*"(,[a-z_]+="[^"]*")*\})? [0-9.e+-]+$')
+
+    def test_the_export_is_prometheus_text(self):
+        requests = instrumentation.request_seconds.count(view='upload-csv', method='POST', status=200)
+        phases = instrumentation.phase_seconds.count(view='upload-csv', phase='parse')
+        self.upload()
+        admin = APIClient()
+        admin.force_authenticate(User.objects.create_user('admin', 'admin@b.c', 'pw', is_staff=True))
+        response = admin.get('/metrics/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        lines = response.content.decode().splitlines()
+        for line in lines:
+            if not line.startswith('# '):
+                self.assertRegex(line, self.sample)
+        self.assertIn('# TYPE analysis_request_seconds histogram', lines)
+        self.assertIn('# TYPE analysis_result_cache_misses_total counter', lines)
+        self.assertIn(f'analysis_request_seconds_count{{view="upload-csv",method="POST",status="200"}} '
+                      f'{requests + 1}', lines)
+        self.assertIn(f'analysis_phase_seconds_count{{view="upload-csv",phase="parse"}} {phases + 1}', lines)
+        buckets = [line for line in lines if line.startswith('analysis_request_queries_bucket{view="upload-csv",')]
+        self.assertTrue(buckets[-1].startswith('analysis_request_queries_bucket{view="upload-csv",le="+Inf"}'))
+
+    def test_only_admins_can_read_metrics(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+        self.assertEqual(APIClient().get('/metrics/').status_code, 401)
+
+
+class TypedParseTests(TestCase):
+
+    def test_columns_are_found_by_name_ignoring_case_and_padding(self):
+        content = (b"Notes, TEMPERATURE ,type,Equipment Name,Pressure,FlowRate\n"
+                   b"x,100,Pump,P1,2,10\ny,50,Valve,V1,3,20\nz,70,Pump,P2,4,30\n")
+        self.assertEqual(analyse_block(io.BytesIO(content)).result(), analyse_csv(io.BytesIO(CSV)).result())
+
+    def test_fast_and_c_engines_agree(self):
+        content = CSV + b"H1,HX,,9,300\nV2,Valve,5.25,,20\n"
+        results = []
+        for engine in {FAST_ENGINE, 'c'}:
+            stats = EquipmentStats()
+            stats.update(read_frame(io.BytesIO(content), engine=engine))
+            results.append(stats.result())
+        results.append(analyse_csv(io.BytesIO(content), chunk_rows=2).result())
+        for result in results[1:]:
+            self.assertEqual(result, results[0])
+
+    def test_numeric_types_are_the_same_labels_on_every_parse_path(self):
+        content = HEADER + b"A,1,10,2,100\nB,01,20,3,50\nC,2,30,4,70\nD,1,5,1,20\nE,,7,9,300\n"
+        block = analyse_block(io.BytesIO(content)).result()
+        chunked = analyse_csv(io.BytesIO(content), chunk_rows=2).result()
+
+        self.assertEqual(block['distribution'], {'labels': ['1', '01', '2'], 'values': [2, 1, 1]})
+        self.assertEqual(chunked['distribution'], block['distribution'])
+        self.assertEqual(list(block['statistics']['by_type']), ['1', '01', '2'])
+
+
+        with self.assertRaisesMessage(ValueError, "Missing required column(s): pressure, temperature"):
+            analyse_block(io.BytesIO(b"Type,Flowrate\nPump,1\n"))
+
+
+class StatisticsTests(TestCase):
+
+    # Every fourth row has no type and every ninth no flowrate
+    content = HEADER + b"".join(
+        b"E%d,%s,%s,%d,%d\n" % (i, (b'Pump', b'Valve', b'HX', b'')[i % 4],
+                                 b'' if i % 9 == 0 else b'%.2f' % (i * 0.37 - 20), i % 13, 100 - i)
+        for i in range(400)
+    )
+
+    def frame(self):
+        frame = pd.read_csv(io.BytesIO(self.content), dtype={'Type': 'string'})
+        frame.columns = frame.columns.str.strip().str.lower()
+        return frame
+
+    def test_summaries_match_pandas_overall_and_per_type(self):
+        statistics = analyse_block(io.BytesIO(self.content)).result()['statistics']
+        frame = self.frame()
+        groups = [('overall', frame)] + [(label, group) for label, group in frame.groupby('type')]
+
+        self.assertEqual(list(statistics['by_type']), ['Pump', 'Valve', 'HX'])
+        for label, group in groups:
+            summaries = statistics['overall'] if label == 'overall' else statistics['by_type'][label]
+            for column in ('flowrate', 'pressure', 'temperature'):
+                values, summary = group[column].dropna(), summaries[column]
+                self.assertEqual(summary['count'], len(values))
+                for key, expected in (('mean', values.mean()), ('std', values.std()),
+                                      ('min', values.min()), ('max', values.max())):
+                    self.assertAlmostEqual(summary[key], round(expected, 2), delta=0.011, msg=(label, column, key))
+
+    def test_percentiles_interpolate_like_pandas(self):
+        samples = ([1, 10, 20, 30], [5], [-5, 0, 2, 7, 100], self.frame()['flowrate'].dropna().tolist())
+        for values in samples:
+            content = HEADER + b''.join(b"E,Pump,%r,1,1\n" % value for value in values)
+            summary = analyse_block(io.BytesIO(content)).result()['statistics']['overall']['flowrate']
+            expected = pd.Series(values, dtype=float)
+            for p in PERCENTILES:
+                exact = expected.quantile(p / 100)
+                self.assertAlmostEqual(summary[f'p{p}'], exact, delta=abs(exact) * RELATIVE_ACCURACY + 0.01,
+                                       msg=(values[:4], p))
+
+    def test_chunked_and_stored_analyses_agree(self):
+        block = analyse_block(io.BytesIO(self.content)).result()
+        self.assertEqual(analyse_csv(io.BytesIO(self.content), chunk_rows=37).result(), block)
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        with override_settings(ANALYSIS_DATASET_DIR=directory), datasets.stage() as dataset:
+            analyse_csv(io.BytesIO(self.content), chunk_rows=50, dataset=dataset)
+            datasets.commit(dataset, 1)
+            self.assertEqual(datasets.analyse(datasets.load(1)).result(), block)
+
+
+class ParallelIngestTests(TestCase):
+
+    def setUp(self):
+        rows = [b"E%d,%s,%d.5,%d,%d\n" % (i, (b'Pump', b'Valve', b'HX', b'Tank')[i % 7 % 4], i % 97, i % 13, i % 311)
+                for i in range(20000)]
+        handle, self.path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(handle, 'wb') as f:
+            f.write(HEADER + b''.join(rows))
+        self.addCleanup(os.remove, self.path)
+
+    def test_ranges_cover_the_rows_and_start_on_row_boundaries(self):
+        header_end, ranges = split_ranges(self.path, 4, 64 * 1024)
+        self.assertEqual(header_end, len(HEADER))
+        self.assertGreater(len(ranges), 4)
+        self.assertEqual(ranges[0][0], header_end)
+        self.assertEqual(ranges[-1][1], os.path.getsize(self.path))
+        with open(self.path, 'rb') as f:
+            for (start, end), (next_start, _) in zip(ranges, ranges[1:]):
+                self.assertEqual(end, next_start)
+                f.seek(start - 1)
+                self.assertEqual(f.read(1), b'\n')
+
+    @override_settings(ANALYSIS_PARALLEL_RANGE_BYTES=64 * 1024)
+    def test_parallel_parse_matches_a_sequential_one(self):
+        with open(self.path, 'rb') as f:
+            sequential = analyse_csv(f, chunk_rows=3000).result()
+        parallel = analyse_csv_parallel(self.path, workers=2).result()
+        self.assertEqual(parallel, sequential)
+
+
+@override_settings(ANALYSIS_RESULT_CACHE_MAX_ENTRIES=2, ANALYSIS_RESULT_CACHE_TTL=60)
+class ResultCacheTests(AnalysisTestMixin, TestCase):
+
+    def test_a_repeat_upload_is_a_hit_that_still_creates_a_record(self):
+        hits, misses = resultcache.hits.value(), resultcache.misses.value()
+        first = self.upload()
+        self.assertEqual((resultcache.hits.value() - hits, resultcache.misses.value() - misses), (0, 1))
+        digest = hashlib.sha256(b'result-format:%d\n' % resultcache.FORMAT + CSV).hexdigest()
+        self.assertTrue(ResultCache.objects.filter(digest=digest).exists())
+
+        second = self.upload()
+        self.assertEqual((resultcache.hits.value() - hits, resultcache.misses.value() - misses), (1, 1))
+        self.assertEqual(ResultCache.objects.get().hits, 1)
+
+        self.assertEqual(Record.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(_without_ids(second), _without_ids(first))
+        self.assertNotEqual(second['id'], first['id'])
+
+    def test_a_new_result_format_starts_a_new_cache(self):
+        self.upload()
+        with mock.patch('analysis.uploadhandlers.FORMAT', resultcache.FORMAT + 1):
+            misses = resultcache.misses.value()
+            self.upload()
+            self.assertEqual(resultcache.misses.value() - misses, 1)
+        self.assertEqual(ResultCache.objects.count(), 2)
+        self.assertEqual(ResultCache.objects.filter(hits=0).count(), 2)
+
+    def test_lookup_misses_unknown_and_expired_entries(self):
+        self.assertIsNone(resultcache.lookup('unknown'))
+        resultcache.store('old', {'total_count': 1}, {'total_count': 1})
+        self.assertEqual(resultcache.lookup('old'), ({'total_count': 1}, {'total_count': 1}))
+
+        ResultCache.objects.filter(digest='old').update(created_at=timezone.now() - timedelta(seconds=61))
+        self.assertIsNone(resultcache.lookup('old'))
+        self.assertEqual(resultcache.evict(), 1)
+        self.assertFalse(ResultCache.objects.exists())
+
+    def test_the_least_recently_used_entry_is_evicted(self):
+        resultcache.store('a', {})
+        resultcache.store('b', {})
+        resultcache.lookup('a')
+        resultcache.store('c', {})
+        self.assertEqual(set(ResultCache.objects.values_list('digest', flat=True)), {'a', 'c'})
+
+    @override_settings(ANALYSIS_RESULT_CACHE_MAX_ENTRIES=0)
+    def test_a_disabled_cache_stores_nothing(self):
+        self.upload()
+        self.upload()
+        self.assertFalse(ResultCache.objects.exists())
+
+
+class UploadJobTests(AnalysisTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.enterContext(override_settings(ANALYSIS_JOB_DIR=directory))
+        self.submit_to_pool = jobs.submit
+        self.submit = self.enterContext(mock.patch('analysis.jobs.submit'))
+
+    def enqueue(self, content=CSV, cached=None):
+        return jobs.enqueue(self.user, SimpleUploadedFile('equipment.csv', content), 'digest', cached)
+
+    def test_async_upload_answers_with_the_queued_job(self):
+        response = self.client.post('/upload/?async=1', {'file': SimpleUploadedFile('e.csv', CSV)},
+                                    format='multipart')
+        self.assertEqual(response.status_code, 202, response.content)
+        job = UploadJob.objects.get()
+        self.assertEqual(response['Location'], f'/jobs/{job.id}/')
+        self.assertEqual(response.json()['status'], UploadJob.QUEUED)
+        self.submit.assert_called_once_with(job.id)
+        with open(job.path, 'rb') as f:
+            self.assertEqual(f.read(), CSV)
+        self.assertFalse(Record.objects.exists())
+
+    def test_a_cached_result_completes_the_job_at_once(self):
+        stats = analyse_csv(io.BytesIO(CSV))
+        job = self.enqueue(cached=(stats.result(), stats.state()))
+        self.assertEqual(job.status, UploadJob.DONE)
+        self.assertEqual(job.record.data['total_count'], 3)
+        self.submit.assert_not_called()
+
+    def test_run_job_saves_the_record_and_removes_the_upload(self):
+        job = self.enqueue()
+        # Retention is not the worker's business: submit schedules it
+        with mock.patch.object(retention, 'schedule') as schedule, self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(jobs.run_job(job.id))
+        schedule.assert_not_called()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, UploadJob.DONE)
+        self.assertEqual(job.result, analyse_csv(io.BytesIO(CSV)).result())
+        self.assertEqual((job.rows_processed, job.bytes_done, job.progress), (3, len(CSV), 1.0))
+        self.assertEqual(job.record.data['total_count'], 3)
+        self.assertEqual(ResultCache.objects.get(digest='digest').data, job.result)
+        self.assertFalse(os.path.exists(job.path))
+        self.assertEqual(self.client.get(f'/jobs/{job.id}/').json()['record_id'], job.record.id)
+
+    def test_a_failed_job_keeps_and_logs_the_error(self):
+        job = self.enqueue(b"Type,Flowrate\nPump,1\n")
+        with self.assertLogs('analysis.jobs', 'ERROR') as logs:
+            self.assertFalse(jobs.run_job(job.id))
+        self.assertIn(f"Upload job {job.id} failed", logs.output[0])
+        self.assertIn("Missing required column(s)", logs.output[0])
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, UploadJob.FAILED)
+        self.assertIn("Missing required column(s)", job.error)
+        self.assertFalse(Record.objects.exists())
+        self.assertFalse(os.path.exists(job.path))
+
+    def test_a_job_runs_once(self):
+        job = self.enqueue()
+        jobs.run_job(job.id)
+        self.assertFalse(jobs.run_job(job.id))
+        self.assertEqual(Record.objects.count(), 1)
+
+    def test_retention_is_scheduled_here_once_a_job_saved_its_record(self):
+        done, failed = self.enqueue(), self.enqueue(b"Type,Flowrate\nPump,1\n")
+        with mock.patch('analysis.jobs.get_executor', return_value=InlineExecutor()), \
+                mock.patch.object(retention, 'schedule') as schedule:
+            self.submit_to_pool(done.id)
+            schedule.assert_called_once_with()
+
+            with self.assertLogs('analysis.jobs', 'ERROR'):
+                self.submit_to_pool(failed.id)
+            schedule.assert_called_once_with()
+        self.assertEqual(UploadJob.objects.get(pk=done.id).status, UploadJob.DONE)
+
+    @override_settings(ANALYSIS_JOB_STALE_AFTER=60)
+    def test_resume_pending_resubmits_queued_and_stalled_jobs(self):
+        queued, stalled, running, done = (self.enqueue() for _ in range(4))
+        UploadJob.objects.filter(pk__in=[stalled.id, running.id]).update(status=UploadJob.RUNNING)
+        UploadJob.objects.filter(pk=stalled.id).update(updated_at=timezone.now() - timedelta(seconds=61))
+        UploadJob.objects.filter(pk=done.id).update(status=UploadJob.DONE)
+        self.submit.reset_mock()
+
+        jobs.resume_pending()
+        self.assertEqual({call.args[0] for call in self.submit.call_args_list}, {queued.id, stalled.id})
+        self.assertEqual(UploadJob.objects.get(pk=stalled.id).status, UploadJob.QUEUED)
+
+
+class BatchUploadTests(AnalysisTestMixin, TestCase):
+
+    def zip_archive(self, members):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as z:
+            for name, content in members.items():
+                z.writestr(name, content)
+        return archive.getvalue()
+
+    def test_each_csv_gets_a_record_and_the_combined_result(self):
+        archive = self.zip_archive({
+            'a.csv': CSV, 'notes.txt': b'x', 'sub/b.CSV': MORE, 'bad.csv': b"Type\nPump\n", '__MACOSX/a.csv': b'',
+        })
+        response = self.upload(archive, 'batch.zip', '/upload/batch/')
+
+        self.assertEqual([f['name'] for f in response['files']], ['a.csv', 'sub/b.CSV', 'bad.csv'])
+        self.assertEqual(response['files'][0]['result']['total_count'], 3)
+        self.assertEqual(response['files'][1]['result']['total_count'], 2)
+        self.assertIsNone(response['files'][2]['result'])
+        self.assertIn("Missing required column(s)", response['files'][2]['error'])
+        self.assertEqual(response['combined'], analyse_csv(io.BytesIO(CSV + MORE.split(b'\n', 1)[1])).result())
+        self.assertEqual(Record.objects.filter(user=self.user).count(), 2)
+
+    def test_compressed_tar_archives(self):
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w:gz') as tar:
+            for name, content in (('a.csv', CSV), ('b.csv', MORE)):
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        response = self.upload(archive.getvalue(), 'batch.tar.gz', '/upload/batch/')
+        self.assertEqual(response['combined']['total_count'], 5)
+
+    def test_archives_without_csv_files_are_rejected(self):
+        for name, content in (('batch.zip', self.zip_archive({'notes.txt': b'x'})), ('batch.zip', CSV)):
+            response = self.client.post('/upload/batch/', {'file': SimpleUploadedFile(name, content)},
+                                        format='multipart')
+            self.assertEqual(response.status_code, 400, response.content)
+        self.assertFalse(Record.objects.exists())
+
+
+class StoredDatasetTests(AnalysisTestMixin, TestCase):
+
+    def analysis(self, record_id, **query):
+        response = self.client.get(f'/record/{record_id}/analysis/', query)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['resultData']
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=0, ANALYSIS_CSV_CHUNK_ROWS=1)
+    def test_reanalysis_matches_the_upload(self):
+        content = CSV + b"H1,HX,,9,300\nV2,,5.25,1,20\n"
+        result = self.upload(content)
+        self.assertEqual(_without_ids(self.analysis(self.latest_id())), _without_ids(result))
+
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as z:
+            z.writestr('a.csv', MORE)
+        member = self.upload(archive.getvalue(), 'batch.zip', '/upload/batch/')['files'][0]['result']
+        self.assertEqual(_without_ids(self.analysis(self.latest_id())), _without_ids(member))
+
+    def test_types_narrow_the_reanalysis(self):
+        self.upload(CSV + b"H1,HX,,9,300\nV2,Valve,5.25,1,20\nX1,,4,4,4\n")
+        record_id = self.latest_id()
+        only = HEADER + b"P1,Pump,10,2,100\nP2,Pump,30,4,70\nH1,HX,,9,300\n"
+        self.assertEqual(_without_ids(self.analysis(record_id, types='Pump, HX')),
+                         analyse_csv(io.BytesIO(only)).result())
+
+        nothing = self.analysis(record_id, types='Tank')
+        self.assertEqual((nothing['total_count'], nothing['distribution']), (0, {'labels': [], 'values': []}))
+        for types in ('', ' , '):
+            response = self.client.get(f'/record/{record_id}/analysis/', {'types': types})
+            self.assertEqual(response.status_code, 400)
+
+
+        self.upload()
+        first = self.latest_id()
+        self.upload()
+        second = self.latest_id()
+        self.assertEqual(_without_ids(self.analysis(second)), _without_ids(self.analysis(first)))
+
+    def test_deleting_the_record_removes_its_dataset(self):
+        self.upload()
+        record_id = self.latest_id()
+        self.assertTrue(os.path.exists(datasets.record_dir(record_id)))
+        with self.captureOnCommitCallbacks(execute=True):
+            Record.objects.get(pk=record_id).delete()
+        self.assertFalse(os.path.exists(datasets.record_dir(record_id)))
+
+    def test_missing_datasets_and_other_users_records(self):
+        other = User.objects.create_user('o@b.c', 'o@b.c', 'pw')
+        other_id = Record.objects.create(user=other, data={}).id
+        self.assertEqual(self.client.get(f'/record/{other_id}/analysis/').status_code, 404)
+        own_id = Record.objects.create(user=self.user, data={}).id
+        response = self.client.get(f'/record/{own_id}/analysis/')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {"error": "No stored dataset for this record"})
+
+
+@override_settings(ANALYSIS_RETENTION_BACKGROUND=False)
+class AsyncViewTests(AnalysisTestMixin, TransactionTestCase):
+    """The /async/ views, committed so the offload threads see the data."""
+
+    def setUp(self):
+        super().setUp()
+        self.token = Token.objects.create(user=self.user).key
+        self.headers = {'Authorization': f'Token {self.token}'}
+
+    async def test_token_authentication(self):
+        response = await self.async_client.get('/async/record/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+        self.assertEqual(response.json(), {"detail": "Authentication credentials were not provided."})
+
+        response = await self.async_client.get('/async/record/', headers={'Authorization': 'Token nope'})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {"detail": "Invalid token."})
+
+        self.assertEqual((await self.async_client.get('/async/record/', headers=self.headers)).status_code, 200)
+        # Deleting the token (logout) drops the cached entry as well
+        await Token.objects.filter(key=self.token).adelete()
+        response = await self.async_client.get('/async/record/', headers=self.headers)
+        self.assertEqual(response.status_code, 401)
+
+    async def test_upload_and_history_answer_like_the_sync_views(self):
+        response = await self.async_client.post(
+            '/async/upload/', {'file': SimpleUploadedFile('equipment.csv', CSV)}, headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(await Record.objects.filter(user=self.user).acount(), 1)
+        uploaded = response.json()
+
+        response = await self.async_client.get('/async/record/', {'limit': 5}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        sync = await sync_to_async(self.client.get)('/record/', {'limit': 5})
+        self.assertEqual(response.json(), sync.json())
+        self.assertEqual(response['ETag'], sync['ETag'])
+        self.assertEqual(response.json()['resultData'][0]['id'], uploaded['id'])
+
+        response = await self.async_client.get(
+            '/async/record/', {'limit': 5}, headers={**self.headers, 'If-None-Match': sync['ETag']},
+        )
+        self.assertEqual(response.status_code, 304)
+        response = await self.async_client.get('/async/record/', {'limit': 0}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    async def test_auto_async_uploads_queue_only_under_asgi(self):
+        # WSGI buffers the event stream, so the upload is answered right away
+        response = await sync_to_async(self.client.post)(
+            '/upload/?async=auto', {'file': SimpleUploadedFile('equipment.csv', CSV)}, format='multipart',
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+
+        with mock.patch('analysis.jobs.submit') as submit:
+            response = await self.async_client.post(
+                '/async/upload/?async=auto', {'file': SimpleUploadedFile('equipment.csv', MORE)},
+                headers=self.headers,
+            )
+        self.assertEqual(response.status_code, 202, response.content)
+        self.assertEqual(response['Location'], f"/jobs/{response.json()['id']}/")
+        submit.assert_called_once()
+
+
+        record = await Record.objects.acreate(user=self.user, data=self.upload_data())
+        other = await User.objects.acreate(username='o@b.c', email='o@b.c')
+        foreign = await Record.objects.acreate(user=other, data=record.data)
+
+        # A thread stands in for the export process pool, which can't see the test database
+        executor = ThreadPoolExecutor(1)
+        self.addCleanup(executor.shutdown)
+        with mock.patch.object(asyncviews, 'get_executor', return_value=executor):
+            response = await self.async_client.get(f'/async/download/{record.id}/', headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/pdf')
+            self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+            response.close()
+            self.assertTrue(os.path.exists(reports.report_path(record, self.user.email, reports.DEFAULT_THEME)))
+
+            response = await self.async_client.get(f'/async/download/{foreign.id}/', headers=self.headers)
+            self.assertEqual(response.status_code, 404)
+            response = await self.async_client.get(
+                f'/async/download/{record.id}/', {'theme': 'nope'}, headers=self.headers,
+            )
+            self.assertEqual(response.status_code, 400)
+
+    def upload_data(self):
+        return analyse_block(io.BytesIO(CSV)).result()
+
+
+class EventStreamTests(AnalysisTestMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.headers = {'Authorization': f'Token {Token.objects.create(user=self.user).key}'}
+
+    def parse(self, message):
+        if message.startswith(b':'):
+            return 'comment', message
+        # Every message is one event line and one single-line JSON data line
+        event, data = message.split(b'\n')
+        self.assertTrue(event.startswith(b'event: ') and data.startswith(b'data: '), message)
+        return event[7:].decode(), json.loads(data[6:])
+
+    async def read(self, response, react=None):
+        """Events up to and including the terminal one; ``react(event)`` may change the state."""
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        received, buffer = [], b''
+        async for chunk in response.streaming_content:
+            buffer += chunk
+            while b'\n\n' in buffer:
+                message, buffer = buffer.split(b'\n\n', 1)
+                received.append(self.parse(message))
+                if received[-1][0] in ('done', 'failed'):
+                    self.assertEqual(buffer, b'')
+                    return received
+                if react is not None:
+                    await react(received[-1])
+        self.fail(f"The stream ended without a result: {received}")
+
+    async def test_job_events_follow_the_job_to_its_result(self):
+        job = await UploadJob.objects.acreate(user=self.user, bytes_total=100)
+        data = analyse_block(io.BytesIO(CSV)).result()
+
+        async def work(event):
+            # What run_job does, published the way it publishes
+            if event[1]['status'] == UploadJob.QUEUED:
+                notify.publish(jobs.topic(job.pk), {'status': UploadJob.RUNNING, 'stage': UploadJob.PARSE})
+                notify.publish(jobs.topic(job.pk), {'rows_processed': 3, 'bytes_done': 50})
+            else:
+                record = await Record.objects.acreate(user=self.user, data=data)
+                await UploadJob.objects.filter(pk=job.pk).aupdate(status=UploadJob.DONE, result=data, record=record)
+                notify.publish(jobs.topic(job.pk), {'status': UploadJob.DONE})
+
+        received = await self.read(await self.async_client.get(f'/jobs/{job.pk}/events/', headers=self.headers), work)
+
+        self.assertEqual([event for event, _ in received], ['progress', 'progress', 'done'])
+        self.assertEqual(received[0][1], {'status': 'queued', 'stage': '', 'progress': 0.0,
+                                          'bytes_done': 0, 'bytes_total': 100, 'rows_processed': 0})
+        self.assertEqual(received[1][1]['progress'], 0.5)
+        self.assertEqual(received[1][1]['stage'], 'parse')
+        record = await Record.objects.aget(user=self.user)
+        self.assertEqual(received[2][1]['id'], record.id)
+        self.assertEqual(_without_ids(received[2][1]), data)
+
+    @override_settings(ANALYSIS_EVENTS_KEEPALIVE=0)
+    async def test_quiet_streams_send_keepalives_and_reread_the_job(self):
+        # Nothing is published, as for a job run by another process
+        job = await UploadJob.objects.acreate(user=self.user)
+
+        async def fail(event):
+            if event[0] == 'comment':
+                await UploadJob.objects.filter(pk=job.pk).aupdate(status=UploadJob.FAILED, error='Bad file')
+
+        received = await self.read(await self.async_client.get(f'/jobs/{job.pk}/events/', headers=self.headers), fail)
+
+        self.assertEqual(received[0][0], 'progress')
+        self.assertEqual(received[1], ('comment', events.KEEPALIVE.rstrip(b'\n')))
+        self.assertEqual(received[-1], ('failed', {'error': 'Bad file'}))
+
+    async def test_worker_notifications_reach_subscribed_streams(self):
+        # A pool worker publishes on the web process's queue; a listener thread delivers
+        notify.connect(notify.channel())
+        self.addCleanup(notify.connect, None)
+        with notify.subscribe(('job', 'x')) as updates, notify.subscribe(('job', 'y')) as other:
+            notify.publish(('job', 'x'), {'bytes_done': 1})
+            notify.publish(('job', 'x'), {'bytes_done': 2, 'rows_processed': 5})
+            fields = await updates.wait(5)
+            while fields != {'bytes_done': 2, 'rows_processed': 5}:
+                # The second put may arrive after the first wake-up
+                self.assertEqual(fields, {'bytes_done': 1})
+                fields = await updates.wait(5)
+            self.assertIsNone(await other.wait(0.05))
+
+
+        other = await User.objects.acreate(username='o@b.c', email='o@b.c')
+        job = await UploadJob.objects.acreate(user=other)
+        self.assertEqual((await self.async_client.get(f'/jobs/{job.pk}/events/', headers=self.headers)).status_code, 404)
+        self.assertEqual((await self.async_client.get(f'/jobs/{job.pk}/events/')).status_code, 401)
+
+    async def test_report_events_build_the_report_and_link_to_it(self):
+        record = await Record.objects.acreate(user=self.user, data=analyse_block(io.BytesIO(CSV)).result())
+        url = f'/download/{record.id}/events/'
+        link = ('done', {'url': f'/download/{record.id}/?theme={reports.DEFAULT_THEME}'})
+        # A thread stands in for the export process pool, which can't see the test database
+        executor = ThreadPoolExecutor(1)
+        self.addCleanup(executor.shutdown)
+
+        with mock.patch.object(events, 'get_executor', return_value=executor):
+            received = await self.read(await self.async_client.get(url, headers=self.headers))
+        self.assertIn(received[0], [('progress', {'status': 'queued'}), ('progress', {'status': 'running'})])
+        self.assertEqual(received[-1], link)
+        self.assertTrue(os.path.exists(reports.report_path(record, self.user.email, reports.DEFAULT_THEME)))
+
+        # Built already: straight to the link
+        received = await self.read(await self.async_client.get(url, headers=self.headers))
+        self.assertEqual(received, [link])
+
+        response = await self.async_client.get(url, {'theme': 'nope'}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(ANALYSIS_RETENTION_BACKGROUND=True, ANALYSIS_RETENTION_MAX_RECORDS=2)
+class BackgroundRetentionTests(AnalysisTestMixin, TransactionTestCase):
+
+    def wait_for(self, condition, timeout=10):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                if condition():
+                    return
+            except OperationalError:
+                # The in-memory test database locks whole tables while the pruner writes
+                pass
+            if time.monotonic() > deadline:
+                self.fail("Timed out waiting for the pruner")
+            time.sleep(0.05)
+
+    def test_uploads_are_pruned_after_the_response(self):
+        created = [self.upload(CSV + b"Q%d,Pump,1,1,1\n" % i)['id'] for i in range(4)]
+        self.wait_for(lambda: Record.objects.count() == 2)
+
+        self.assertEqual(list(Record.objects.order_by('id').values_list('id', flat=True)), created[2:])
+        self.wait_for(lambda: not any(os.path.exists(datasets.record_dir(i)) for i in created[:2]))
+        for record_id in created[2:]:
+            self.assertTrue(os.path.exists(datasets.record_dir(record_id)))
+
+    def test_a_dataset_attached_after_its_record_was_pruned_is_discarded(self):
+        with datasets.stage() as dataset:
+            with dataset.part(0) as part:
+                part.write(read_frame(io.BytesIO(CSV)))
+            record = Record.objects.create(user=self.user, data={})
+            record.delete()
+            datasets.attach(dataset, record.id)
+        self.assertFalse(os.path.exists(datasets.record_dir(record.id)))
+
+
+@override_settings(ANALYSIS_WRITER_QUEUE=True)
+class WriterTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('w@b.c', 'w@b.c', 'pw')
+
+    def insert(self, label):
+        return Record.objects.create(user=self.user, data={'label': label}).id
+
+    def fail_after_insert(self):
+        self.insert('failed')
+        raise ValueError("rejected")
+
+    def test_queued_writes_commit_together_in_queue_order(self):
+        queue = writer._ensure_writer().queue
+        busy, release = threading.Event(), threading.Event()
+
+        def hold():
+            busy.set()
+            release.wait(10)
+
+        results, threads = {}, []
+
+        def call(name, func, *args):
+            try:
+                results[name] = func(*args)
+            except Exception as e:
+                results[name] = e
+
+        def start(name, func, *args):
+            queued = queue.qsize()
+            thread = threading.Thread(target=call, args=(name, writer.execute, func, *args))
+            thread.start()
+            threads.append(thread)
+            deadline = time.monotonic() + 10
+            while queue.qsize() == queued and time.monotonic() < deadline:
+                time.sleep(0.005)
+
+        groups = writer.group_size.count()
+        start('hold', hold)
+        busy.wait(10)
+        # The writer is busy: these queue up behind it
+        for label in ('a', 'b'):
+            start(label, self.insert, label)
+        start('failed', self.fail_after_insert)
+        for label in ('c', 'd'):
+            start(label, self.insert, label)
+        release.set()
+        for thread in threads:
+            thread.join(10)
+
+        self.assertEqual(writer.group_size.count() - groups, 2)
+        self.assertIsInstance(results['failed'], ValueError)
+        labels = list(Record.objects.order_by('id').values_list('data__label', flat=True))
+        self.assertEqual(labels, ['a', 'b', 'c', 'd'])
+        self.assertEqual([results[label] for label in 'abcd'],
+                         list(Record.objects.order_by('id').values_list('id', flat=True)))
@@ -0,0 +1,31 @@
+import hashlib
+
+from django.core.files.uploadhandler import FileUploadHandler
+
+from .resultcache import FORMAT
+
+
+class ContentHashUploadHandler(FileUploadHandler):
+    """Hash each uploaded file as it streams in, then hand the bytes on unchanged.
+
+    Install it ahead of Django's default handlers; they still build the
+    UploadedFile. Digests are kept per form field in ``digests``; they cover
+    the result cache's FORMAT too, so a new format starts a new cache.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.digests = {}
+        self._hash = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self._hash = hashlib.sha256(b'result-format:%d\n' % FORMAT)
+
+    def receive_data_chunk(self, raw_data, start):
+        self._hash.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.digests[self.field_name] = self._hash.hexdigest()
+        return None
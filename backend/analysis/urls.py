@@ -1,8 +1,23 @@
 from django.urls import path
 from .views import *
+from . import asyncviews
 
 urlpatterns = [
     path('upload/', EquipmentUploadView.as_view(), name='upload-csv'),
+    path('upload/batch/', BatchUploadView.as_view(), name='upload-batch'),
     path('record/',record,name='record'),
-    path('download/',download,name='download')
+    path('record/<int:record_id>/analysis/',record_analysis,name='record-analysis'),
+    path('record/<int:record_id>/append/',record_append,name='record-append'),
+    path('record/<int:record_id>/chart.png',record_chart,name='record-chart'),
+    path('download/',download,name='download'),
+    path('download/<int:record_id>/',download_record,name='download-record'),
+    path('download/all/',download_all,name='download-all'),
+    path('download/<int:record_id>/events/',asyncviews.report_events,name='download-record-events'),
+    path('jobs/',job_list,name='job-list'),
+    path('jobs/<uuid:job_id>/',job_detail,name='job-detail'),
+    path('jobs/<uuid:job_id>/events/',asyncviews.job_events,name='job-events'),
+    path('metrics/',metrics_view,name='metrics'),
+    path('async/upload/',asyncviews.upload,name='async-upload'),
+    path('async/record/',asyncviews.record,name='async-record'),
+    path('async/download/<int:record_id>/',asyncviews.download_record,name='async-download-record')
 ]
\ No newline at end of file
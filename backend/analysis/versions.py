@@ -0,0 +1,96 @@
+"""Per-user history version stamps and delete tombstones.
+
+Every change to a user's records (upload, append, prune) bumps their
+HistoryVersion row, so GET /record/ can answer a conditional request from
+that one row without reading the Record table. Written records carry the
+version they were written at and deletions leave a RecordTombstone at the
+version of the delete, so ``?since=<version>`` can return just the changes.
+"""
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Max
+from django.utils import timezone
+
+from .models import HistoryVersion, RecordTombstone
+
+_local = threading.local()
+
+
+def current(user):
+    """Return ``(version, updated_at, horizon)`` for ``user``; ``(0, None, 0)`` before any change."""
+    row = HistoryVersion.objects.filter(user=user).values_list('version', 'updated_at', 'horizon').first()
+    return row or (0, None, 0)
+
+
+async def acurrent(user):
+    """``current`` through the async ORM."""
+    row = await HistoryVersion.objects.filter(user=user).values_list('version', 'updated_at', 'horizon').afirst()
+    return row or (0, None, 0)
+
+
+def bump(user_ids):
+    """Advance the version of each user; returns ``{user_id: new version}``."""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return {}
+    versions = HistoryVersion.objects.filter(user_id__in=user_ids)
+    if versions.update(version=F('version') + 1, updated_at=timezone.now()) < len(user_ids):
+        # First change for some of them: create the rows, then bump again. A
+        # second bump of an existing row is harmless, a missed one is not.
+        HistoryVersion.objects.bulk_create(
+            [HistoryVersion(user_id=user_id, updated_at=timezone.now()) for user_id in user_ids],
+            ignore_conflicts=True,
+        )
+        versions.update(version=F('version') + 1, updated_at=timezone.now())
+    # The UPDATE holds the rows' write locks until commit, so these are ours
+    return dict(versions.values_list('user_id', 'version'))
+
+
+def next_version(user_id):
+    return bump([user_id])[user_id]
+
+
+def record_deleted(user_id, record_id):
+    """Bump the version and leave a tombstone, now or at the end of ``deferred()``."""
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        pending.setdefault(user_id, []).append(record_id)
+    else:
+        _flush({user_id: [record_id]})
+
+
+def _flush(deleted):
+    new_versions = bump(deleted)
+    now = timezone.now()
+    RecordTombstone.objects.bulk_create([
+        RecordTombstone(user_id=user_id, record_id=record_id, version=new_versions[user_id], deleted_at=now)
+        for user_id, record_ids in deleted.items() for record_id in record_ids
+    ])
+
+
+@contextmanager
+def deferred():
+    """Collect deletions (one signal per row) and bump each user once on exit."""
+    _local.pending = {}
+    try:
+        yield
+        pending = _local.pending
+    finally:
+        _local.pending = None
+    if pending:
+        _flush(pending)
+
+
+def purge_tombstones():
+    """Drop tombstones older than ANALYSIS_TOMBSTONE_TTL, raising each user's horizon."""
+    expired = RecordTombstone.objects.filter(
+        deleted_at__lt=timezone.now() - timedelta(seconds=settings.ANALYSIS_TOMBSTONE_TTL),
+    )
+    horizons = expired.values('user_id').annotate(horizon=Max('version')).values_list('user_id', 'horizon')
+    for user_id, horizon in horizons:
+        HistoryVersion.objects.filter(user_id=user_id, horizon__lt=horizon).update(horizon=horizon)
+    return expired.delete()[0]
+
@@ -1,171 +1,451 @@
-import pandas as pd
 from rest_framework.views import APIView
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework import status
 from rest_framework.response import Response
-from .models import Record
-from rest_framework.decorators import api_view,permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
+from .models import Record, UploadJob
+from .ingest import analyse_upload
+from .history import RECORD_FIELDS, append_to_record, create_record, create_records, history_changes, history_page
+from .batch import ArchiveError, analyse_archive
+from .serializers import UploadJobSerializer
+from .uploadhandlers import ContentHashUploadHandler
+from . import datasets, historycache, jobs, metrics, reports, resultcache, retention, versions
+from .instrumentation import span
+from rest_framework.decorators import api_view,permission_classes,parser_classes
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 
 import io
 import base64
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from pypdf import PdfReader, PdfWriter # For password protection
-from django.http import HttpResponse
+import hashlib
+import logging
+from contextlib import ExitStack
+from reportlab.lib.utils import ImageReader
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+
+logger = logging.getLogger(__name__)
+
+def handle_upload(request, user):
+    """Analyse and save one uploaded CSV; returns ``(data, status, headers)``.
+
+    Shared by the DRF view and its async twin, which runs it off the event loop.
+    """
+    # Hash the upload while it streams in (must be installed before FILES is read)
+    hasher = ContentHashUploadHandler(request)
+    request.upload_handlers.insert(0, hasher)
+
+    file_obj = request.FILES.get('file')
+    
+    if not file_obj:
+        return {"error": "No file provided"}, status.HTTP_400_BAD_REQUEST, None
+
+    try:
+        # 1. Identical bytes were analysed before? Reuse that result
+        digest = hasher.digests.get('file')
+        with span('cache_lookup'):
+            cached = resultcache.lookup(digest) if resultcache.enabled() and digest else None
+
+        # Async mode (?async=1): queue the analysis and answer with the job right away.
+        # ?async=auto queues only where the job's progress can be streamed live
+        mode = request.GET.get('async')
+        if mode in ('1', 'true') or (mode == 'auto' and _streams_events(request)):
+            job = jobs.enqueue(user, file_obj, digest or '', cached=cached)
+            return (UploadJobSerializer(job).data, status.HTTP_202_ACCEPTED,
+                    {'Location': reverse('job-detail', args=[job.id])})
+
+        with datasets.stage() as dataset:
+            if cached is not None:
+                resultData, state = cached
+            else:
+                # 2. Parse the CSV (chunked, or across the process pool if it is large),
+                #    keeping the parsed columns for re-analysis
+                # 3. Calculate Stats and create Data Dict (WITHOUT created_at yet)
+                with span('analyse'):
+                    stats = analyse_upload(file_obj, dataset)
+                    resultData, state = stats.result(), stats.state()
+                if resultcache.enabled() and digest:
+                    with span('cache_store'):
+                        resultcache.store(digest, resultData, state)
+
+            # 4. Save to Database (history is trimmed in the background, once the
+            #    dataset is in place)
+            with span('save'):
+                new_record = create_record(user, resultData, state)
+            with span('dataset'):
+                datasets.attach(dataset, new_record.id, digest)
+        transaction.on_commit(retention.schedule)
+
+        # 5. Add Timestamp to Response
+        # Now we can get the real time from the DB and add it to the result
+        resultData['created_at'] = new_record.created_at
+        resultData['id'] = new_record.id
+
+        return resultData, status.HTTP_200_OK, None
+
+    except Exception as e:
+        return {"error": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR, None
+
+
+def _streams_events(request):
+    # Under WSGI a server-sent event stream reaches the client only once it ends
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
 
 class EquipmentUploadView(APIView):
     parser_classes = (MultiPartParser, FormParser)
     permission_classes = [IsAuthenticated]
 
+    def post(self, request, *args, **kwargs):
+        data, status_code, headers = handle_upload(request, request.user)
+        return Response(data, status=status_code, headers=headers)
+
+
+class BatchUploadView(APIView):
+    parser_classes = (MultiPartParser, FormParser)
+    permission_classes = [IsAuthenticated]
+
     def post(self, request, *args, **kwargs):
         file_obj = request.FILES.get('file')
-        
+
         if not file_obj:
             return Response({"error": "No file provided"}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            # 1. Read CSV
-            df = pd.read_csv(file_obj)
-            df.columns = df.columns.str.strip().str.lower()
-            
-            # 2. Calculate Stats
-            total_count = len(df)
-            averages = {
-                "flowrate": round(df['flowrate'].mean(), 2) if not df.empty else 0,
-                "pressure": round(df['pressure'].mean(), 2) if not df.empty else 0,
-                "temperature": round(df['temperature'].mean(), 2) if not df.empty else 0
-            }
-
-            type_counts = df['type'].value_counts().to_dict()
-            chart_data = {
-                "labels": list(type_counts.keys()),
-                "values": list(type_counts.values())
-            }
-
-            # 3. Create Data Dict (WITHOUT created_at yet)
-            resultData = {
-                "total_count": total_count,
-                "averages": averages,
-                "distribution": chart_data,
-            }
-
-            # 4. Save to Database FIRST
-            # We assign it to 'new_record' so we can access its properties
-            new_record = Record.objects.create(user=request.user, data=resultData)
-
-            # 5. Add Timestamp to Response
-            # Now we can get the real time from the DB and add it to the result
-            resultData['created_at'] = new_record.created_at
-
-            # 6. Enforce Limit (Keep only last 5)
-            user_records = Record.objects.filter(user=request.user)
-            last_five_ids = user_records.order_by('-created_at').values_list('id', flat=True)[:5]
-            user_records.exclude(id__in=last_five_ids).delete()
-            
-            return Response(resultData, status=status.HTTP_200_OK)
+            with ExitStack() as staging:
+                # 1. Analyse every CSV in the archive across the process pool
+                files, combined = analyse_archive(file_obj, staging)
+
+                # 2. Save one Record per parsed file with a single bulk_create
+                results = [(stats.result(), stats.state()) for _, stats, _, _ in files if stats is not None]
+                new_records = iter(create_records(request.user, results))
+
+                # 3. Per-file results (with their timestamps) plus the combined aggregate
+                file_results = []
+                for name, stats, error, dataset in files:
+                    if stats is None:
+                        file_results.append({"name": name, "result": None, "error": error})
+                        continue
+                    new_record = next(new_records)
+                    datasets.attach(dataset, new_record.id)
+                    resultData = dict(new_record.data, created_at=new_record.created_at, id=new_record.id)
+                    file_results.append({"name": name, "result": resultData, "error": None})
+            transaction.on_commit(retention.schedule)
+
+            return Response({"files": file_results, "combined": combined.result()}, status=status.HTTP_200_OK)
 
+        except ArchiveError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def record(request):
+    # Latency is reported by outcome: hit, miss, not_modified or error
+    with historycache.latency.time(outcome='error') as timing:
+        return _history_response(request, timing)
+
+
+def history_params(query):
+    """``(limit, cursor, since, fields)`` from the query string; ValueError says what is wrong."""
+    try:
+        limit = int(query.get('limit', settings.ANALYSIS_HISTORY_PAGE_SIZE))
+        if not 0 < limit <= settings.ANALYSIS_HISTORY_MAX_PAGE_SIZE:
+            raise ValueError
+    except ValueError:
+        raise ValueError(f"limit must be between 1 and {settings.ANALYSIS_HISTORY_MAX_PAGE_SIZE}") from None
+
+    fields = RECORD_FIELDS
+    if query.get('fields'):
+        fields = [field.strip() for field in query['fields'].split(',')]
+        unknown = [field for field in fields if field not in RECORD_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+
+    # Delta sync (?since=<next_since of an earlier response>) or one page (?cursor=)
+    cursor = query.get('cursor')
+    since = query.get('since')
+    if since is not None:
+        if cursor is not None:
+            raise ValueError("Use either cursor or since")
+        try:
+            since = int(since)
+            if since < 0:
+                raise ValueError
+        except ValueError:
+            raise ValueError("since must be a version number") from None
+    return limit, cursor, since, fields
+
+
+def history_validators(request, user, version, updated_at, params):
+    """``(page_key, headers, not_modified)`` for the history page ``params`` at ``version``."""
+    limit, cursor, since, fields = params
+    page_key = hashlib.sha1(f'{limit}|{cursor}|{since}|{",".join(fields)}'.encode()).hexdigest()[:12]
+    etag = quote_etag(f'{user.id}-{version}-{page_key}')
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache', 'Vary': 'Authorization'}
+    if updated_at is not None:
+        headers['Last-Modified'] = http_date(updated_at.timestamp())
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        not_modified = etag in parse_etags(if_none_match.replace('W/', '')) or if_none_match.strip() == '*'
+    else:
+        modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+        not_modified = modified_since is not None and updated_at is not None and int(updated_at.timestamp()) <= modified_since
+    return page_key, headers, not_modified
+
+
+def history_content(user, version, horizon, page_key, params):
+    """Build, render and cache one history response body. Raises ValueError for a bad cursor."""
+    limit, cursor, since, fields = params
+    if since is not None:
+        # 4. Only what changed after `since`. If its tombstones have expired (or
+        #    the version is unknown) the client must rebuild: send everything.
+        reset = not horizon <= since <= version
+        with span('query'):
+            history_list, deleted, next_since, has_more = history_changes(
+                user, -1 if reset else since, version, limit, fields,
+            )
+        resultData = {
+            "resultData": history_list,
+            "deleted": [] if reset else deleted,
+            "next_since": next_since,
+            "has_more": has_more,
+            "reset": reset,
+        }
+    else:
+        # 4. Fetch one page of records for the current user, newest first
+        with span('query'):
+            history_list, next_cursor = history_page(user, limit, cursor, fields)
+
+        # Each entry holds the requested parts of the saved analysis, its id and
+        # the timestamp so the frontend knows when it happened (None if there
+        # is no history). next_since lets the client switch to delta sync.
+        if not history_list and cursor is None:
+            history_list = None
+        resultData = {"resultData": history_list, "next_cursor": next_cursor, "next_since": version}
+
+    # 5. Render once and keep the bytes for the next request of this page
+    with span('render'):
+        content = JSONRenderer().render(resultData)
+    historycache.put(user.id, version, page_key, content)
+    return content
+
+
+def _history_response(request, timing):
     user = request.user
-    
-    # 1. Fetch records for the current user, newest first
-    records = Record.objects.filter(user=user).order_by('-created_at')
-    # 2. Check if empty
-    if not records.exists():
-        return Response({"resultData": None}, status=status.HTTP_200_OK)
-    
-    # 3. Serialize the data
-    # We extract the 'data' field (which contains your averages, charts, etc.) 
-    # and optionally add the timestamp so the frontend knows when it happened.
-    history_list = []
-    for record in records:
-        record_entry = record.data # This is the JSON dict saved earlier
-        record_entry['created_at'] = record.created_at # Add timestamp for UI display
-        history_list.append(record_entry)
-        
-    return Response({"resultData": history_list}, status=status.HTTP_200_OK)
+
+    # 1. Page size, position and projection from the query string
+    try:
+        params = history_params(request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    # 2. Unchanged since the client's copy? Answer from the version row alone.
+    #    The version is read before the records, so a concurrent change can
+    #    only make the ETag older than the body, never newer.
+    with span('version'):
+        version, updated_at, horizon = versions.current(user)
+    page_key, headers, not_modified = history_validators(request, user, version, updated_at, params)
+    if not_modified:
+        timing['outcome'] = 'not_modified'
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    # 3. Rendered before for this version? Serve the bytes as they are
+    with span('cache_lookup'):
+        content = historycache.get(user.id, version, page_key)
+    if content is not None:
+        timing['outcome'] = 'hit'
+        return HttpResponse(content, content_type='application/json', headers=headers)
+
+    # 4-5. Query, render and cache
+    try:
+        content = history_content(user, version, horizon, page_key, params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    timing['outcome'] = 'miss'
+    return HttpResponse(content, content_type='application/json', headers=headers)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def record_analysis(request, record_id):
+    # Re-run the statistics from the stored columns instead of re-parsing the CSV.
+    # ?types=Pump,Valve narrows the analysis to those equipment types
+    types = None
+    if 'types' in request.query_params:
+        types = [label.strip() for label in request.query_params['types'].split(',') if label.strip()]
+        if not types:
+            return Response({"error": "types must name at least one equipment type"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+    record = get_object_or_404(Record, pk=record_id, user=request.user)
+    dataset = datasets.load(record.id)
+    if dataset is None:
+        return Response({"error": "No stored dataset for this record"}, status=status.HTTP_404_NOT_FOUND)
+
+    resultData = datasets.analyse(dataset, types).result()
+    resultData['created_at'] = record.created_at
+    return Response({"resultData": resultData}, status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@parser_classes([MultiPartParser, FormParser])
+def record_append(request, record_id):
+    # Fold a CSV of new rows into an existing record without re-reading its history
+    record = get_object_or_404(Record.objects.only('id'), pk=record_id, user=request.user)
+    file_obj = request.FILES.get('file')
+
+    if not file_obj:
+        return Response({"error": "No file provided"}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        with datasets.stage() as dataset:
+            # 1. Parse only the new rows
+            delta = analyse_upload(file_obj, dataset)
+
+            # 2. Merge them into the stored aggregates and keep their columns
+            record = append_to_record(record.id, delta)
+            if record is None:
+                return Response({"error": "This record has no stored aggregates to append to; upload the full CSV instead"},
+                                status=status.HTTP_409_CONFLICT)
+            datasets.extend(dataset, record.id)
+
+        resultData = dict(record.data, created_at=record.created_at, id=record.id)
+        return Response(resultData, status=status.HTTP_200_OK)
+
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def record_chart(request, record_id):
+    # The distribution chart as a PNG, rendered once per record version and theme
+    record = get_object_or_404(Record.objects.only('id', 'version', 'data'), pk=record_id, user=request.user)
+    theme = request.query_params.get('theme', reports.DEFAULT_THEME)
+    if theme not in reports.THEMES:
+        return Response({"error": f"theme must be one of: {', '.join(reports.THEMES)}"},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    response = FileResponse(open(reports.chart_file(record, theme), 'rb'), content_type='image/png')
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def job_list(request):
+    # Most recent upload jobs of the current user
+    user_jobs = UploadJob.objects.filter(user=request.user).order_by('-created_at')[:20]
+    return Response(UploadJobSerializer(user_jobs, many=True).data, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def job_detail(request, job_id):
+    job = get_object_or_404(UploadJob, pk=job_id, user=request.user)
+    return Response(UploadJobSerializer(job).data, status=status.HTTP_200_OK)
+
+
+def _record_report(request, record_id, theme):
+    record = get_object_or_404(Record.objects.only('id', 'version', 'data', 'created_at'),
+                               pk=record_id, user=request.user)
+    if theme not in reports.THEMES:
+        return Response({"error": f"theme must be one of: {', '.join(reports.THEMES)}"},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    # Built once per record version, theme and password, then served from disk
+    with span('report'):
+        path = reports.report_file(record, request.user.email, theme)
+    return FileResponse(open(path, 'rb'), as_attachment=True, content_type='application/pdf',
+                        filename=reports.report_filename(record.created_at.isoformat()))
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def download_record(request, record_id):
+    # The password-protected report of a saved analysis; nothing but the id is sent
+    return _record_report(request, record_id, request.query_params.get('theme', reports.DEFAULT_THEME))
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def download_all(request):
+    # Every report of the user in one ZIP, streamed while the missing ones are built
+    theme = request.query_params.get('theme', reports.DEFAULT_THEME)
+    if theme not in reports.THEMES:
+        return Response({"error": f"theme must be one of: {', '.join(reports.THEMES)}"},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    user_records = list(Record.objects.filter(user=request.user)
+                        .only('id', 'version', 'created_at').order_by('-created_at', '-id'))
+    response = StreamingHttpResponse(reports.stream_archive(user_records, request.user.email, theme),
+                                     content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="reports.zip"'
+    return response
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def download(request):
+    # Older clients that post a record id get the same report as GET /download/<id>/
+    record_id = request.data.get('record_id')
+    if record_id is not None:
+        # A JSON number or a string of digits; never a float or a bool
+        if isinstance(record_id, bool) or not str(record_id).isdecimal():
+            return Response({"error": "record_id must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        return _record_report(request, int(record_id), request.data.get('theme', reports.DEFAULT_THEME))
+
     try:
         # 1. Get Data from Frontend
         chart_image_b64 = request.data.get('chartImage') # Base64 string
         stats = request.data.get('stats')
         created_at = request.data.get('created_at')
 
-        # 2. Create the PDF in memory
-        buffer = io.BytesIO()
-        p = canvas.Canvas(buffer, pagesize=letter)
-        width, height = letter
-        
-        # --- PDF CONTENT DESIGN ---
-        p.setFont("Helvetica-Bold", 18)
-        p.drawString(50, height - 50, "Equipment Analysis Report")
-        
-        p.setFont("Helvetica", 12)
-        p.drawString(50, height - 80, f"Date: {created_at}")
-        p.drawString(50, height - 100, f"Generated for: {request.user.email}")
-
-        # Draw Stats Text
-        y_position = height - 150
-        p.drawString(50, y_position, "Summary Statistics:")
-        y_position -= 20
-        p.setFont("Courier", 12)
-        
-        if stats:
-            for key, value in stats.items():
-                p.drawString(70, y_position, f"{key.capitalize()}: {value}")
-                y_position -= 20
-
-        # Draw Chart Image (Decode Base64)
+        # 2. Decode the Chart Image (Base64)
+        chart = None
         if chart_image_b64:
             try:
                 # Remove header "data:image/png;base64," if present
                 if "base64," in chart_image_b64:
                     chart_image_b64 = chart_image_b64.split("base64,")[1]
-                
+
                 image_data = base64.b64decode(chart_image_b64)
-                image_stream = io.BytesIO(image_data)
-                from reportlab.lib.utils import ImageReader
-                img = ImageReader(image_stream)
-                
-                # Draw image (x, y, width, height)
-                p.drawImage(img, 50, y_position - 300, width=400, height=250)
-            except Exception as e:
-                print(f"Image Error: {e}")
-
-        p.showPage()
-        p.save()
+                chart = ImageReader(io.BytesIO(image_data))
+            except Exception:
+                logger.warning("Ignoring undecodable chart image", exc_info=True)
+
+        # 3. Create the PDF in memory, encrypted with the user's email as it is written
+        buffer = io.BytesIO()
+        with span('report'):
+            reports.draw_report(buffer, created_at, request.user.email, stats, chart, password=request.user.email)
         buffer.seek(0)
 
-        # 3. Add Password Protection (User Email)
-        input_pdf = PdfReader(buffer)
-        output_pdf = PdfWriter()
-        
-        for page in input_pdf.pages:
-            output_pdf.add_page(page)
-            
-        # Encrypt with User Email
-        password = request.user.email
-        output_pdf.encrypt(password)
-        
         # 4. Return as File Response
-        final_buffer = io.BytesIO()
-        output_pdf.write(final_buffer)
-        final_buffer.seek(0)
-        
-        filename = f"{created_at.replace(':', '-').replace(' ', '_')}.pdf"
-        response = HttpResponse(final_buffer, content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response = HttpResponse(buffer, content_type='application/pdf')
+        response['Content-Disposition'] = f'attachment; filename="{reports.report_filename(created_at)}"'
         
         return response
 
     except Exception as e:
-        return Response({"error": str(e)}, status=500)
\ No newline at end of file
+        return Response({"error": str(e)}, status=500)
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics_view(request):
+    """Prometheus text export of the metrics of the process serving this request.
+
+    Metrics are kept in process memory. The parse, job, report and export
+    pools run in their own processes, so counters and spans recorded there
+    (e.g. the parse/compute spans of a parallel parse) never reach this
+    export. Each web worker process reports only what it did itself.
+    """
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
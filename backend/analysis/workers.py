@@ -0,0 +1,81 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import notify
+
+_executors = {}
+_lock = threading.Lock()
+
+
+def _init_worker(channel):
+    # Workers are spawned, not forked, so they share no DB connections or
+    # threads with the web process; they configure Django from scratch.
+    import django
+    django.setup()
+    notify.connect(channel)
+
+
+def get_executor(name, max_workers):
+    """Return the process pool registered under ``name``, creating it on first use.
+
+    Pools are per web process and live for its lifetime; a pool whose worker
+    died is replaced transparently.
+    """
+    with _lock:
+        executor = _executors.get(name)
+        if executor is not None and getattr(executor, '_broken', False):
+            executor.shutdown(wait=False)
+            executor = None
+        if executor is None:
+            executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(notify.channel(),),
+            )
+            _executors[name] = executor
+        return executor
+
+
+def _thread_executor():
+    with _lock:
+        executor = _executors.get('async')
+        if executor is None:
+            executor = _executors['async'] = ThreadPoolExecutor(
+                max_workers=settings.ANALYSIS_ASYNC_WORKERS, thread_name_prefix='analysis-async',
+            )
+        return executor
+
+
+def _run_in_thread(func, args):
+    # The pool's threads outlive requests; treat each call like one
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+async def offload(func, *args):
+    """Await ``func(*args)`` run on the bounded thread pool of the async views.
+
+    For blocking work (pandas, sync ORM, file I/O) that must not hold the
+    event loop; the caller's context (request metrics) goes along.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _thread_executor(), context.run, _run_in_thread, func, args,
+    )
+
+
+def shutdown_executors(wait=True):
+    with _lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=wait)
+        _executors.clear()
@@ -0,0 +1,111 @@
+"""One writer thread per process, committing queued writes in groups.
+
+SQLite has a single write lock. Instead of every upload thread taking it
+for a small transaction of its own, Record inserts, retention deletes and
+result cache writes are handed to ``execute``: the writer thread runs
+whatever is queued (up to ANALYSIS_WRITER_MAX_GROUP writes) in one
+transaction, each write in its own savepoint, so concurrent uploads share
+one commit and one lock acquisition. A write that fails rolls back alone and
+its caller gets the exception; writes run in the caller's context, so their
+SQL and spans count for the caller's request.
+
+Calls made inside an atomic block (tests), from the writer thread itself
+(on_commit hooks) or with ANALYSIS_WRITER_QUEUE off run inline: handing them
+off would commit them outside the caller's transaction, or never.
+"""
+import contextvars
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+group_size = metrics.histogram(
+    'analysis_writer_group_size', 'Writes committed together by the writer thread.',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+
+
+class _Write:
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.context = contextvars.copy_context()
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def run(self):
+        with transaction.atomic():
+            return self.context.run(self.func, *self.args)
+
+
+class Writer(threading.Thread):
+    """Daemon thread that commits queued writes, as many as are waiting at a time."""
+
+    def __init__(self):
+        super().__init__(name='analysis-writer', daemon=True)
+        self.queue = queue.SimpleQueue()
+
+    def run(self):
+        while True:
+            group = [self.queue.get()]
+            # Whatever queued up during the last commit joins this one
+            while len(group) < settings.ANALYSIS_WRITER_MAX_GROUP:
+                try:
+                    group.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.commit(group)
+
+    def commit(self, group):
+        try:
+            close_old_connections()
+            with transaction.atomic():
+                for write in group:
+                    try:
+                        write.result = write.run()
+                    except Exception as e:
+                        write.error = e
+        except Exception as e:
+            # Nothing of the group was committed
+            logger.exception("Group commit of %d writes failed", len(group))
+            for write in group:
+                write.result, write.error = None, write.error or e
+        finally:
+            group_size.observe(len(group))
+            for write in group:
+                write.done.set()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _ensure_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = Writer()
+            _writer.start()
+    return _writer
+
+
+def execute(func, *args):
+    """Return ``func(*args)``, run in a transaction by the writer thread's next commit."""
+    if (not settings.ANALYSIS_WRITER_QUEUE or connection.in_atomic_block
+            or threading.current_thread() is _writer):
+        with transaction.atomic():
+            return func(*args)
+
+    write = _Write(func, args)
+    _ensure_writer().queue.put(write)
+    write.done.wait()
+    if write.error is not None:
+        raise write.error
+    return write.result
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -51,6 +52,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'analysis.instrumentation.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -63,10 +65,12 @@ MIDDLEWARE = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'authentication.backends.CachedTokenAuthentication',
     ],
 }
 
+AUTHENTICATION_BACKENDS = ['authentication.backends.ProfileModelBackend']
+
 ROOT_URLCONF = 'api.urls'
 
 TEMPLATES = [
@@ -98,6 +102,19 @@ DATABASES = {
     }
 }
 
+# Production SQLite profile for concurrent requests: ANALYSIS_SQLITE_PROFILE=production
+# in the environment (needs Django 5.1+). See ANALYSIS_WRITER_QUEUE below.
+if os.environ.get('ANALYSIS_SQLITE_PROFILE') == 'production':
+    DATABASES['default'].update({
+        'OPTIONS': {
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    })
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -138,4 +155,166 @@ STATIC_URL = 'static/'
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
-DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
\ No newline at end of file
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Analysis ingestion
+# Uploads are parsed in chunks of this many rows, so peak memory is bounded
+# by the chunk size rather than by the size of the file.
+
+ANALYSIS_CSV_CHUNK_ROWS = 100_000
+
+# Uploads at least this large (and spooled to disk by Django) are split into
+# newline-aligned byte ranges and parsed across a pool of worker processes.
+# Set ANALYSIS_PARSE_WORKERS to 1 to always parse in the request process.
+
+ANALYSIS_PARSE_WORKERS = os.cpu_count() or 1
+
+ANALYSIS_PARALLEL_MIN_BYTES = 32 * 1024 * 1024
+
+ANALYSIS_PARALLEL_RANGE_BYTES = 64 * 1024 * 1024
+
+# Results are cached by the sha256 of the uploaded bytes (and result format), so
+# re-uploading an identical export skips parsing. Entries expire after the TTL (seconds, None
+# to never expire); beyond the size limit the least recently used are evicted.
+# Set the size limit to 0 to disable the cache.
+
+ANALYSIS_RESULT_CACHE_MAX_ENTRIES = 256
+
+ANALYSIS_RESULT_CACHE_TTL = 7 * 24 * 60 * 60
+
+# Asynchronous uploads (POST /upload/?async=1) are analysed by this many worker
+# processes. Uploads wait in ANALYSIS_JOB_DIR until processed; a running job
+# whose progress heartbeat (every ANALYSIS_JOB_PROGRESS_INTERVAL seconds) is
+# older than ANALYSIS_JOB_STALE_AFTER seconds is re-queued after a restart.
+
+ANALYSIS_JOB_WORKERS = 2
+
+ANALYSIS_JOB_DIR = BASE_DIR / 'var' / 'jobs'
+
+ANALYSIS_JOB_PROGRESS_INTERVAL = 0.5
+
+ANALYSIS_JOB_STALE_AFTER = 5 * 60
+
+# Batch uploads (POST /upload/batch/) accept a ZIP or tar archive holding at
+# most this many CSV files, analysed in parallel on the parse worker pool.
+
+ANALYSIS_BATCH_MAX_FILES = 500
+
+# Parsed columns of every upload are kept as memory-mappable column files tied
+# to its Record, so GET /record/<id>/analysis/ can re-run statistics without
+# the CSV. They are deleted together with the Record.
+
+ANALYSIS_PERSIST_DATASETS = True
+
+ANALYSIS_DATASET_DIR = BASE_DIR / 'var' / 'datasets'
+
+# GET /record/ returns the history newest first, one page at a time: ?limit=
+# (default / maximum below) and the opaque ?cursor= from the previous page's
+# next_cursor. ?fields=averages,distribution returns only those keys of each
+# analysis.
+
+ANALYSIS_HISTORY_PAGE_SIZE = 50
+
+ANALYSIS_HISTORY_MAX_PAGE_SIZE = 500
+
+# Record retention: keep at most ANALYSIS_RETENTION_MAX_RECORDS records and
+# none older than ANALYSIS_RETENTION_MAX_AGE seconds (None disables either),
+# counted per 'user' or per 'company'. A background thread prunes in batches
+# shortly after uploads and every ANALYSIS_RETENTION_INTERVAL seconds; with
+# ANALYSIS_RETENTION_BACKGROUND = False uploads prune synchronously instead.
+# `manage.py prune_records` runs the same pruning from cron.
+
+ANALYSIS_RETENTION_SCOPE = 'user'
+
+ANALYSIS_RETENTION_MAX_RECORDS = 5
+
+ANALYSIS_RETENTION_MAX_AGE = None
+
+ANALYSIS_RETENTION_BACKGROUND = True
+
+ANALYSIS_RETENTION_INTERVAL = 60
+
+ANALYSIS_RETENTION_BATCH_SIZE = 500
+
+# Deleted records leave a tombstone so GET /record/?since=<version> can report
+# them. Clients whose version is older than the oldest remaining tombstone are
+# told to reset and get the full history.
+
+ANALYSIS_TOMBSTONE_TTL = 30 * 24 * 60 * 60
+
+# Rendered GET /record/ pages are cached per user in this cache (entries are
+# dropped when the user's records change). The default locmem cache is per
+# process; point ANALYSIS_HISTORY_CACHE at a file-based or shared cache to
+# share entries between processes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'analysis',
+        'OPTIONS': {'MAX_ENTRIES': 10_000},
+    },
+}
+
+ANALYSIS_HISTORY_CACHE = 'default'
+
+ANALYSIS_HISTORY_CACHE_TIMEOUT = 10 * 60
+
+ANALYSIS_HISTORY_CACHE_MAX_PAGES = 16
+
+# Charts (and reports) rendered on the server from saved records are kept
+# here per record, and removed with the record.
+
+ANALYSIS_REPORT_DIR = BASE_DIR / 'var' / 'reports'
+
+# Build the chart and PDF report of every new record in the background, in
+# these themes, on a pool of ANALYSIS_REPORT_WORKERS processes. Other themes
+# (and reports for a changed email) are still built on first download.
+
+ANALYSIS_REPORT_PREBUILD = True
+
+ANALYSIS_REPORT_PREBUILD_THEMES = ('dark', 'light')
+
+ANALYSIS_REPORT_WORKERS = 1
+
+# Reports built on demand (missing ones in GET /download/all/, and the async
+# download view) go to their own pool of this many processes.
+
+ANALYSIS_EXPORT_WORKERS = os.cpu_count() or 1
+
+# Token -> user lookups are cached in this cache for this many seconds.
+# Logout and profile updates drop the entry; with a per-process cache other
+# processes keep theirs until it expires, so keep the timeout short or use a
+# shared cache.
+
+AUTHENTICATION_TOKEN_CACHE = 'default'
+
+AUTHENTICATION_TOKEN_CACHE_TIMEOUT = 5 * 60
+
+# The async views (/async/..., for ASGI servers) run their blocking work
+# (parsing, sync ORM, rendering) on a pool of this many threads; more
+# concurrent requests queue instead of taking threads.
+
+ANALYSIS_ASYNC_WORKERS = 4
+
+# Progress streams (GET /jobs/<id>/events/, /download/<id>/events/) get their
+# updates pushed by the workers. After this many quiet seconds they send a
+# comment line, so idle connections stay open through proxies, and re-read
+# the job in case another process runs it.
+
+ANALYSIS_EVENTS_KEEPALIVE = 15
+
+# SQLite under concurrent load. With the production profile the database runs
+# in WAL mode, so readers (GET /record/ and friends) never wait for a writer,
+# with synchronous=NORMAL (no fsync per commit, still safe against
+# corruption). Transactions take the write lock when they begin (IMMEDIATE)
+# and wait up to 'timeout' seconds for it, instead of failing with "database
+# is locked" when a read turns into a write. Connections are kept for
+# CONN_MAX_AGE seconds. The development database keeps SQLite's defaults.
+#
+# In either mode, Record inserts, retention deletes and result cache stores
+# of a process are queued to one writer thread, which commits up to
+# ANALYSIS_WRITER_MAX_GROUP of them in a single transaction.
+
+ANALYSIS_WRITER_QUEUE = True
+
+ANALYSIS_WRITER_MAX_GROUP = 64
@@ -0,0 +1,114 @@
+"""Authentication with fewer queries per request.
+
+CachedTokenAuthentication keeps token -> (user, token) in a Django cache for
+AUTHENTICATION_TOKEN_CACHE_TIMEOUT seconds, so polling clients don't hit
+authtoken_token and auth_user on every call. Entries are dropped when the
+token is deleted (logout) or the user or profile is saved (update, admin),
+see signals.py. With the default per-process locmem cache another process
+may accept a revoked token until its entry expires; point
+AUTHENTICATION_TOKEN_CACHE at a shared cache to make revocation immediate.
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+
+UserModel = get_user_model()
+
+
+def _cache():
+    return caches[settings.AUTHENTICATION_TOKEN_CACHE]
+
+
+def _key(token_key):
+    # The token itself never ends up in a cache key
+    return 'auth-token:' + hashlib.sha256(token_key.encode()).hexdigest()
+
+
+def remember(token):
+    """Cache ``token`` and its user (with the profile, if it was loaded)."""
+    _cache().set(_key(token.key), (token.user, token), settings.AUTHENTICATION_TOKEN_CACHE_TIMEOUT)
+
+
+async def aremember(token):
+    await _cache().aset(_key(token.key), (token.user, token), settings.AUTHENTICATION_TOKEN_CACHE_TIMEOUT)
+
+
+def forget(token_keys):
+    _cache().delete_many([_key(token_key) for token_key in token_keys])
+
+
+def forget_user(user_id):
+    forget(Token.objects.filter(user_id=user_id).values_list('key', flat=True))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that reads the token, user and profile from the cache."""
+
+    def authenticate_credentials(self, key):
+        cached = _cache().get(_key(key))
+        if cached is None:
+            try:
+                token = Token.objects.select_related('user__profile').get(key=key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            remember(token)
+            cached = (token.user, token)
+
+        return self._check(cached)
+
+    async def aauthenticate(self, request):
+        """``authenticate`` for plain async Django views, through the async cache and ORM."""
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(_('Invalid token header. Token string should not contain invalid characters.'))
+
+        cached = await _cache().aget(_key(key))
+        if cached is None:
+            try:
+                token = await Token.objects.select_related('user__profile').aget(key=key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            await aremember(token)
+            cached = (token.user, token)
+        return self._check(cached)
+
+    @staticmethod
+    def _check(cached):
+        user, token = cached
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return user, token
+
+
+class ProfileModelBackend(ModelBackend):
+    """ModelBackend that loads the user's profile in the same query."""
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return
+        try:
+            user = UserModel._default_manager.select_related('profile').get(
+                **{UserModel.USERNAME_FIELD: username}
+            )
+        except UserModel.DoesNotExist:
+            # Run the default password hasher once to reduce the timing
+            # difference between an existing and a nonexistent user (#20760).
+            UserModel().set_password(password)
+        else:
+            if user.check_password(password) and self.user_can_authenticate(user):
+                return user
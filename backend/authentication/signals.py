@@ -0,0 +1,23 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from . import backends
+from .models import Profile
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    # Logout deletes the token; it must stop authenticating at once
+    token_key = instance.key
+    transaction.on_commit(lambda: backends.forget([token_key]))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Profile)
+def forget_changed_user(sender, instance, **kwargs):
+    # Cached users carry their profile; any change to either is refetched
+    user_id = instance.pk if sender is User else instance.user_id
+    transaction.on_commit(lambda: backends.forget_user(user_id))
@@ -1,3 +1,55 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from .backends import _cache, _key
+from .models import Profile
+
+
+@override_settings(ANALYSIS_REPORT_PREBUILD=False)
+class CachedTokenAuthenticationTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        user = User.objects.create_user('a@b.c', 'a@b.c', 'pw')
+        Profile.objects.create(user=user, role='Engineer', company='Acme')
+        self.client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/login/', {'username': 'a@b.c', 'password': 'pw'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.token = response.json()['token']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def test_logged_in_requests_skip_the_token_lookup(self):
+        etag = self.client.get('/record/')['ETag']
+        # Only the history version is read: the token and user come from the cache
+        with self.assertNumQueries(1):
+            response = self.client.get('/record/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_profile_updates_refresh_the_cached_user(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch('/update/', {
+                'currentPassword': 'pw', 'newPassword': '', 'email': 'n@b.c',
+                'first_name': 'F', 'last_name': 'L', 'role': 'Lead', 'company': 'Other',
+            }, format='json')
+        self.assertEqual(response.status_code, 202, response.content)
+        self.client.get('/record/')
+        self.assertEqual(_cache().get(_key(self.token))[0].profile.company, 'Other')
+
+    def test_logout_revokes_the_cached_token(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post('/logout/').status_code, 200)
+        self.assertEqual(self.client.get('/record/').status_code, 401)
+
+    def test_unknown_tokens_and_inactive_users_are_rejected(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token nope')
+        self.assertEqual(self.client.get('/record/').status_code, 401)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+        user = User.objects.get(username='a@b.c')
+        user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        self.assertEqual(self.client.get('/record/').status_code, 401)
@@ -5,6 +5,7 @@ from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import authenticate
 from .serializers import UserSerializer
+from . import backends
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
@@ -27,6 +28,9 @@ def login(request):
 
     if user is not None:
         token,_=Token.objects.get_or_create(user=user)
+        # The user came with its profile (ProfileModelBackend); the client's next call is a cache hit
+        token.user=user
+        backends.remember(token)
         return Response({
             'token':token.key,
             'user':{
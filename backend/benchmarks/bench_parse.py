@@ -0,0 +1,129 @@
+"""Parse-time and memory comparison of the upload parse paths.
+
+Run from ``backend/``::
+
+    python -m benchmarks.bench_parse --rows 1000000
+
+Each case runs in a fresh process so its peak RSS is not polluted by the
+previous one.
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from .synthetic import write_equipment_csv
+
+
+def _setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api.settings')
+    import django
+    django.setup()
+
+
+def _baseline(path):
+    # The pre-fast-path upload code: every column, generic dtypes
+    import pandas as pd
+    df = pd.read_csv(path)
+    df.columns = df.columns.str.strip().str.lower()
+    return len(df)
+
+
+def _typed(path, engine):
+    from analysis.ingest import read_frame
+    with open(path, 'rb') as f:
+        return len(read_frame(f, engine=engine))
+
+
+def _chunked(path):
+    from analysis.ingest import read_chunks
+    with open(path, 'rb') as f:
+        return sum(len(chunk) for chunk in read_chunks(f))
+
+
+CASES = {
+    'read_csv (current)': _baseline,
+    'typed, c engine': lambda path: _typed(path, 'c'),
+    'typed, pyarrow': lambda path: _typed(path, 'pyarrow'),
+    'typed, chunked c': _chunked,
+}
+
+
+def _status_kib(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def reset_peak_rss():
+    """Reset the kernel's RSS high-water mark and return the current RSS in KiB.
+
+    Falls back to ru_maxrss (which cannot be reset) off Linux.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return _status_kib('VmRSS')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def peak_rss():
+    try:
+        return _status_kib('VmHWM')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _run_case(name, path):
+    _setup_django()
+    import analysis.ingest  # noqa: F401  (load pandas/pyarrow before the baseline RSS)
+
+    before = reset_peak_rss()
+    start = time.perf_counter()
+    rows = CASES[name](path)
+    elapsed = time.perf_counter() - start
+    return rows, elapsed, (peak_rss() - before) / 1024
+
+
+def measure(name, path, repeat):
+    best = None
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+            result = pool.submit(_run_case, name, path).result()
+        if best is None or result[1] < best[1]:
+            best = result
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--csv', help='use an existing CSV instead of generating one')
+    args = parser.parse_args(argv)
+
+    _setup_django()
+    from analysis.ingest import FAST_ENGINE
+    cases = [name for name in CASES if FAST_ENGINE == 'pyarrow' or 'pyarrow' not in name]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.csv or write_equipment_csv(os.path.join(tmp, 'equipment.csv'), args.rows)
+        print(f"{os.path.getsize(path) / 2**20:.1f} MiB CSV")
+        print(f"{'case':<22}{'rows':>12}{'seconds':>10}{'peak MiB':>10}{'speedup':>9}")
+
+        reference = None
+        for name in cases:
+            rows, seconds, peak = measure(name, path, args.repeat)
+            reference = reference or seconds
+            print(f"{name:<22}{rows:>12}{seconds:>10.3f}{peak:>10.1f}{reference / seconds:>8.1f}x")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,283 @@
+"""Concurrent load test of the whole API, from sign-up to PDF download.
+
+Run from ``backend/``::
+
+    python -m benchmarks.loadtest --users 20 --duration 60
+    python -m benchmarks.loadtest --url http://10.0.0.5:8000 --mix upload=1,history=8,download=2
+
+Without ``--url`` a throwaway server (``manage.py runserver`` on a temporary
+SQLite database and data directories) is started and stopped around the run.
+Each synthetic user signs up and logs in through the authentication
+endpoints, uploads one CSV so it has a record, then loops for ``--duration``
+seconds picking operations by the weights of ``--mix``:
+
+- upload:   POST /upload/ with a synthetic CSV of ``--rows`` rows
+- history:  GET /record/ with If-None-Match, as the desktop client polls
+- download: GET /download/<id>/ of one of the user's records
+
+Per endpoint it reports throughput, p50/p95/p99 latency and the error rate.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import requests
+
+from .synthetic import write_equipment_csv
+
+DEFAULT_MIX = 'upload=1,history=6,download=3'
+PERCENTILES = (50, 95, 99)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVER_SETTINGS = """\
+from api.settings import *
+
+DATABASES['default']['NAME'] = {database!r}
+ANALYSIS_JOB_DIR = {root!r} + '/jobs'
+ANALYSIS_DATASET_DIR = {root!r} + '/datasets'
+ANALYSIS_REPORT_DIR = {root!r} + '/reports'
+DEBUG = False
+ALLOWED_HOSTS = ['127.0.0.1', 'localhost']
+"""
+
+
+class Stats:
+    """Latencies and errors per endpoint, shared by all user threads."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        # The first failure of each endpoint, to tell what went wrong
+        self.first_error = {}
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, seconds, error=None):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            if error is not None:
+                self.errors[endpoint] += 1
+                self.first_error.setdefault(endpoint, error)
+
+    def summary(self, duration):
+        result = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            entry = {
+                'requests': len(latencies),
+                'throughput': len(latencies) / duration,
+                'error_rate': self.errors[endpoint] / len(latencies),
+                'first_error': self.first_error.get(endpoint),
+            }
+            for p in PERCENTILES:
+                # Nearest rank
+                entry[f'p{p}'] = latencies[max(0, -(-len(latencies) * p // 100) - 1)]
+            result[endpoint] = entry
+        return result
+
+
+def _timed(stats, endpoint, call, ok_statuses=(200,)):
+    start = time.perf_counter()
+    try:
+        response = call()
+    except requests.RequestException as e:
+        stats.add(endpoint, time.perf_counter() - start, str(e))
+        return None
+    error = None
+    if response.status_code not in ok_statuses:
+        error = f'{response.status_code} {response.text[:200]}'
+    stats.add(endpoint, time.perf_counter() - start, error)
+    return response
+
+
+class User:
+    """One synthetic operator with its own keep-alive session."""
+
+    def __init__(self, base_url, run_id, index, stats):
+        self.base_url = base_url
+        self.stats = stats
+        self.session = requests.Session()
+        self.email = f'load-{run_id}-{index}@example.com'
+        self.record_ids = []
+        self.etag = None
+
+    def url(self, path):
+        return self.base_url + path
+
+    def sign_up(self):
+        password = uuid.uuid4().hex
+        _timed(self.stats, 'signup', lambda: self.session.post(self.url('/signup/'), json={
+            'username': self.email, 'email': self.email, 'password': password,
+            'first_name': 'Load', 'last_name': 'Test', 'role': 'operator', 'company': 'loadtest',
+        }), ok_statuses=(201,))
+        response = _timed(self.stats, 'login', lambda: self.session.post(
+            self.url('/login/'), json={'username': self.email, 'password': password},
+        ))
+        if response is None or response.status_code != 200:
+            return False
+        self.session.headers['Authorization'] = f"Token {response.json()['token']}"
+        return True
+
+    def upload(self, csv_bytes):
+        response = _timed(self.stats, 'upload', lambda: self.session.post(
+            self.url('/upload/'), files={'file': ('equipment.csv', csv_bytes, 'text/csv')},
+        ))
+        if response is not None and response.status_code == 200:
+            self.record_ids.append(response.json()['id'])
+
+    def history(self):
+        headers = {'If-None-Match': self.etag} if self.etag else {}
+        response = _timed(self.stats, 'history', lambda: self.session.get(self.url('/record/'), headers=headers),
+                          ok_statuses=(200, 304))
+        if response is not None and response.status_code == 200:
+            self.etag = response.headers.get('ETag')
+            # Retention may have dropped records; download only what is listed
+            records = response.json().get('resultData') or []
+            self.record_ids = [record['id'] for record in records]
+
+    def download(self):
+        if not self.record_ids:
+            return
+        record_id = random.choice(self.record_ids)
+        _timed(self.stats, 'download', lambda: self.session.get(self.url(f'/download/{record_id}/?theme=dark')))
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ('upload', 'history', 'download'):
+            raise ValueError(f"Unknown operation {name!r}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def run_user(user, mix, csv_bytes, deadline, think_time):
+    if not user.sign_up():
+        return
+    user.upload(csv_bytes)
+    operations, weights = zip(*mix.items())
+    while time.monotonic() < deadline:
+        operation = random.choices(operations, weights)[0]
+        if operation == 'upload':
+            user.upload(csv_bytes)
+        else:
+            getattr(user, operation)()
+        if think_time:
+            time.sleep(random.uniform(0, 2 * think_time))
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class LocalServer:
+    """manage.py runserver on a temporary database, for the duration of a ``with``."""
+
+    def __init__(self, root):
+        self.root = root
+        self.port = _free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self.process = None
+
+    def __enter__(self):
+        with open(os.path.join(self.root, 'loadtest_settings.py'), 'w') as f:
+            f.write(SERVER_SETTINGS.format(database=os.path.join(self.root, 'db.sqlite3'), root=self.root))
+        # Served like production: WAL, immediate transactions, persistent connections
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='loadtest_settings', ANALYSIS_SQLITE_PROFILE='production',
+                   PYTHONPATH=os.pathsep.join([self.root, BACKEND_DIR, os.environ.get('PYTHONPATH', '')]))
+        manage = [sys.executable, os.path.join(BACKEND_DIR, 'manage.py')]
+        subprocess.run(manage + ['migrate', '-v0'], env=env, check=True, cwd=BACKEND_DIR)
+        self.process = subprocess.Popen(
+            manage + ['runserver', f'127.0.0.1:{self.port}', '--noreload'],
+            env=env, cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        for _ in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=0.1).close()
+                return self
+            except OSError:
+                time.sleep(0.1)
+        self.__exit__(None, None, None)
+        raise RuntimeError("The local server did not start")
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def load_test(base_url, users, duration, mix, csv_bytes, think_time):
+    stats = Stats()
+    run_id = uuid.uuid4().hex[:8]
+    start = time.monotonic()
+    deadline = start + duration
+    threads = [
+        threading.Thread(target=run_user, args=(User(base_url, run_id, i, stats), mix, csv_bytes, deadline, think_time))
+        for i in range(users)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats.summary(time.monotonic() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='base URL of a running server (default: start a local one)')
+    parser.add_argument('--users', type=int, default=10, help='concurrent synthetic users')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load after sign-up')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'operation weights (default {DEFAULT_MIX})')
+    parser.add_argument('--rows', type=int, default=1000, help='rows in the uploaded CSV')
+    parser.add_argument('--think-time', type=float, default=0.0, help='mean pause between a user\'s requests')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(write_equipment_csv(os.path.join(tmp, 'equipment.csv'), args.rows), 'rb') as f:
+            csv_bytes = f.read()
+
+        if args.url:
+            results = load_test(args.url.rstrip('/'), args.users, args.duration, mix, csv_bytes, args.think_time)
+        else:
+            with LocalServer(tmp) as server:
+                results = load_test(server.url, args.users, args.duration, mix, csv_bytes, args.think_time)
+
+    print(f"{args.users} users, {args.duration:g}s, mix {args.mix}, {args.rows} rows per upload")
+    print(f"{'endpoint':<10}{'requests':>10}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>9}")
+    for endpoint, entry in results.items():
+        print(f"{endpoint:<10}{entry['requests']:>10}{entry['throughput']:>9.1f}"
+              + ''.join(f"{entry[f'p{p}'] * 1000:>9.1f}" for p in PERCENTILES)
+              + f"{entry['error_rate']:>9.1%}")
+    for endpoint, entry in results.items():
+        if entry['first_error']:
+            print(f"first {endpoint} error: {entry['first_error']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'users': args.users, 'duration': args.duration, 'mix': mix, 'rows': args.rows,
+                       'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,286 @@
+"""Regression benchmarks for the upload, history and report endpoints.
+
+Run from ``backend/``::
+
+    python -m benchmarks.suite --output baseline.json
+    python -m benchmarks.suite --compare baseline.json --threshold 0.2
+
+Requests go through the Django test client against a throwaway SQLite
+database, with the real middleware, authentication and views. Every case
+runs in a fresh process; it records the best wall time over ``--repeat``
+runs, the peak RSS growth of a run and the number of SQL queries of the
+request. Upload cases scale with the synthetic CSV size (``--sizes``, up to
+1e7 rows; note the test client holds the whole multipart body in memory,
+which is part of the RSS figure). History and report cases use a history of
+``--history`` records.
+
+``--compare`` exits with status 1 if a case got slower or bigger than the
+baseline by more than the threshold, or runs more queries.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+
+from .bench_parse import peak_rss, reset_peak_rss
+from .synthetic import write_equipment_csv
+
+DEFAULT_SIZES = '1e3,1e4,1e5,1e6'
+WARM_UP_ROWS = 1000
+# Differences below these are noise, whatever the ratio
+MIN_SECONDS_DELTA = 0.002
+MIN_RSS_DELTA_MIB = 2.0
+
+
+def _setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api.settings')
+    import django
+    django.setup()
+
+
+class Bench:
+    """A throwaway database with one user, and a test client logged in as them."""
+
+    def __init__(self, tmp, warm_up_csv):
+        from django.db import connection
+        from django.test import Client
+        from django.test.utils import override_settings, setup_test_environment
+        from rest_framework.authtoken.models import Token
+
+        override_settings(
+            ANALYSIS_JOB_DIR=os.path.join(tmp, 'jobs'),
+            ANALYSIS_DATASET_DIR=os.path.join(tmp, 'datasets'),
+            ANALYSIS_REPORT_DIR=os.path.join(tmp, 'reports'),
+            # Every repeat must do the work: no result cache, no history trimming
+            ANALYSIS_RESULT_CACHE_MAX_ENTRIES=0,
+            ANALYSIS_RETENTION_MAX_RECORDS=None,
+            ANALYSIS_REPORT_PREBUILD=False,
+            # One client has nothing to group; inline writes keep their queries counted
+            ANALYSIS_WRITER_QUEUE=False,
+        ).enable()
+        setup_test_environment()
+        # A file database, so the background pruner thread can share it
+        connection.settings_dict['TEST']['NAME'] = os.path.join(tmp, 'bench.sqlite3')
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+        from django.contrib.auth.models import User
+        from authentication.models import Profile
+        self.user = User.objects.create_user('bench@example.com', 'bench@example.com', 'bench')
+        Profile.objects.create(user=self.user, role='bench', company='bench')
+        token = Token.objects.create(user=self.user)
+        self.client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        # Load every module the views touch before anything is measured
+        self.record_id = self.upload(warm_up_csv).json()['id']
+        self.client.get('/record/')
+        self.client.get(f'/download/{self.record_id}/')
+
+    def upload(self, path):
+        with open(path, 'rb') as f:
+            response = self.client.post('/upload/', {'file': f})
+        _check(response)
+        return response
+
+    def seed_history(self, records):
+        """Grow the user's history to ``records`` copies of the warm-up analysis."""
+        from analysis.history import create_records
+        from analysis.models import Record
+        record = Record.objects.get(pk=self.record_id)
+        missing = records - Record.objects.filter(user=self.user).count()
+        if missing > 0:
+            create_records(self.user, [(record.data, record.state)] * missing)
+        self.record_id = Record.objects.filter(user=self.user).latest('created_at', 'id').id
+
+
+def _check(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"{response.status_code}: {response.content[:200]!r}")
+    if response.streaming:
+        # Draining the body is part of the request for streamed responses
+        for _ in response.streaming_content:
+            pass
+    return response
+
+
+# Each case builds (prepare, run): prepare() resets the state before a
+# repeat and is not timed; run() issues the measured request.
+
+def _upload(bench, csv_path):
+    return (lambda: None), (lambda: bench.upload(csv_path))
+
+
+def _history_miss(bench, csv_path):
+    from analysis import historycache
+    return (lambda: historycache.invalidate(bench.user.id)), (lambda: _check(bench.client.get('/record/')))
+
+
+def _history_hit(bench, csv_path):
+    return (lambda: bench.client.get('/record/')), (lambda: _check(bench.client.get('/record/')))
+
+
+def _history_not_modified(bench, csv_path):
+    etag = bench.client.get('/record/')['ETag']
+    return (lambda: None), (lambda: _check(bench.client.get('/record/', HTTP_IF_NONE_MATCH=etag)))
+
+
+def _report_cold(bench, csv_path):
+    from analysis import reports
+    return ((lambda: reports.discard(bench.record_id)),
+            (lambda: _check(bench.client.get(f'/download/{bench.record_id}/'))))
+
+
+def _report_warm(bench, csv_path):
+    url = f'/download/{bench.record_id}/'
+    return (lambda: bench.client.get(url)), (lambda: _check(bench.client.get(url)))
+
+
+def _archive_warm(bench, csv_path):
+    from analysis import reports
+    from analysis.models import Record
+
+    def prepare():
+        for record in Record.objects.filter(user=bench.user):
+            reports.report_file(record, bench.user.email)
+
+    return prepare, (lambda: _check(bench.client.get('/download/all/')))
+
+
+# name -> (factory, scales with --sizes)
+CASES = {
+    'upload': (_upload, True),
+    'history_miss': (_history_miss, False),
+    'history_hit': (_history_hit, False),
+    'history_304': (_history_not_modified, False),
+    'report_cold': (_report_cold, False),
+    'report_warm': (_report_warm, False),
+    'download_all_warm': (_archive_warm, False),
+}
+
+
+def _run_case(name, csv_path, warm_up_csv, repeat, history):
+    _setup_django()
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bench = Bench(tmp, warm_up_csv)
+        factory, scales = CASES[name]
+        if not scales:
+            bench.seed_history(history)
+        prepare, run = factory(bench, csv_path)
+
+        best, peak, queries = None, 0.0, 0
+        for _ in range(repeat):
+            prepare()
+            before = reset_peak_rss()
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                run()
+                elapsed = time.perf_counter() - start
+            peak = max(peak, (peak_rss() - before) / 1024)
+            queries = len(captured)
+            best = elapsed if best is None else min(best, elapsed)
+        # Not destroy_test_db(): that points the settings back at the real
+        # database while the pruner thread may still run. The file goes with tmp.
+        connection.close()
+    return {'seconds': best, 'peak_mib': peak, 'queries': queries}
+
+
+def measure(name, csv_path, warm_up_csv, repeat, history):
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+        return pool.submit(_run_case, name, csv_path, warm_up_csv, repeat, history).result()
+
+
+def compare(baseline, results, threshold):
+    """Print current against baseline results; returns the keys that regressed."""
+    regressions = []
+    print(f"{'case':<26}{'base s':>10}{'now s':>10}{'ratio':>8}{'base MiB':>10}{'now MiB':>10}"
+          f"{'base q':>8}{'now q':>8}")
+    for key, now in results.items():
+        base = baseline.get(key)
+        if base is None:
+            print(f"{key:<26}{'-':>10}{now['seconds']:>10.4f}{'new':>8}")
+            continue
+        ratio = now['seconds'] / base['seconds'] if base['seconds'] else float('inf')
+        reasons = []
+        if ratio > 1 + threshold and now['seconds'] - base['seconds'] > MIN_SECONDS_DELTA:
+            reasons.append('time')
+        if (now['peak_mib'] - base['peak_mib'] > MIN_RSS_DELTA_MIB
+                and now['peak_mib'] > base['peak_mib'] * (1 + threshold)):
+            reasons.append('memory')
+        if now['queries'] > base['queries']:
+            reasons.append('queries')
+        flag = f"  REGRESSION ({', '.join(reasons)})" if reasons else ''
+        print(f"{key:<26}{base['seconds']:>10.4f}{now['seconds']:>10.4f}{ratio:>7.2f}x"
+              f"{base['peak_mib']:>10.1f}{now['peak_mib']:>10.1f}{base['queries']:>8}{now['queries']:>8}{flag}")
+        if reasons:
+            regressions.append(key)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help=f'comma separated CSV row counts for the upload cases (default {DEFAULT_SIZES})')
+    parser.add_argument('--cases', default=','.join(CASES), help='comma separated subset of the cases')
+    parser.add_argument('--history', type=int, default=50, help='records in the history for the non-upload cases')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write the results to this JSON file (e.g. a new baseline)')
+    parser.add_argument('--compare', help='baseline JSON file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed relative slowdown / memory growth before flagging (default 0.2)')
+    args = parser.parse_args(argv)
+
+    sizes = [int(float(size)) for size in args.sizes.split(',')]
+    names = args.cases.split(',')
+    unknown = [name for name in names if name not in CASES]
+    if unknown:
+        parser.error(f"unknown case(s): {', '.join(unknown)}")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        warm_up_csv = write_equipment_csv(os.path.join(tmp, 'warm-up.csv'), WARM_UP_ROWS, seed=1)
+        for name in names:
+            _, scales = CASES[name]
+            for rows in (sizes if scales else [None]):
+                key = f'{name}/{rows}' if scales else name
+                csv_path = None
+                if scales:
+                    csv_path = os.path.join(tmp, f'{rows}.csv')
+                    if not os.path.exists(csv_path):
+                        write_equipment_csv(csv_path, rows)
+                results[key] = measure(name, csv_path, warm_up_csv, args.repeat, args.history)
+                print(f"{key:<26}{results[key]['seconds']:>10.4f} s{results[key]['peak_mib']:>9.1f} MiB"
+                      f"{results[key]['queries']:>5} queries", flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'repeat': args.repeat,
+                'history': args.history,
+                'results': results,
+            }, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        print()
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,29 @@
+"""Synthetic equipment CSVs shaped like the plant exports the app ingests."""
+import numpy as np
+import pandas as pd
+
+HEADER = ['Equipment Name', 'Type', 'Flowrate', 'Pressure', 'Temperature']
+TYPES = np.array(['Pump', 'Compressor', 'Valve', 'HeatExchanger', 'Reactor', 'Condenser'])
+
+
+def equipment_frame(rows, seed=0, offset=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Equipment Name': [f'EQ-{i}' for i in range(offset, offset + rows)],
+        'Type': TYPES[rng.integers(0, len(TYPES), rows)],
+        'Flowrate': rng.normal(120, 35, rows).round(2),
+        'Pressure': rng.normal(6.5, 1.8, rows).round(2),
+        'Temperature': rng.normal(110, 40, rows).round(1),
+    }, columns=HEADER)
+
+
+def write_equipment_csv(path, rows, seed=0, block_rows=500_000):
+    """Write ``rows`` synthetic rows to ``path`` in blocks so any size fits in memory."""
+    with open(path, 'w', newline='') as f:
+        f.write(','.join(HEADER) + '\n')
+        written = 0
+        while written < rows:
+            size = min(block_rows, rows - written)
+            equipment_frame(size, seed + written, written).to_csv(f, header=False, index=False)
+            written += size
+    return path
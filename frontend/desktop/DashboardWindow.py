@@ -9,7 +9,7 @@ from PyQt5.QtGui import QIcon
 import qtawesome as qta
 from StyleSheetManager import * 
 from Thread import APIWorker
-import AnalysisResultWidget,HistoryCard,DownloadWorker,LoginWindow
+import AnalysisResultWidget,HistoryCard,DownloadWorker,LoginWindow,UploadWorker
 
 class DashboardWindow(QMainWindow):
     def __init__(self, theme='dark'):
@@ -46,36 +46,33 @@ class DashboardWindow(QMainWindow):
         self.workspace_layout.insertWidget(0, self.upload_card)
     
     def upload_csv(self, file_path):
-        url = "http://127.0.0.1:8000/upload/"
-
         if not hasattr(self, 'token') or not self.token:
             QMessageBox.critical(self, "Error", "You must be logged in to upload files.")
             return
 
-        headers = { "Authorization": f"Token {self.token}" }
-
-        try:
-            with open(file_path, 'rb') as f:
-                files = {'file': f}
-                print(f"Uploading {file_path} to {url}...")
-                response = requests.post(url, headers=headers, files=files)
-
-            if response.status_code == 200:
-                print("Upload Success")
-                QMessageBox.information(self, "Success", "File uploaded and analyzed successfully!")
-                self.display_results(response.json())
-            else:
-                try:
-                    error_msg = response.json().get('error', 'Unknown Error')
-                except:
-                    error_msg = f"Error {response.status_code}"
-                print(f"Upload Failed: {error_msg}")
-                QMessageBox.warning(self, "Upload Failed", str(error_msg))
-
-        except requests.exceptions.ConnectionError:
-            QMessageBox.critical(self, "Connection Error", "Could not connect to the server. Is Django running?")
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"An unexpected error occurred: {str(e)}")
+        # Runs off the UI thread; the server streams the analysis progress
+        print(f"Uploading {file_path}...")
+        self.upload_worker = UploadWorker.UploadWorker("http://127.0.0.1:8000", self.token, file_path)
+        self.upload_worker.progress.connect(self.uc_text.setText)
+        self.upload_worker.success.connect(self.on_upload_success)
+        self.upload_worker.error.connect(self.on_upload_error)
+        self.upload_worker.start()
+        self.uc_btn.setEnabled(False)
+
+    def on_upload_success(self, data):
+        print("Upload Success")
+        self.reset_upload_card()
+        QMessageBox.information(self, "Success", "File uploaded and analyzed successfully!")
+        self.display_results(data)
+
+    def on_upload_error(self, error_msg):
+        print(f"Upload Failed: {error_msg}")
+        self.reset_upload_card()
+        QMessageBox.warning(self, "Upload Failed", str(error_msg))
+
+    def reset_upload_card(self):
+        self.uc_text.setText("Drag and drop your CSV file here")
+        self.uc_btn.setEnabled(True)
     
     def open_file_dialog(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "Select CSV File", "", "CSV Files (*.csv)")
@@ -207,19 +204,19 @@ class DashboardWindow(QMainWindow):
         cloud_icon.setPixmap(qta.icon('fa5s.cloud-upload-alt', color=THEMES[self.current_theme]['accent']).pixmap(64, 64))
         cloud_icon.setAlignment(Qt.AlignCenter)
         
-        uc_text = QLabel("Drag and drop your CSV file here")
-        uc_text.setAlignment(Qt.AlignCenter)
-        uc_text.setStyleSheet("color: #94a3b8; font-size: 16px; margin-top: 10px;")
+        self.uc_text = QLabel("Drag and drop your CSV file here")
+        self.uc_text.setAlignment(Qt.AlignCenter)
+        self.uc_text.setStyleSheet("color: #94a3b8; font-size: 16px; margin-top: 10px;")
 
-        uc_btn = QPushButton("Select File")
-        uc_btn.setObjectName("PrimaryBtn")
-        uc_btn.setFixedWidth(150)
-        uc_btn.setCursor(Qt.PointingHandCursor)
-        uc_btn.clicked.connect(self.open_file_dialog)
+        self.uc_btn = QPushButton("Select File")
+        self.uc_btn.setObjectName("PrimaryBtn")
+        self.uc_btn.setFixedWidth(150)
+        self.uc_btn.setCursor(Qt.PointingHandCursor)
+        self.uc_btn.clicked.connect(self.open_file_dialog)
 
         uc_layout.addWidget(cloud_icon)
-        uc_layout.addWidget(uc_text)
-        uc_layout.addWidget(uc_btn, 0, Qt.AlignCenter)
+        uc_layout.addWidget(self.uc_text)
+        uc_layout.addWidget(self.uc_btn, 0, Qt.AlignCenter)
 
         self.workspace_layout.addWidget(self.upload_card)
         self.workspace_layout.addStretch()
@@ -233,13 +230,21 @@ class DashboardWindow(QMainWindow):
         
         if not hasattr(self, 'token'): return
 
+        headers = {"Authorization": f"Token {self.token}"}
+        # Revalidate the copy we already have; the server answers 304 if nothing changed
+        if getattr(self, 'history_etag', None):
+            headers["If-None-Match"] = self.history_etag
+
         try:
-            response = requests.get(url, headers={"Authorization": f"Token {self.token}"})
+            response = requests.get(url, headers=headers)
             
-            if response.status_code == 200:
-                response_data = response.json()
+            if response.status_code in (200, 304):
+                if response.status_code == 200:
+                    response_data = response.json()
+                    self.history_records = response_data.get('resultData', [])
+                    self.history_etag = response.headers.get('ETag')
 
-                records = response_data.get('resultData', [])
+                records = self.history_records
                 
                 if not records:
                     self.history_grid.addWidget(QLabel("No history found."), 0, 0)
@@ -293,8 +298,19 @@ class DashboardWindow(QMainWindow):
         refresh_btn.setStyleSheet("background: transparent; border: none; text-align: right; padding: 10px;")
         refresh_btn.setCursor(Qt.PointingHandCursor)
         refresh_btn.clicked.connect(self.fetch_history)
+
+        download_all_btn = QPushButton(" Download All")
+        download_all_btn.setIcon(qta.icon('fa5s.file-archive', color=THEMES[self.current_theme]['text_secondary']))
+        download_all_btn.setStyleSheet("background: transparent; border: none; text-align: right; padding: 10px;")
+        download_all_btn.setCursor(Qt.PointingHandCursor)
+        download_all_btn.clicked.connect(self.handle_download_all)
+
+        toolbar = QHBoxLayout()
+        toolbar.addStretch()
+        toolbar.addWidget(download_all_btn)
+        toolbar.addWidget(refresh_btn)
         
-        page_layout.insertWidget(0, refresh_btn, 0, Qt.AlignRight)
+        page_layout.insertLayout(0, toolbar)
         return page
     
     def handle_pdf_download(self, data, chart_obj):
@@ -303,20 +319,37 @@ class DashboardWindow(QMainWindow):
         
         if not file_path: return
 
-        chart_b64 = chart_obj.get_image_base64()
-        payload = {
-            "chartImage": chart_b64,
-            "stats": data.get('averages', {}),
-            "created_at": data.get('created_at', '')
-        }
-
-        url = "http://127.0.0.1:8000/download/" 
+        if data.get('id') is not None:
+            # The server renders the chart itself from the saved record
+            url = f"http://127.0.0.1:8000/download/{data['id']}/?theme={self.current_theme}"
+            payload = None
+        else:
+            chart_b64 = chart_obj.get_image_base64()
+            payload = {
+                "chartImage": chart_b64,
+                "stats": data.get('averages', {}),
+                "created_at": data.get('created_at', '')
+            }
+            url = "http://127.0.0.1:8000/download/" 
         
         self.dl_worker = DownloadWorker.DownloadWorker(url, self.token, payload, file_path)
         self.dl_worker.finished.connect(self.on_download_finished)
         self.dl_worker.start()
         QApplication.setOverrideCursor(Qt.WaitCursor)
 
+    def handle_download_all(self):
+        file_path, _ = QFileDialog.getSaveFileName(self, "Save Reports", "reports.zip", "ZIP Files (*.zip)")
+
+        if not file_path: return
+
+        # Every saved report in one ZIP, streamed by the server as they are built
+        url = f"http://127.0.0.1:8000/download/all/?theme={self.current_theme}"
+
+        self.dl_worker = DownloadWorker.DownloadWorker(url, self.token, None, file_path)
+        self.dl_worker.finished.connect(self.on_download_finished)
+        self.dl_worker.start()
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+
     def on_download_finished(self, success, message):
         QApplication.restoreOverrideCursor()
         if success:
@@ -21,12 +21,17 @@ class DownloadWorker(QThread):
                 "Authorization": f"Token {self.token}",
                 "Content-Type": "application/json"
             }
-            response = requests.post(self.url, json=self.payload, headers=headers)
+            if self.payload is None:
+                response = requests.get(self.url, headers=headers, stream=True)
+            else:
+                response = requests.post(self.url, json=self.payload, headers=headers, stream=True)
 
             if response.status_code == 200:
+                # Written as it arrives; a ZIP of every report can be large
                 with open(self.save_path, 'wb') as f:
-                    f.write(response.content)
-                self.finished.emit(True, "PDF Downloaded Successfully!")
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+                self.finished.emit(True, "Downloaded Successfully!")
             else:
                 self.finished.emit(False, f"Server Error: {response.status_code}")
         except Exception as e:
@@ -0,0 +1,62 @@
+import json
+import requests
+from PyQt5.QtCore import QThread, pyqtSignal
+
+STAGES = {'parse': "Parsing", 'save': "Saving"}
+
+class UploadWorker(QThread):
+    progress = pyqtSignal(str)
+    success = pyqtSignal(dict)
+    error = pyqtSignal(str)
+
+    def __init__(self, base_url, token, file_path):
+        super().__init__()
+        self.base_url = base_url
+        self.token = token
+        self.file_path = file_path
+
+    def run(self):
+        headers = {"Authorization": f"Token {self.token}"}
+        try:
+            # Queued as a job where the server can stream its progress (ASGI),
+            # analysed right away otherwise
+            self.progress.emit("Uploading...")
+            with open(self.file_path, 'rb') as f:
+                response = requests.post(f"{self.base_url}/upload/?async=auto", headers=headers, files={'file': f})
+            if response.status_code == 200:
+                self.success.emit(response.json())
+                return
+            if response.status_code != 202:
+                try:
+                    self.error.emit(response.json().get('error', 'Unknown Error'))
+                except ValueError:
+                    self.error.emit(f"Error {response.status_code}")
+                return
+
+            job_id = response.json()['id']
+            self.progress.emit("Queued")
+            events = requests.get(f"{self.base_url}/jobs/{job_id}/events/", headers=headers, stream=True)
+            event = None
+            for line in events.iter_lines(decode_unicode=True):
+                if line.startswith('event: '):
+                    event = line[7:]
+                elif line.startswith('data: '):
+                    data = json.loads(line[6:])
+                    if event == 'progress':
+                        stage = STAGES.get(data['stage']) or ("Queued" if data['status'] == 'queued' else "Analysing")
+                        self.progress.emit(f"{stage}... {data['progress']:.0%} ({data['rows_processed']} rows)")
+                    elif event == 'done':
+                        self.success.emit(data)
+                        return
+                    elif event == 'failed':
+                        self.error.emit(data.get('error') or "Analysis failed")
+                        return
+            self.error.emit("The server closed the progress stream")
+
+        except requests.exceptions.ConnectionError:
+            self.error.emit("Could not connect to the server. Is Django running?")
+        except Exception as e:
+            self.error.emit(str(e))
+
+if __name__ == "__main__":
+    print("Error: Run Main.py to start the application!")
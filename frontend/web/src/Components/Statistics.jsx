@@ -9,33 +9,44 @@ import {
   BarElement 
 } from 'chart.js';
 import { Bar } from 'react-chartjs-2';
-import { useRef } from 'react';
+import { useContext, useRef } from 'react';
 import html2canvas from 'html2canvas';
+import { AppContext } from '../AppContext';
 
 const Statistcs = ({stats,chartData}) => {
     ChartJS.register(ArcElement, Tooltip, Legend, CategoryScale, LinearScale, BarElement);
 
     const printRef = useRef();
+    const { theme } = useContext(AppContext);
 
     const handleDownload = async () => {
         if (!printRef.current) return;
 
         try {
-        const canvas = await html2canvas(printRef.current);
-        const imageBase64 = canvas.toDataURL("image/png");
         const token = localStorage.getItem('userToken');
-        const response = await fetch('http://127.0.0.1:8000/download/', {
-            method: 'POST',
-            headers: {
-            'Content-Type': 'application/json',
-            'Authorization': `Token ${token}`
-            },
-            body: JSON.stringify({
+        let response;
+        if (stats.id !== undefined) {
+            // Saved records are rendered on the server; only the id is sent
+            response = await fetch(`http://127.0.0.1:8000/download/${stats.id}/?theme=${theme}`, {
+            headers: { 'Authorization': `Token ${token}` }
+            });
+        } else {
+            const canvas = await html2canvas(printRef.current);
+            const imageBase64 = canvas.toDataURL("image/png");
+            const payload = {
             chartImage: imageBase64,
             stats: stats,
             created_at: stats.created_at
-            })
-        });
+            };
+            response = await fetch('http://127.0.0.1:8000/download/', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Authorization': `Token ${token}`
+            },
+            body: JSON.stringify(payload)
+            });
+        }
 
         if (response.ok) {
             const blob = await response.blob();
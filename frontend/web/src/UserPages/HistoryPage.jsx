@@ -1,12 +1,14 @@
-import { useEffect, useState } from 'react';
+import { useContext, useEffect, useState } from 'react';
 import styles from './Dashboard.module.css';
 import Statistics from '../Components/Statistics';
+import { AppContext } from '../AppContext';
 
 const HistoryPage = ({ title, icon }) => {
   const token = localStorage.getItem('userToken')
 
   const[info,setInfo]=useState(null)
-  
+  const { theme } = useContext(AppContext);
+
   useEffect(() => {
       fetch('http://127.0.0.1:8000/record/',{headers:{'Authorization': `Token ${token}`}})
       .then(response => response.json())
@@ -14,8 +16,36 @@ const HistoryPage = ({ title, icon }) => {
       .catch(err => console.log(err))
   },[])
 
+  // Every report in one ZIP, streamed by the server as they are built
+  const handleDownloadAll = async () => {
+    try {
+      const response = await fetch(`http://127.0.0.1:8000/download/all/?theme=${theme}`, {
+        headers: { 'Authorization': `Token ${token}` }
+      });
+      if (!response.ok) {
+        alert("Download failed!");
+        return;
+      }
+      const blob = await response.blob();
+      const url = window.URL.createObjectURL(blob);
+      const a = document.createElement('a');
+      a.href = url;
+      a.download = 'reports.zip';
+      document.body.appendChild(a);
+      a.click();
+      a.remove();
+    } catch (error) {
+      console.error("ZIP Error:", error);
+    }
+  };
+
   return(
     <div className={styles.container} style={{display:"flex",flexWrap:"wrap",justifyContent:"center",gap:"250px"}}>
+      {info && info.length > 0 && (
+        <div style={{width:"100%",display:"flex",justifyContent:"flex-end"}}>
+          <button onClick={handleDownloadAll} className={styles.downloadBtn}>Download All</button>
+        </div>
+      )}
       {info && info.map((record, index) => {
         const formattedChartData = {
           labels: record.distribution.labels,
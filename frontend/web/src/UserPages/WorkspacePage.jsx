@@ -6,6 +6,30 @@ import {
 } from 'lucide-react';
 import Statistics from "../Components/Statistics"
 
+// Reads a text/event-stream body (EventSource can't send the token header)
+const readEvents = async (response, onEvent) => {
+  const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) return;
+    buffer += value;
+    let end;
+    while ((end = buffer.indexOf('\n\n')) !== -1) {
+      const message = buffer.slice(0, end);
+      buffer = buffer.slice(end + 2);
+      let event = 'message', data = '';
+      for (const line of message.split('\n')) {
+        if (line.startsWith('event: ')) event = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+      }
+      if (data && onEvent(event, JSON.parse(data)) === false) return;
+    }
+  }
+};
+
+const STAGES = { parse: 'Parsing', save: 'Saving' };
+
 const WorkspacePage = () => {
 
   const token = localStorage.getItem('userToken')
@@ -17,6 +41,53 @@ const WorkspacePage = () => {
 
   const [stats, setStats] = useState({total_count:0,averages:{pressure:0,temperature:0}});
   const [chartData, setChartData] = useState(null);
+  const [progress, setProgress] = useState(null);
+
+  const followJob = async (jobId) => {
+    setProgress('Queued');
+    const response = await fetch(`http://127.0.0.1:8000/jobs/${jobId}/events/`, {
+      headers: { "Authorization": `Token ${token}` }
+    });
+    let result = null;
+    await readEvents(response, (event, data) => {
+      if (event === 'progress') {
+        const stage = STAGES[data.stage] || (data.status === 'queued' ? 'Queued' : 'Analysing');
+        setProgress(`${stage}… ${Math.round(data.progress * 100)}% (${data.rows_processed} rows)`);
+      } else if (event === 'done') {
+        result = data;
+        return false;
+      } else if (event === 'failed') {
+        alert(data.error || "Analysis failed!");
+        return false;
+      }
+    });
+    return result;
+  };
+
+  const showResult = (data) => {
+    setStats(data);
+    setChartData({
+      labels: data.distribution.labels,
+      datasets: [
+        {
+          label: 'Equipment Count',
+          data: data.distribution.values,
+          backgroundColor: [
+            'rgba(56, 189, 248, 0.6)',
+            'rgba(129, 140, 248, 0.6)',
+            'rgba(244, 114, 182, 0.6)',
+          ],
+          borderColor: [
+            'rgba(56, 189, 248, 1)',
+            'rgba(129, 140, 248, 1)',
+            'rgba(244, 114, 182, 1)',
+          ],
+          borderWidth: 1,
+          barThickness:50
+        },
+      ],
+    });
+  };
 
   const handleFileChange = async (event) => {
     const file = event.target.files[0];
@@ -32,45 +103,33 @@ const WorkspacePage = () => {
     const formData = new FormData();
     formData.append('file', file);
 
+    setProgress('Uploading…');
     try {
-      const response = await fetch('http://127.0.0.1:8000/upload/', {
+      // Queued as a job where the server can stream its progress (ASGI),
+      // analysed right away otherwise
+      const response = await fetch('http://127.0.0.1:8000/upload/?async=auto', {
         method: 'POST',
         headers:{
           "Authorization":`Token ${token}`
         },
         body: formData,
       });
-      
-      const data = await response.json();
-      
-      if (response.ok) {
-        setStats(data);
-        setChartData({
-          labels: data.distribution.labels,
-          datasets: [
-            {
-              label: 'Equipment Count',
-              data: data.distribution.values,
-              backgroundColor: [
-                'rgba(56, 189, 248, 0.6)',
-                'rgba(129, 140, 248, 0.6)',
-                'rgba(244, 114, 182, 0.6)',
-              ],
-              borderColor: [
-                'rgba(56, 189, 248, 1)',
-                'rgba(129, 140, 248, 1)',
-                'rgba(244, 114, 182, 1)',
-              ],
-              borderWidth: 1,
-              barThickness:50
-            },
-          ],
-        });
+
+      const body = await response.json();
+      if (!response.ok) {
+        alert(body.error || "Upload failed!");
+        return;
       }
+      // 202: a job that is already done (same file as before) answers right away
+      const data = response.status === 202 ? await followJob(body.id) : body;
+      if (data) showResult(data);
     } 
     catch (error) {
       console.error("Upload failed", error);
     }
+    finally {
+      setProgress(null);
+    }
   };
 
 
@@ -82,7 +141,7 @@ const WorkspacePage = () => {
           <UploadCloud size={32} />
         </div>
         <h3>Upload Equipment Data</h3>
-        <p>Drag and drop your CSV file here to begin analysis</p>
+        <p>{progress || 'Drag and drop your CSV file here to begin analysis'}</p>
         
         <input 
           type="file" 